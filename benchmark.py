@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# plantagenet - a python blogging system
+# Copyright (C) 2016-2017 izrik
+#
+# This file is a part of plantagenet.
+#
+# Plantagenet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Plantagenet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with plantagenet.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+from flask import url_for
+from sqlalchemy import event
+
+import plantagenet
+from plantagenet import create_app, db, Page, Post, Tag
+
+
+def summarize_timings(timings):
+    timings = sorted(timings)
+    return {
+        'mean_ms': statistics.mean(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[int(0.95 * (len(timings) - 1))] * 1000,
+        'min_ms': timings[0] * 1000,
+    }
+
+
+def sample_url_args():
+    post = db.session.execute(
+        db.select(Post).filter_by(is_draft=False)
+        .order_by(Post.date.desc())).scalar()
+    page = db.session.execute(db.select(Page)).scalar()
+    tag = db.session.execute(db.select(Tag)).scalar()
+    return {
+        'post_slug': post.slug,
+        'page_slug': page.slug,
+        'tag_id': tag.id,
+        'year': post.date.year,
+        'month': post.date.month,
+    }
+
+
+def url_args_for(rule, samples):
+    values = {}
+    for arg in rule.arguments:
+        if arg == 'slug':
+            if 'page' in rule.endpoint:
+                values[arg] = samples['page_slug']
+            else:
+                values[arg] = samples['post_slug']
+        elif arg in samples:
+            values[arg] = samples[arg]
+        else:
+            return None
+    return values
+
+
+def bench_routes(app, samples, repeat):
+    """Time every GET route. This must be called without an app context,
+    so that each request gets its own."""
+    queries = []
+
+    def count_query(*args, **kwargs):
+        queries.append(1)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'after_cursor_execute', count_query)
+    try:
+        results = {}
+        for rule in app.url_map.iter_rules():
+            if ('GET' not in rule.methods or
+                    rule.endpoint in ('static', 'logout')):
+                continue
+            values = url_args_for(rule, samples)
+            if values is None:
+                continue
+            with app.test_request_context():
+                url = url_for(rule.endpoint, **values)
+            client = app.test_client()
+            authenticated = False
+            if client.get(url).status_code == 401:
+                authenticated = True
+                with client.session_transaction() as sess:
+                    sess['_user_id'] = 'admin'
+                    sess['_fresh'] = True
+            timings = []
+            query_counts = []
+            status = None
+            for _ in range(repeat):
+                del queries[:]
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - start)
+                query_counts.append(len(queries))
+                status = response.status_code
+            result = summarize_timings(timings)
+            result.update({
+                'url': url,
+                'status': status,
+                'authenticated': authenticated,
+                'queries': max(query_counts),
+            })
+            results[rule.endpoint] = result
+        return results
+    finally:
+        event.remove(engine, 'after_cursor_execute', count_query)
+
+
+def bench_function(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return summarize_timings(timings)
+
+
+def bench_functions(repeat):
+    rnd = random.Random(1)
+    small = plantagenet.generate_markdown(rnd, 3)
+    large = plantagenet.generate_markdown(rnd, 2000)
+    tag_string = ','.join('tag{}'.format(i) for i in range(10))
+    return {
+        'summarize_small': bench_function(
+            lambda: Post.summarize(small), repeat),
+        'summarize_large': bench_function(
+            lambda: Post.summarize(large), repeat),
+        'render_gfm_small': bench_function(
+            lambda: plantagenet.render_gfm(small), repeat),
+        'render_gfm_large': bench_function(
+            lambda: plantagenet.render_gfm(large), repeat),
+        'tags_from_string': bench_function(
+            lambda: Post.tags_from_string(tag_string), repeat),
+    }
+
+
+def run_benchmark(db_uri, scale, repeat):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': db_uri})
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        plantagenet.run_migrations(db.engine)
+        start = time.perf_counter()
+        plantagenet.generate_posts(scale, num_pages=20, seed=0)
+        seed_time = time.perf_counter() - start
+        samples = sample_url_args()
+    try:
+        routes = bench_routes(app, samples, repeat)
+        with app.app_context():
+            functions = bench_functions(repeat)
+            return {
+                'backend': db.engine.dialect.name,
+                'scale': scale,
+                'seed_seconds': seed_time,
+                'routes': routes,
+                'functions': functions,
+            }
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.engine.dispose()
+
+
+def compare(old, new):
+    """Print the ratio of new to old median latencies."""
+    old_index = {(r['backend'], r['scale']): r for r in old['results']}
+    for result in new['results']:
+        key = (result['backend'], result['scale'])
+        if key not in old_index:
+            continue
+        print('{} @ {}:'.format(*key))
+        for group in ('routes', 'functions'):
+            for name, new_stats in sorted(result[group].items()):
+                old_stats = old_index[key][group].get(name)
+                if not old_stats or not old_stats['median_ms']:
+                    continue
+                ratio = new_stats['median_ms'] / old_stats['median_ms']
+                print('  {:<24} {:>9.2f} ms -> {:>9.2f} ms  x{:.2f}'.format(
+                    name, old_stats['median_ms'], new_stats['median_ms'],
+                    ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Measure the latency and query count of every route, '
+                    'and of a few hot functions, against synthetic '
+                    'databases of several sizes.')
+    parser.add_argument('--scales', type=str, default='1000,10000,100000',
+                        help='Comma-separated list of post counts.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of timed runs per route or function.')
+    parser.add_argument('--sqlite-path', type=str, default=None,
+                        help='Path of the SQLite database file to use. '
+                             'Defaults to a temporary file.')
+    parser.add_argument('--no-sqlite', action='store_true')
+    parser.add_argument('--postgres-uri', type=str,
+                        default=os.environ.get('PLANTAGENET_BENCH_PG_URI'),
+                        help='URI of a scratch Postgres database. All of its '
+                             'plantagenet tables will be dropped.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--compare', type=str, default=None,
+                        metavar='JSON_FILE',
+                        help='Compare the results to a previous run.')
+    args = parser.parse_args(argv)
+
+    uris = []
+    tmpdir = None
+    if not args.no_sqlite:
+        path = args.sqlite_path
+        if path is None:
+            tmpdir = tempfile.TemporaryDirectory()
+            path = os.path.join(tmpdir.name, 'bench.sqlite')
+        uris.append('sqlite:///' + os.path.abspath(path))
+    if args.postgres_uri:
+        uris.append(args.postgres_uri)
+
+    results = []
+    for uri in uris:
+        for scale in (int(s) for s in args.scales.split(',')):
+            result = run_benchmark(uri, scale, args.repeat)
+            print('{} @ {} posts (seeded in {:.1f}s)'.format(
+                result['backend'], scale, result['seed_seconds']))
+            for name, stats in sorted(result['routes'].items()):
+                print('  {:<24} {:>9.2f} ms  {:>3} queries'.format(
+                    name, stats['median_ms'], stats['queries']))
+            for name, stats in sorted(result['functions'].items()):
+                print('  {:<24} {:>9.3f} ms'.format(
+                    name, stats['median_ms']))
+            results.append(result)
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    report = {
+        'revision': plantagenet.__revision__,
+        'version': plantagenet.__version__,
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
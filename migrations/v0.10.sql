@@ -0,0 +1,11 @@
+-- Store the table of contents and word count of each post, and the
+-- rendered html, table of contents and word count of each page
+ALTER TABLE post ADD COLUMN toc JSON;
+
+ALTER TABLE post ADD COLUMN word_count INTEGER;
+
+ALTER TABLE page ADD COLUMN content_html TEXT;
+
+ALTER TABLE page ADD COLUMN toc JSON;
+
+ALTER TABLE page ADD COLUMN word_count INTEGER
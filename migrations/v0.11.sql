@@ -0,0 +1,15 @@
+-- Add draft_buffer table for autosaved changes to posts
+CREATE TABLE IF NOT EXISTS draft_buffer (
+    id INTEGER NOT NULL PRIMARY KEY,
+    post_id INTEGER NOT NULL REFERENCES post (id),
+    revision INTEGER NOT NULL,
+    title VARCHAR(100),
+    content TEXT,
+    notes TEXT,
+    tags TEXT,
+    is_draft BOOLEAN NOT NULL,
+    updated_date TIMESTAMP NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_draft_buffer_post_id
+ON draft_buffer (post_id)
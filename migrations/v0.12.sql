@@ -0,0 +1,18 @@
+-- Add revision table for the history of posts and pages
+CREATE TABLE IF NOT EXISTS revision (
+    id INTEGER NOT NULL PRIMARY KEY,
+    post_id INTEGER REFERENCES post (id),
+    page_id INTEGER REFERENCES page (id),
+    number INTEGER NOT NULL,
+    base INTEGER,
+    title VARCHAR(100),
+    length INTEGER NOT NULL,
+    date TIMESTAMP NOT NULL,
+    data TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_revision_post_id_number
+ON revision (post_id, number);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_revision_page_id_number
+ON revision (page_id, number)
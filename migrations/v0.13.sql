@@ -0,0 +1,12 @@
+-- Add media table for uploaded files, stored by content hash
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER NOT NULL PRIMARY KEY,
+    sha256 VARCHAR(64) NOT NULL UNIQUE,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    upload_date TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_media_upload_date_id
+ON media (upload_date, id)
@@ -0,0 +1,16 @@
+-- Add job table for the queue of work done after a request
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER NOT NULL PRIMARY KEY,
+    command VARCHAR(100) NOT NULL,
+    args JSON NOT NULL,
+    dedup_key VARCHAR(64) UNIQUE,
+    status VARCHAR(10) NOT NULL,
+    attempts INTEGER NOT NULL,
+    run_after TIMESTAMP NOT NULL,
+    created_date TIMESTAMP NOT NULL,
+    started_date TIMESTAMP,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS ix_job_status_run_after
+ON job (status, run_after)
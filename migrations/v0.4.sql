@@ -0,0 +1,2 @@
+-- Index post.date for ordering, archive grouping and next/prev lookups
+CREATE INDEX IF NOT EXISTS ix_post_date ON post (date)
@@ -0,0 +1,13 @@
+-- Add profile table for on-demand request profiles
+CREATE TABLE IF NOT EXISTS profile (
+    id INTEGER NOT NULL PRIMARY KEY,
+    date TIMESTAMP NOT NULL,
+    method VARCHAR(10) NOT NULL,
+    url TEXT NOT NULL,
+    endpoint VARCHAR(100),
+    duration FLOAT NOT NULL,
+    report TEXT NOT NULL,
+    stats TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_profile_date ON profile (date)
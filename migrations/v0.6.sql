@@ -0,0 +1,2 @@
+-- Store the rendered html of each post's content
+ALTER TABLE post ADD COLUMN content_html TEXT
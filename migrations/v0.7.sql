@@ -0,0 +1,19 @@
+-- Rebuild tags_posts without duplicate or partial rows, with a composite
+-- primary key on (tag_id, post_id) and a covering index in the other
+-- direction, so that joins from either side only need to read an index
+CREATE TABLE tags_posts_new (
+    tag_id INTEGER NOT NULL REFERENCES tag (id),
+    post_id INTEGER NOT NULL REFERENCES post (id),
+    PRIMARY KEY (tag_id, post_id)
+);
+
+INSERT INTO tags_posts_new (tag_id, post_id)
+SELECT DISTINCT tag_id, post_id FROM tags_posts
+WHERE tag_id IS NOT NULL AND post_id IS NOT NULL;
+
+DROP TABLE tags_posts;
+
+ALTER TABLE tags_posts_new RENAME TO tags_posts;
+
+CREATE INDEX IF NOT EXISTS ix_tags_posts_post_id_tag_id
+ON tags_posts (post_id, tag_id)
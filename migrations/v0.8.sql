@@ -0,0 +1,13 @@
+-- Store the number of published and of all posts of each tag
+ALTER TABLE tag ADD COLUMN published_count INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE tag ADD COLUMN total_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE tag SET
+    total_count = (
+        SELECT COUNT(*) FROM tags_posts
+        WHERE tags_posts.tag_id = tag.id),
+    published_count = (
+        SELECT COUNT(*) FROM tags_posts
+        JOIN post ON post.id = tags_posts.post_id
+        WHERE tags_posts.tag_id = tag.id AND post.is_draft = FALSE)
@@ -0,0 +1,2 @@
+-- Store the rendered html of the part of each post before <!--more-->
+ALTER TABLE post ADD COLUMN excerpt_html TEXT
@@ -20,21 +20,55 @@
 
 
 import argparse
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import cProfile
+import difflib
+from datetime import date as date_type
 from datetime import datetime
+from datetime import MAXYEAR
+from datetime import MINYEAR
+from datetime import timedelta
+import hashlib
+import importlib.util
+import html as html_lib
+import io
+from collections import OrderedDict
 from itertools import cycle
+import json
+import marshal
+import math
+import mimetypes
 import os
 from os import environ
+import pstats
+import random
 import re
 import secrets
+import shlex
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 
 import dateutil.parser
+from flask import before_render_template
+from flask import current_app
 from flask import flash
 from flask import Flask
+from flask import g
+from flask import has_app_context
+from flask import has_request_context
+from flask import jsonify
 from markupsafe import Markup
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import send_file
 from flask import send_from_directory
+from flask import template_rendered
 from flask import url_for
 from flask_bcrypt import Bcrypt
 from flask_login import AnonymousUserMixin
@@ -45,11 +79,20 @@ from flask_login import LoginManager
 from flask_login import logout_user
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import text
+from sqlalchemy.orm import Session
 import git
 import jinja2
 from slugify import slugify
 from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import Conflict
+from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import MethodNotAllowed
 from werkzeug.exceptions import NotFound
 from werkzeug.exceptions import ServiceUnavailable
 from werkzeug.exceptions import Unauthorized
@@ -76,6 +119,13 @@ class ConfigError(PlantagenetError):
     pass
 
 
+def positive_int(value):
+    value = int(value)
+    if value < 1:
+        raise ValueError('{} is less than 1'.format(value))
+    return value
+
+
 class Config(object):
     SECRET_KEY = environ.get('PLANTAGENET_SECRET_KEY', 'secret')
     HOST = environ.get('PLANTAGENET_HOST', '127.0.0.1')
@@ -90,6 +140,20 @@ class Config(object):
     LOCAL_RESOURCES = environ.get('PLANTAGENET_LOCAL_RESOURCES', False)
     EXTERN_ROOT = environ.get('PLANTAGENET_EXTERN_ROOT', None)
     EXTRA_LINKS = environ.get('PLANTAGENET_EXTRA_LINKS', '')
+    SERVER_TIMING = environ.get('PLANTAGENET_SERVER_TIMING', False)
+    METRICS = environ.get('PLANTAGENET_METRICS', False)
+    SLOW_QUERY_THRESHOLD = environ.get('PLANTAGENET_SLOW_QUERY_THRESHOLD')
+    PROFILE_HISTORY = positive_int(
+        environ.get('PLANTAGENET_PROFILE_HISTORY', 20))
+    METRICS_DIR = environ.get('PLANTAGENET_METRICS_DIR',
+                              environ.get('PROMETHEUS_MULTIPROC_DIR'))
+    MEDIA_ROOT = environ.get('PLANTAGENET_MEDIA_ROOT', None)
+    MEDIA_ACCEL_REDIRECT = environ.get('PLANTAGENET_MEDIA_ACCEL_REDIRECT',
+                                       None)
+    MEDIA_WORKERS = int(environ.get('PLANTAGENET_MEDIA_WORKERS', 2))
+    MEDIA_VARIANT_BUDGET = int(environ.get('PLANTAGENET_MEDIA_VARIANT_BUDGET',
+                                           1024 * 1024 * 1024))
+    JOB_WORKERS = int(environ.get('PLANTAGENET_JOB_WORKERS', 1))
 
 
 if __name__ == "__main__":
@@ -136,20 +200,165 @@ if __name__ == "__main__":
                         help='Comma-separated list of Label:URL pairs to add '
                              'to the navbar, e.g. "About:/pages/about.html,'
                              'Resume:/pages/resume.pdf".')
+    parser.add_argument('--server-timing', action='store_true',
+                        default=Config.SERVER_TIMING,
+                        help='Add a Server-Timing header to every response, '
+                             'breaking the request time down into SQL, '
+                             'markdown and template rendering.')
+    parser.add_argument('--metrics', action='store_true',
+                        default=Config.METRICS,
+                        help='Collect request, database and cache metrics '
+                             'and serve them in Prometheus format under '
+                             '/metrics.')
+    parser.add_argument('--slow-query-threshold', type=float,
+                        default=Config.SLOW_QUERY_THRESHOLD,
+                        metavar='MILLISECONDS',
+                        help='Log every SQL statement that takes longer than '
+                             'this, along with the types of its parameters, '
+                             'its endpoint and request id, and the query '
+                             'plan of each distinct slow statement.')
+    parser.add_argument('--profile-history', type=positive_int,
+                        default=Config.PROFILE_HISTORY, metavar='N',
+                        help='Number of recent request profiles (made with '
+                             '?__profile=1 while logged in) to keep for '
+                             'download from the admin page.')
+    parser.add_argument('--metrics-dir', type=str,
+                        default=Config.METRICS_DIR,
+                        help='A directory shared by all worker processes '
+                             '(e.g. gunicorn workers), where each worker '
+                             'periodically writes its metrics so that '
+                             '/metrics can report totals across workers.')
+    parser.add_argument('--media-root', type=str,
+                        default=Config.MEDIA_ROOT,
+                        help='Directory in which uploaded media files are '
+                             'stored, by content hash. Uploads are disabled '
+                             'if this is not set.')
+    parser.add_argument('--media-accel-redirect', type=str,
+                        default=Config.MEDIA_ACCEL_REDIRECT, metavar='PREFIX',
+                        help='Let the front-end web server send media files, '
+                             'by answering with an X-Accel-Redirect header '
+                             'to PREFIX followed by the path of the file '
+                             'under the media root, e.g. "/_media" for an '
+                             'nginx internal location aliased to the media '
+                             'root.')
+    parser.add_argument('--media-workers', type=int,
+                        default=Config.MEDIA_WORKERS, metavar='N',
+                        help='Number of background processes that resize '
+                             'uploaded images (0 to resize them only with '
+                             '--generate-media-variants). Requires Pillow.')
+    parser.add_argument('--media-variant-budget', type=int,
+                        default=Config.MEDIA_VARIANT_BUDGET, metavar='BYTES',
+                        help='Disk space for resized images. The least '
+                             'recently served ones are deleted beyond it, '
+                             'and made again when next needed.')
+    parser.add_argument('--job-workers', type=int,
+                        default=Config.JOB_WORKERS, metavar='N',
+                        help='Number of threads that run queued jobs, such '
+                             'as the work that follows a save, in each web '
+                             'server process (0 to leave them to --worker), '
+                             'or in --worker.')
 
     parser.add_argument('--create-secret-key', action='store_true')
     parser.add_argument('--create-db', action='store_true')
     parser.add_argument('--hash-password', action='store', metavar='PASSWORD')
     parser.add_argument('--count-posts', action='store_true')
+    parser.add_argument('--generate-posts', action='store', type=int,
+                        metavar='N',
+                        help='Insert N synthetic posts for load testing.')
+    parser.add_argument('--generate-tags', action='store', type=int,
+                        default=50, metavar='N',
+                        help='Number of tags to spread the generated posts '
+                             'over.')
+    parser.add_argument('--generate-paragraphs', action='store', type=float,
+                        default=5, metavar='MEDIAN',
+                        help='Median number of paragraphs per generated '
+                             'post. Sizes are log-normally distributed, so a '
+                             'few posts are much longer than the rest.')
+    parser.add_argument('--generate-draft-ratio', action='store', type=float,
+                        default=0.1, metavar='RATIO',
+                        help='Fraction of generated posts that are drafts.')
+    parser.add_argument('--generate-pages', action='store', type=int,
+                        default=0, metavar='N',
+                        help='Number of synthetic pages to insert.')
+    parser.add_argument('--generate-batch-size', action='store', type=int,
+                        default=5000, metavar='N')
+    parser.add_argument('--generate-seed', action='store', type=int,
+                        default=None, metavar='SEED')
+    parser.add_argument('--import-markdown', action='store',
+                        metavar='DIRECTORY',
+                        help='Import every .md/.markdown file under '
+                             'DIRECTORY as a post. YAML (---) or TOML (+++) '
+                             'front matter may set title, date, tags, draft '
+                             'and slug. Posts whose slug already exists are '
+                             'skipped, so the import can be re-run.')
+    parser.add_argument('--import-batch-size', action='store', type=int,
+                        default=500, metavar='N')
+    parser.add_argument('--import-workers', action='store', type=int,
+                        default=None, metavar='N',
+                        help='Number of processes used to parse and render '
+                             'the files. Defaults to the number of CPUs.')
+    parser.add_argument('--export-jsonl', action='store', metavar='FILE',
+                        help='Write all posts, pages, tags and options to '
+                             'FILE as JSON lines.')
+    parser.add_argument('--import-jsonl', action='store', metavar='FILE',
+                        help='Load a file written by --export-jsonl into an '
+                             'empty database.')
+    parser.add_argument('--rename-tag', action='store', nargs=2,
+                        metavar=('OLD_NAME', 'NEW_NAME'))
+    parser.add_argument('--merge-tags', action='store', nargs='+',
+                        metavar='NAME',
+                        help='Merge the second and following tags into the '
+                             'first one.')
+    parser.add_argument('--delete-orphan-tags', action='store_true',
+                        help='Delete all tags that have no posts.')
+    parser.add_argument('--reconcile-tag-counts', action='store_true',
+                        help='Recount the posts of every tag and fix the '
+                             'stored counts.')
+    parser.add_argument('--prune-revisions', action='store', type=int,
+                        metavar='KEEP',
+                        help='Delete all but the newest KEEP revisions of '
+                             'every post and page.')
+    parser.add_argument('--compact-revisions', action='store_true',
+                        help='Re-encode the revisions of every post and '
+                             'page.')
+    parser.add_argument('--generate-media-variants', action='store_true',
+                        help='Make the missing resized copies of every '
+                             'uploaded image, using --media-workers '
+                             'processes.')
     parser.add_argument('--reset-slug', action='store', metavar='POST_ID')
     parser.add_argument('--set-date', action='store', nargs=2,
                         metavar=('POST_ID', 'DATE'))
     parser.add_argument('--set-last-updated-date', action='store', nargs=2,
                         metavar=('POST_ID', 'DATE'))
-    parser.add_argument('--reset-summary', action='store', metavar='POST_ID')
+    parser.add_argument('--reset-summary', action='store', metavar='POST_ID',
+                        help='Regenerate the summary and html of a post, or '
+                             'of every post if POST_ID is "all".')
+    parser.add_argument('--reset-summary-batch-size', action='store',
+                        type=int, default=500,
+                        help='Number of posts read, rendered and written at '
+                             'a time by --reset-summary all.')
+    parser.add_argument('--reset-summary-workers', action='store', type=int,
+                        default=None,
+                        help='Number of worker processes used by '
+                             '--reset-summary all. Defaults to rendering in '
+                             'the main process.')
     parser.add_argument('--set-option', action='store', nargs=2,
                         metavar=('NAME', 'VALUE'))
     parser.add_argument('--clear-option', action='store', metavar='NAME')
+    parser.add_argument('--batch', action='store', metavar='FILE',
+                        help='Run the maintenance commands in FILE ("-" for '
+                             'stdin), one per line, e.g. "set-date 12 '
+                             '2017-01-01" or "reset-summary all".')
+    parser.add_argument('--batch-size', action='store', type=int,
+                        default=1000,
+                        help='Number of batch commands per transaction.')
+    parser.add_argument('--enqueue-job', action='store', nargs='+',
+                        metavar='ARG',
+                        help='Queue a batch command (e.g. "reset-summary '
+                             '12") to be run by a job worker.')
+    parser.add_argument('--worker', action='store_true',
+                        help='Run queued jobs with --job-workers threads '
+                             'until interrupted, instead of serving.')
 
     args = parser.parse_args()
 
@@ -172,6 +381,16 @@ if __name__ == "__main__":
     Config.LOCAL_RESOURCES = args.local_resources
     Config.EXTERN_ROOT = args.extern_root
     Config.EXTRA_LINKS = args.extra_links
+    Config.SERVER_TIMING = args.server_timing
+    Config.METRICS = args.metrics
+    Config.SLOW_QUERY_THRESHOLD = args.slow_query_threshold
+    Config.PROFILE_HISTORY = args.profile_history
+    Config.METRICS_DIR = args.metrics_dir
+    Config.MEDIA_ROOT = args.media_root
+    Config.MEDIA_ACCEL_REDIRECT = args.media_accel_redirect
+    Config.MEDIA_WORKERS = args.media_workers
+    Config.MEDIA_VARIANT_BUDGET = args.media_variant_budget
+    Config.JOB_WORKERS = args.job_workers
 
 
 # extensions (unbound; initialized per-app in create_app)
@@ -199,10 +418,75 @@ class Guest(AnonymousUserMixin):
     pass
 
 
+# One token per match: a tag (removed), a run of letters and digits (kept),
+# a punctuation mark (kept, followed by a space) or anything else (a space).
+# A "<" that does not start a tag is matched by the last alternative.
+summary_token_re = re.compile(
+    r'(<[^>]+>)|([a-zA-Z0-9]+)|([,.?!])|[^a-zA-Z0-9,.?!<]+|<')
+
+SUMMARY_LENGTH = 100
+
+# everything before this marker is shown on the index
+more_marker_re = re.compile(r'<!--\s*more\s*-->')
+
+heading_re = re.compile(r'<h([1-6])>(.*?)</h\1>', re.DOTALL)
+tag_re = re.compile(r'<[^>]+>')
+word_re = re.compile(r"\w[\w'\u2019-]*")
+
+WORDS_PER_MINUTE = 200
+
+PREVIEW_CACHE_ENTRIES = 4096
+# the markdown and html of cached preview blocks, in characters
+PREVIEW_CACHE_SIZE = 16 * 1024 * 1024
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_PAGE_SIZE = 48
+# uploaded files never change, since their url contains their hash
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+sha256_re = re.compile(r'^[0-9a-f]{64}$')
+media_extension_re = re.compile(r'^[a-z0-9]{1,10}$')
+
+# resized copies of uploaded images, for srcset; they are made with Pillow,
+# and only if it is installed
+HAVE_PILLOW = importlib.util.find_spec('PIL') is not None
+MEDIA_VARIANT_WIDTHS = (480, 960, 1440, 1920)
+MEDIA_VARIANT_SIZES = '(max-width: 1170px) 100vw, 1170px'
+# webp variants are made of every image, jpeg ones of jpeg images only, so
+# that transparency is not lost in the fallback
+MEDIA_VARIANT_SOURCES = {'jpg': ('webp', 'jpg'), 'jpeg': ('webp', 'jpg'),
+                         'png': ('webp',), 'webp': ('webp',)}
+MEDIA_VARIANT_QUALITY = {'webp': 80, 'jpg': 82}
+MEDIA_VARIANT_QUEUE_LIMIT = 100
+# a served variant's mtime is only bumped (for LRU eviction) this often
+MEDIA_VARIANT_TOUCH_INTERVAL = 60 * 60
+media_img_re = re.compile(
+    r'<img src="/media/([0-9a-f]{64})\.([a-z0-9]{1,10})"([^>]*)>')
+media_url_re = re.compile(r'/media/([0-9a-f]{64})\.([a-z0-9]{1,10})\b')
+
+# an idle job worker looks for due jobs this often, or when woken by a
+# commit that queued one
+JOB_POLL_INTERVAL = 1.0
+JOB_MAX_ATTEMPTS = 5
+# seconds before the first retry of a failed job, doubled for each retry
+JOB_RETRY_DELAY = 10
+# a job still running after this many seconds is assumed to have lost its
+# worker, and is claimed again
+JOB_TIMEOUT = 10 * 60
+
+# a revision is stored in full at least this often, and otherwise as a delta
+# against an earlier revision since the last full copy
+REVISION_SNAPSHOT_INTERVAL = 32
+# diffing is quadratic in the number of lines, so longer documents are
+# always stored in full
+REVISION_DIFF_MAX_LINES = 5000
+
+
 tags_table = db.Table(
     'tags_posts',
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), index=True),
-    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), index=True))
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'),
+              primary_key=True),
+    db.Index('ix_tags_posts_post_id_tag_id', 'post_id', 'tag_id'))
 
 
 class Post(db.Model):
@@ -211,10 +495,18 @@ class Post(db.Model):
     slug = db.Column(db.String(100), index=True, unique=True)
     _content = db.Column(db.Text, name='content')
     summary = db.Column(db.Text)
+    _content_html = db.Column(db.Text, name='content_html')
+    _excerpt_html = db.Column(db.Text, name='excerpt_html')
+    # [[level, anchor, text], ...] for the headings of the content
+    toc = db.Column(db.JSON)
+    word_count = db.Column(db.Integer)
     notes = db.Column(db.Text)
-    date = db.Column(db.DateTime)
+    date = db.Column(db.DateTime, index=True)
     last_updated_date = db.Column(db.DateTime, nullable=False)
-    is_draft = db.Column(db.Boolean, nullable=False, default=False)
+    # active_history, so that flush listeners always see the previous value
+    is_draft = db.column_property(
+        db.Column(db.Boolean, nullable=False, default=False),
+        active_history=True)
     tags = db.relationship('Tag', secondary=tags_table,
                            backref=db.backref('posts'))
 
@@ -232,14 +524,39 @@ class Post(db.Model):
 
     @staticmethod
     def summarize(value):
-        stripped = re.sub(r'</?[^>]+/?>', '', value)
-        cleaned = re.sub(r'[^a-zA-Z01-9,.?!]', ' ', stripped)
-        normalized = re.sub(r'\s*([.,?!])\s*', r'\1 ', cleaned)
-        condensed = re.sub(r'\s+', ' ', normalized)
-        truncated = condensed
-        if len(truncated) > 100:
-            truncated = condensed[:100] + '...'
-        return truncated
+        # reads only as much of the input as the summary needs
+        parts = []
+        length = 0
+        pending_space = False
+        after_punctuation = False
+        for match in summary_token_re.finditer(value):
+            tag, word, punctuation = match.groups()
+            if tag:
+                continue
+            if word:
+                if pending_space:
+                    parts.append(' ')
+                    length += 1
+                    pending_space = False
+                parts.append(word)
+                length += len(word)
+                after_punctuation = False
+            elif punctuation:
+                parts.append(punctuation + ' ')
+                length += 2
+                pending_space = False
+                after_punctuation = True
+            elif not after_punctuation:
+                pending_space = True
+            if length > SUMMARY_LENGTH:
+                return ''.join(parts)[:SUMMARY_LENGTH] + '...'
+        if pending_space:
+            parts.append(' ')
+            length += 1
+        summary = ''.join(parts)
+        if length > SUMMARY_LENGTH:
+            return summary[:SUMMARY_LENGTH] + '...'
+        return summary
 
     @content.setter
     def content(self, value):
@@ -247,7 +564,36 @@ class Post(db.Model):
             value = ''
         value = str(value)
         self._content = value
-        self.summary = self.summarize(value)
+        rendered = render_post_content(value)
+        self.summary = rendered['summary']
+        self._content_html = rendered['content_html']
+        self._excerpt_html = rendered['excerpt_html']
+        self.toc = rendered['toc']
+        self.word_count = rendered['word_count']
+
+    @property
+    def html(self):
+        if self._content_html is None:
+            # posts saved before the rendered html was stored
+            return render_gfm(self.content)
+        return Markup(self._content_html)  # nosec B704 - trusted content
+
+    @staticmethod
+    def render_excerpt(value):
+        parts = more_marker_re.split(value, 1)
+        if len(parts) == 1:
+            return None
+        return add_responsive_images(str(render_gfm(parts[0])))
+
+    @property
+    def reading_minutes(self):
+        return reading_minutes(self.word_count)
+
+    @property
+    def excerpt(self):
+        if self._excerpt_html is None:
+            return None
+        return Markup(self._excerpt_html)  # nosec B704 - trusted content
 
     @classmethod
     def get_by_slug(cls, slug):
@@ -312,6 +658,81 @@ class Post(db.Model):
         stmt = stmt.order_by(Post.date.desc())
         return db.paginate(stmt)
 
+    @classmethod
+    def archive_counts(cls, include_drafts=False):
+        # The per-month counts are shared by every archive page, so they are
+        # cached on the app. The stamp is kept in the db so that changes made
+        # by other workers or by the command line also invalidate the cache.
+        stamp = Options.get('archive_stamp')
+        key = (include_drafts, stamp)
+        cache = current_app.archive_cache
+        current_app.metrics.count_cache('archive', key in cache)
+        if key not in cache:
+            year = db.extract('year', Post.date)
+            month = db.extract('month', Post.date)
+            stmt = (db.select(year, month, db.func.count(Post.id))
+                    .where(Post.date.isnot(None)))
+            if not include_drafts:
+                stmt = stmt.filter_by(is_draft=False)
+            stmt = (stmt.group_by(year, month)
+                    .order_by(year.desc(), month.desc()))
+            counts = [(int(y), int(m), c)
+                      for y, m, c in db.session.execute(stmt)]
+            for stale in [k for k in list(cache) if k[1] != stamp]:
+                cache.pop(stale, None)
+            cache[key] = counts
+            return counts
+        return cache[key]
+
+    @staticmethod
+    def invalidate_archive(session):
+        current_app.archive_cache.clear()
+        stamp = secrets.token_hex(8)
+        option = session.get(Option, 'archive_stamp')
+        if option:
+            option.value = stamp
+        else:
+            session.add(Option('archive_stamp', stamp))
+        if has_request_context():
+            g.get('options', {}).pop('archive_stamp', None)
+
+    @classmethod
+    def list_for_month(cls, year, month, include_drafts=False, before=None,
+                       before_id=None, per_page=20):
+        start = datetime(year, month, 1)
+        if month == 12:
+            end = datetime(year + 1, 1, 1)
+        else:
+            end = datetime(year, month + 1, 1)
+        stmt = db.select(Post).where(Post.date >= start, Post.date < end)
+        if not include_drafts:
+            stmt = stmt.filter_by(is_draft=False)
+        if before is not None:
+            stmt = stmt.where(db.or_(
+                Post.date < before,
+                db.and_(Post.date == before, Post.id < before_id)))
+        stmt = stmt.order_by(Post.date.desc(), Post.id.desc())
+        posts = list(db.session.execute(stmt.limit(per_page + 1)).scalars())
+        has_more = len(posts) > per_page
+        return posts[:per_page], has_more
+
+    def update(self, title, content, notes, is_draft, tags):
+        # the caller saves
+        self.title = title
+        self.content = content
+        self.notes = notes
+        self.is_draft = is_draft
+        self.last_updated_date = datetime.now()
+
+        current_tags = set(self.tags)
+        next_tags = Post.tags_from_string(tags)
+        tags_to_add = next_tags.difference(current_tags)
+        tags_to_remove = current_tags.difference(next_tags)
+
+        for ttr in tags_to_remove:
+            self.tags.remove(ttr)
+        self.tags.extend(tags_to_add)
+
     def save(self):
         for tag in self.tags:
             db.session.add(tag)
@@ -332,9 +753,16 @@ class Post(db.Model):
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, index=True)
+    # maintained by update_tag_counts_on_flush; see reconcile_counts
+    published_count = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
+    total_count = db.Column(db.Integer, nullable=False, default=0,
+                            server_default='0')
 
     def __init__(self, name):
         self.name = name
+        self.published_count = 0
+        self.total_count = 0
 
     @classmethod
     def list(cls):
@@ -344,12 +772,95 @@ class Tag(db.Model):
     def get(cls, tag_id):
         return db.session.get(Tag, tag_id)
 
+    @classmethod
+    def list_with_counts(cls, include_drafts=False):
+        count = Tag.total_count if include_drafts else Tag.published_count
+        stmt = db.select(Tag, count).where(count > 0).order_by(Tag.id)
+        return db.session.execute(stmt).all()
+
+    @classmethod
+    def reconcile_counts(cls, tag_ids=None):
+        # returns the number of tags fixed; the caller commits
+        tp = tags_table.c
+        total = (db.select(db.func.count()).select_from(tags_table)
+                 .where(tp.tag_id == Tag.id).scalar_subquery())
+        published = (db.select(db.func.count()).select_from(tags_table)
+                     .join(Post, Post.id == tp.post_id)
+                     .where(tp.tag_id == Tag.id,
+                            Post.is_draft == False)  # noqa: E712
+                     .scalar_subquery())
+        stmt = (db.update(Tag)
+                .where(db.or_(Tag.total_count != total,
+                              Tag.published_count != published))
+                .values(total_count=total, published_count=published)
+                .execution_options(synchronize_session=False))
+        if tag_ids is not None:
+            stmt = stmt.where(Tag.id.in_(tag_ids))
+        count = db.session.execute(stmt).rowcount
+        db.session.expire_all()
+        return count
+
+    @classmethod
+    def get_by_name(cls, name):
+        return db.session.execute(db.select(Tag).filter_by(name=name)).scalar()
+
+    @classmethod
+    def rename(cls, old_name, new_name):
+        new_name = new_name.strip()
+        if not new_name:
+            raise BadRequest('The new tag name is invalid.')
+        if cls.get_by_name(old_name) is None:
+            raise NotFound('No tag found with name {}'.format(old_name))
+        if cls.get_by_name(new_name) is not None:
+            raise BadRequest('A tag named {} already exists; merge the tags '
+                             'instead.'.format(new_name))
+        db.session.execute(db.update(Tag).where(Tag.name == old_name)
+                           .values(name=new_name))
+        db.session.commit()
+
+    @classmethod
+    def merge(cls, target_name, source_names):
+        # returns the number of associations added to the target
+        target_name = target_name.strip()
+        if not target_name:
+            raise BadRequest('The target tag name is invalid.')
+        source_names = set(n.strip() for n in source_names) - {target_name}
+        source_ids = list(db.session.execute(
+            db.select(Tag.id).where(Tag.name.in_(source_names))).scalars())
+        if len(source_ids) != len(source_names):
+            raise NotFound('Not all of the tags to merge exist.')
+        target = cls.get_by_name(target_name)
+        if target is None:
+            target = Tag(target_name)
+            db.session.add(target)
+            db.session.flush()
+        tp = tags_table.c
+        already_tagged = db.select(tp.post_id).where(tp.tag_id == target.id)
+        moved = db.session.execute(db.insert(tags_table).from_select(
+            ['tag_id', 'post_id'],
+            db.select(db.literal(target.id), tp.post_id)
+            .where(tp.tag_id.in_(source_ids),
+                   tp.post_id.notin_(already_tagged))
+            .distinct())).rowcount
+        db.session.execute(db.delete(tags_table)
+                           .where(tp.tag_id.in_(source_ids)))
+        db.session.execute(db.delete(Tag).where(Tag.id.in_(source_ids)))
+        cls.reconcile_counts([target.id])
+        db.session.commit()
+        return moved
+
+    @classmethod
+    def delete_orphans(cls):
+        has_posts = (db.select(tags_table.c.tag_id)
+                     .where(tags_table.c.tag_id == Tag.id).exists())
+        count = db.session.execute(db.delete(Tag).where(~has_posts)).rowcount
+        db.session.commit()
+        return count
+
     def post_count(self, include_drafts=False):
-        stmt = (db.select(db.func.count()).select_from(Post)
-                .join(Post.tags).where(Tag.id == self.id))
-        if not include_drafts:
-            stmt = stmt.where(Post.is_draft == False)  # noqa: E712
-        return db.session.execute(stmt).scalar()
+        if include_drafts:
+            return self.total_count
+        return self.published_count
 
     def get_posts(self, include_drafts=False):
         stmt = db.select(Post).join(Post.tags).where(Tag.id == self.id)
@@ -368,6 +879,9 @@ class Page(db.Model):
     last_updated_date = db.Column(db.DateTime, nullable=False)
     published_date = db.Column(db.DateTime, nullable=True)
     is_draft = db.Column(db.Boolean, nullable=False, default=False)
+    _content_html = db.Column(db.Text, name='content_html')
+    toc = db.Column(db.JSON)
+    word_count = db.Column(db.Integer)
 
     def __init__(self, title, content, date, is_draft=False, notes=None):
         self.title = title
@@ -386,6 +900,19 @@ class Page(db.Model):
         if value is None:
             value = ''
         self._content = str(value)
+        self._content_html, self.toc, self.word_count = \
+            render_document(self._content)
+
+    @property
+    def html(self):
+        if self._content_html is None:
+            # pages saved before the rendered html was stored
+            return render_gfm(self.content)
+        return Markup(self._content_html)  # nosec B704 - trusted content
+
+    @property
+    def reading_minutes(self):
+        return reading_minutes(self.word_count)
 
     @classmethod
     def get_by_slug(cls, slug):
@@ -436,6 +963,357 @@ class Page(db.Model):
             self.slug = self.get_unique_slug(self._title)
 
 
+class DraftBuffer(db.Model):
+    # unsaved changes to a post, written by autosave
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False,
+                        unique=True)
+    revision = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(100))
+    content = db.Column(db.Text)
+    notes = db.Column(db.Text)
+    tags = db.Column(db.Text)
+    is_draft = db.Column(db.Boolean, nullable=False)
+    updated_date = db.Column(db.DateTime, nullable=False)
+
+    FIELDS = ('title', 'content', 'notes', 'tags', 'is_draft')
+
+    @classmethod
+    def get_for_post(cls, post):
+        return db.session.execute(
+            db.select(DraftBuffer).filter_by(post_id=post.id)).scalar()
+
+    @classmethod
+    def for_post(cls, post):
+        # a new buffer is not added to the session
+        buffer = cls.get_for_post(post)
+        if buffer is None:
+            buffer = DraftBuffer(
+                post_id=post.id, revision=0, title=post.title,
+                content=normalize_newlines(post.content), notes=post.notes,
+                tags=','.join(tag.name for tag in post.tags),
+                is_draft=post.is_draft)
+        return buffer
+
+    def apply(self, revision, changes, content_length=None):
+        # splice offsets are in UTF-16 code units, as in javascript
+        if revision != self.revision:
+            raise Conflict('The draft is at revision {}.'.format(
+                self.revision))
+        for name, value in changes.items():
+            if name not in self.FIELDS:
+                raise BadRequest('Unknown field {}.'.format(name))
+            if name == 'content' and isinstance(value, list):
+                content = normalize_newlines(self.content or '')
+                if content_length != utf16_length(content):
+                    raise Conflict('The draft content has a different '
+                                   'length.')
+                value = apply_splices(content, value)
+            elif name == 'content' and isinstance(value, str):
+                value = normalize_newlines(value)
+            elif name == 'is_draft':
+                if not isinstance(value, bool):
+                    raise BadRequest('is_draft must be a boolean.')
+            elif value is not None and not isinstance(value, str):
+                raise BadRequest('{} must be a string.'.format(name))
+            setattr(self, name, value)
+        self.revision += 1
+        self.updated_date = datetime.now()
+
+
+def normalize_newlines(text):
+    # browsers submit CRLF but edit textareas with LF, and splice offsets
+    # are counted in the latter
+    if text is None:
+        return None
+    return text.replace('\r\n', '\n')
+
+
+def apply_splices(content, splices):
+    data = content.encode('utf-16-le')
+    for splice in splices:
+        if not isinstance(splice, dict):
+            raise BadRequest('Invalid splice.')
+        start = splice.get('start')
+        end = splice.get('end')
+        replacement = splice.get('text', '')
+        if (not isinstance(start, int) or not isinstance(end, int) or
+                not isinstance(replacement, str) or
+                not 0 <= start <= end <= len(data) // 2):
+            raise BadRequest('Invalid splice.')
+        data = (data[:start * 2] + replacement.encode('utf-16-le') +
+                data[end * 2:])
+    try:
+        return data.decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise BadRequest('A splice splits a character.')
+
+
+class Revision(db.Model):
+    # A revision is a snapshot (base None) or a delta against revision
+    # base. After a snapshot, the revision at offset k is a delta against
+    # offset k with its lowest set bit cleared, so any revision is
+    # rebuilt from at most log2(REVISION_SNAPSHOT_INTERVAL) + 1 rows.
+    # Saves store revisions in full with base = number, and the
+    # encode-revisions job turns them into deltas.
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
+    page_id = db.Column(db.Integer, db.ForeignKey('page.id'))
+    number = db.Column(db.Integer, nullable=False)
+    base = db.Column(db.Integer)
+    title = db.Column(db.String(100))
+    # the length of the content, in characters
+    length = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    # base64-encoded zlib of the JSON of the content or the delta
+    data = db.Column(db.Text, nullable=False)
+    post = db.relationship('Post')
+    page = db.relationship('Page')
+
+    __table_args__ = (
+        db.Index('ix_revision_post_id_number', 'post_id', 'number',
+                 unique=True),
+        db.Index('ix_revision_page_id_number', 'page_id', 'number',
+                 unique=True),
+    )
+
+    @staticmethod
+    def of(document):
+        if isinstance(document, Post):
+            return Revision.post_id == document.id
+        return Revision.page_id == document.id
+
+    @staticmethod
+    def in_full():
+        return db.or_(Revision.base.is_(None),
+                      Revision.base == Revision.number)
+
+    @classmethod
+    def list_for(cls, document):
+        return db.session.execute(
+            db.select(Revision).options(db.defer(Revision.data))
+            .where(cls.of(document))
+            .order_by(Revision.number.desc())).scalars()
+
+    @classmethod
+    def latest(cls, where):
+        # (number of the latest revision, of the latest snapshot)
+        number, snapshot = db.session.execute(
+            db.select(db.func.max(Revision.number),
+                      db.func.max(db.case((cls.in_full(),
+                                           Revision.number))))
+            .where(where)).one()
+        return number or 0, snapshot
+
+    @classmethod
+    def load(cls, document, number):
+        where = cls.of(document)
+        snapshot = db.session.execute(
+            db.select(db.func.max(Revision.number))
+            .where(where, cls.in_full(),
+                   Revision.number <= number)).scalar()
+        if snapshot is None:
+            return None, None
+        chain = skip_delta_chain(snapshot, number)
+        revisions = db.session.execute(
+            db.select(Revision)
+            .where(where, Revision.number.in_(chain))
+            .order_by(Revision.number)).scalars().all()
+        if [revision.number for revision in revisions] != chain:
+            return None, None
+        content = None
+        for revision in revisions:
+            content = revision.decode(content)
+        return revisions[-1], content
+
+    def decode(self, base_content):
+        value = unpack_revision_data(self.data)
+        if self.base is None or self.base == self.number:
+            return value
+        return patch_content(base_content, value)
+
+    @classmethod
+    def record(cls, document):
+        # a document saved before revisions were recorded first gets one
+        # with its values in the database. Returns whether the revision
+        # is left for encode-revisions.
+        number = 0
+        if document.id is not None:
+            number = cls.latest(cls.of(document))[0]
+        if document.id is not None and number == 0:
+            model = type(document)
+            title, content, date = db.session.execute(
+                db.select(model._title, model._content,
+                          model.last_updated_date)
+                .where(model.id == document.id)).one()
+            cls.add(document, 1, title, content or '', date)
+            number = 1
+        cls.add(document, number + 1, document.title, document.content,
+                datetime.now(), deferred=number > 0)
+        return number > 0
+
+    @classmethod
+    def add(cls, document, number, title, content, date, deferred=False):
+        if deferred:
+            base, data = number, pack_revision_data(content)
+        else:
+            base, data = encode_revision(number, None, content, None)
+        revision = Revision(number=number, base=base, title=title,
+                            length=len(content), date=date, data=data)
+        if isinstance(document, Post):
+            revision.post = document
+        else:
+            revision.page = document
+        db.session.add(revision)
+
+    @staticmethod
+    def histories(having=None):
+        stmt = (db.select(Revision.post_id, Revision.page_id,
+                          db.func.max(Revision.number))
+                .group_by(Revision.post_id, Revision.page_id))
+        if having is not None:
+            stmt = stmt.having(having)
+        for post_id, page_id, latest in db.session.execute(stmt).all():
+            if post_id is not None:
+                yield Revision.post_id == post_id, latest
+            else:
+                yield Revision.page_id == page_id, latest
+
+    @classmethod
+    def rewrite(cls, where, first, continued=False):
+        # with continued, the revisions from first on continue the deltas
+        # of the snapshot before first, instead of starting with one
+        snapshot = None
+        if continued:
+            snapshot = db.session.execute(
+                db.select(db.func.max(Revision.number))
+                .where(where, Revision.base.is_(None),
+                       Revision.number < first)).scalar()
+        start = snapshot
+        if start is None:
+            start = db.session.execute(
+                db.select(db.func.max(Revision.number))
+                .where(where, cls.in_full(),
+                       Revision.number <= first)).scalar()
+        revisions = db.session.execute(
+            db.select(Revision).where(where, Revision.number >= start)
+            .order_by(Revision.number)).scalars().all()
+        contents = {}
+        for revision in revisions:
+            contents[revision.number] = revision.decode(
+                contents.get(revision.base))
+        before = after = 0
+        for revision in revisions:
+            if revision.number < first:
+                continue
+            before += len(revision.data)
+            revision.base, revision.data = encode_revision(
+                revision.number, snapshot, contents[revision.number],
+                contents.get)
+            if revision.base is None:
+                snapshot = revision.number
+            after += len(revision.data)
+        return before, after
+
+    @classmethod
+    def encode_deferred(cls, where):
+        # returns the number of revisions encoded, and their bytes of data
+        # before and after
+        first, last = db.session.execute(
+            db.select(db.func.min(Revision.number),
+                      db.func.max(Revision.number))
+            .where(where, Revision.base == Revision.number)).one()
+        if first is None:
+            return 0, 0, 0
+        before, after = cls.rewrite(where, first, continued=True)
+        return last - first + 1, before, after
+
+    @classmethod
+    def prune(cls, keep):
+        # the caller commits
+        if keep < 1:
+            raise BadRequest('At least one revision must be kept.')
+        deleted = 0
+        for where, latest in cls.histories(
+                db.func.count(Revision.id) > keep):
+            cutoff = latest - keep + 1
+            cls.rewrite(where, cutoff)
+            db.session.flush()
+            deleted += db.session.execute(
+                db.delete(Revision).where(where, Revision.number < cutoff)
+            ).rowcount
+        return deleted
+
+    @classmethod
+    def compact(cls):
+        # the caller commits
+        count = before = after = 0
+        for where, _latest in cls.histories():
+            first = db.session.execute(
+                db.select(db.func.min(Revision.number)).where(where)).scalar()
+            b, a = cls.rewrite(where, first)
+            count += 1
+            before += b
+            after += a
+        return count, before, after
+
+
+def skip_delta_chain(snapshot, number):
+    chain = [number]
+    while number > snapshot:
+        offset = number - snapshot
+        number = snapshot + (offset & (offset - 1))
+        chain.append(number)
+    return chain[::-1]
+
+
+def diff_content(old, new):
+    # [start, end] ranges of the lines of old to copy, and strings to
+    # insert
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def patch_content(old, ops):
+    lines = old.splitlines(keepends=True)
+    return ''.join(''.join(lines[op[0]:op[1]]) if isinstance(op, list)
+                   else op for op in ops)
+
+
+def pack_revision_data(value):
+    data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+
+def unpack_revision_data(data):
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def encode_revision(number, snapshot, content, load):
+    # a snapshot is stored if the delta would not be smaller
+    data = pack_revision_data(content)
+    if (snapshot is None or
+            number - snapshot >= REVISION_SNAPSHOT_INTERVAL):
+        return None, data
+    offset = number - snapshot
+    base = snapshot + (offset & (offset - 1))
+    old = load(base)
+    if max(old.count('\n'), content.count('\n')) > REVISION_DIFF_MAX_LINES:
+        return None, data
+    delta = pack_revision_data(diff_content(old, content))
+    if len(delta) >= len(data):
+        return None, data
+    return base, delta
+
+
 class Option(db.Model):
     name = db.Column(db.String(100), primary_key=True)
     value = db.Column(db.String(100), nullable=True)
@@ -445,13 +1323,618 @@ class Option(db.Model):
         self.value = value
 
 
+@db.event.listens_for(Session, 'before_flush')
+def invalidate_archive_on_flush(session, flush_context, instances):
+    # catches new, deleted and re-dated posts, whether they were changed by a
+    # view or by a command line operation such as --set-date
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, Post):
+            continue
+        state = inspect(obj)
+        if (obj in session.new or obj in session.deleted or
+                state.attrs.date.history.has_changes() or
+                state.attrs.is_draft.history.has_changes()):
+            Post.invalidate_archive(session)
+            return
+
+
+@db.event.listens_for(Session, 'before_flush')
+def update_tag_counts_on_flush(session, flush_context, instances):
+    # core statements call Tag.reconcile_counts instead
+    deltas = {}
+
+    def add(tags, published, total):
+        for tag in tags:
+            counts = deltas.setdefault(tag, [0, 0])
+            counts[0] += published
+            counts[1] += total
+
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, Post):
+            continue
+        state = inspect(obj)
+        draft_history = state.attrs.is_draft.history
+        if (obj not in session.new and obj not in session.deleted and
+                not draft_history.has_changes() and
+                ('tags' in state.unloaded or
+                 not state.attrs.tags.history.has_changes())):
+            # neither counts nor membership change; don't load the tags
+            continue
+        if obj in session.new:
+            was_published = None
+        elif draft_history.deleted:
+            was_published = not draft_history.deleted[0]
+        else:
+            was_published = not obj.is_draft
+        is_published = not obj.is_draft
+        tags = state.attrs.tags.load_history()
+        if obj in session.deleted:
+            add(list(tags.unchanged) + list(tags.deleted),
+                -was_published, -1)
+            continue
+        add(tags.added, is_published, 1)
+        if was_published is not None:
+            add(tags.deleted, -was_published, -1)
+            add(tags.unchanged, is_published - was_published, 0)
+
+    for tag, (published, total) in deltas.items():
+        if not published and not total:
+            continue
+        if inspect(tag).persistent:
+            # increment in SQL, so that concurrent saves don't lose counts
+            tag.published_count = Tag.published_count + published
+            tag.total_count = Tag.total_count + total
+        else:
+            tag.published_count = (tag.published_count or 0) + published
+            tag.total_count = (tag.total_count or 0) + total
+
+
+@db.event.listens_for(Session, 'before_flush')
+def record_revisions_on_flush(session, flush_context, instances):
+    # core inserts leave no history
+    for obj in list(session.new | session.dirty):
+        if not isinstance(obj, (Post, Page)) or obj in session.deleted:
+            continue
+        state = inspect(obj)
+        if (obj in session.new or
+                state.attrs._title.history.has_changes() or
+                state.attrs._content.history.has_changes()):
+            deferred = Revision.record(obj)
+            session.info.setdefault('revised', []).append((obj, deferred))
+
+
+@db.event.listens_for(Session, 'after_flush_postexec')
+def enqueue_jobs_after_flush(session, flush_context):
+    # the work on revised documents that the save doesn't wait for; their
+    # ids are known by now
+    for document, deferred in session.info.pop('revised', ()):
+        if deferred:
+            kind = 'post' if isinstance(document, Post) else 'page'
+            Job.enqueue('encode-revisions', kind, document.id)
+        enqueue_media_variants(document.content)
+
+
+class Profile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.DateTime, nullable=False, index=True)
+    method = db.Column(db.String(10), nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    endpoint = db.Column(db.String(100))
+    duration = db.Column(db.Float, nullable=False)
+    report = db.Column(db.Text, nullable=False)
+    # base64-encoded marshal of the stats, the format written by
+    # pstats.Stats.dump_stats and read by pstats, snakeviz etc.
+    stats = db.Column(db.Text, nullable=False)
+
+    def __init__(self, date, method, url, endpoint, duration, report, stats):
+        self.date = date
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint
+        self.duration = duration
+        self.report = report
+        self.stats = stats
+
+    @classmethod
+    def list_recent(cls):
+        return db.session.execute(
+            db.select(Profile).order_by(Profile.id.desc())).scalars()
+
+    def save(self, keep):
+        db.session.add(self)
+        db.session.flush()
+        db.session.execute(db.delete(Profile).where(
+            Profile.id <= self.id - keep))
+        db.session.commit()
+
+    def get_stats_bytes(self):
+        return base64.b64decode(self.stats)
+
+
+class Media(db.Model):
+    # stored once per distinct content, as ab/cd/<sha256>
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    # the name of the file when it was first uploaded
+    filename = db.Column(db.String(255), nullable=False)
+    upload_date = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_media_upload_date_id', 'upload_date', 'id'),
+    )
+
+    @property
+    def extension(self):
+        return media_extension(self.filename, self.content_type)
+
+    @classmethod
+    def get_by_sha256(cls, sha256):
+        return db.session.execute(
+            db.select(Media).filter_by(sha256=sha256)).scalar()
+
+    @classmethod
+    def list_page(cls, before=None, limit=MEDIA_PAGE_SIZE):
+        stmt = db.select(Media)
+        if before is not None:
+            cursor = db.select(Media.upload_date).where(
+                Media.id == before).scalar_subquery()
+            stmt = stmt.where(db.or_(
+                Media.upload_date < cursor,
+                db.and_(Media.upload_date == cursor, Media.id < before)))
+        stmt = stmt.order_by(Media.upload_date.desc(), Media.id.desc())
+        return db.session.execute(stmt.limit(limit)).scalars().all()
+
+    @classmethod
+    def store(cls, stream, filename, content_type, media_root):
+        # the caller commits
+        digest, size = write_media_file(stream, media_root)
+        media = cls.get_by_sha256(digest)
+        if media is not None:
+            return media, False
+        media = Media(sha256=digest, size=size,
+                      content_type=content_type or
+                      'application/octet-stream',
+                      filename=os.path.basename(filename or '') or digest,
+                      upload_date=datetime.now())
+        try:
+            with db.session.begin_nested():
+                db.session.add(media)
+        except IntegrityError:
+            # the same content was uploaded concurrently
+            return cls.get_by_sha256(digest), False
+        return media, True
+
+
+def media_path(media_root, sha256):
+    return os.path.join(media_root, sha256[:2], sha256[2:4], sha256)
+
+
+def media_extension(filename, content_type):
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    if not media_extension_re.match(extension):
+        guessed = mimetypes.guess_extension(content_type or '') or ''
+        extension = guessed.lstrip('.')
+    return extension or 'bin'
+
+
+def write_media_file(stream, media_root):
+    hasher = hashlib.sha256()
+    size = 0
+    os.makedirs(media_root, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=media_root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        path = media_path(media_root, digest)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return digest, size
+
+
+def variant_path(media_root, sha256, width, fmt):
+    return os.path.join(media_root, 'variants', sha256[:2],
+                        '{}-{}.{}'.format(sha256, width, fmt))
+
+
+def generate_variants(media_root, sha256, formats, budget):
+    # runs in a worker process
+    from PIL import Image
+    from PIL import ImageOps
+    written = 0
+    with Image.open(media_path(media_root, sha256)) as original:
+        image = ImageOps.exif_transpose(original)
+        for width in MEDIA_VARIANT_WIDTHS:
+            for fmt in formats:
+                path = variant_path(media_root, sha256, width, fmt)
+                if os.path.exists(path):
+                    continue
+                variant = image.copy()
+                variant.thumbnail((width, width * 4))
+                if fmt == 'jpg':
+                    variant = variant.convert('RGB')
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(path), prefix='.variant-')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        variant.save(f, 'JPEG' if fmt == 'jpg' else 'WEBP',
+                                     quality=MEDIA_VARIANT_QUALITY[fmt])
+                    os.chmod(tmp_path, 0o644)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                written += 1
+    evict_variants(media_root, budget)
+    return written
+
+
+def evict_variants(media_root, budget):
+    files = []
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(
+            os.path.join(media_root, 'variants')):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    deleted = 0
+    for _mtime, size, path in sorted(files):
+        if total <= budget:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted
+
+
+def touch_variant(path):
+    # at most once per interval, so that serving a variant rarely writes
+    now = time.time()
+    if os.stat(path).st_mtime < now - MEDIA_VARIANT_TOUCH_INTERVAL:
+        os.utime(path, (now, now))
+
+
+def add_responsive_images(html):
+    if not HAVE_PILLOW:
+        return html
+
+    def srcset(sha256, fmt):
+        return ', '.join('/media/{}/{}.{} {}w'.format(sha256, width, fmt,
+                                                      width)
+                         for width in MEDIA_VARIANT_WIDTHS)
+
+    def replace(match):
+        sha256, extension, rest = match.groups()
+        formats = MEDIA_VARIANT_SOURCES.get(extension)
+        if not formats:
+            return match.group(0)
+        img = '<img src="/media/{}.{}"'.format(sha256, extension)
+        if 'jpg' in formats:
+            img += ' srcset="{}" sizes="{}"'.format(
+                srcset(sha256, 'jpg'), MEDIA_VARIANT_SIZES)
+        return ('<picture><source type="image/webp" srcset="{}" '
+                'sizes="{}" />{} loading="lazy"{}></picture>'.format(
+                    srcset(sha256, 'webp'), MEDIA_VARIANT_SIZES, img, rest))
+
+    return media_img_re.sub(replace, html)
+
+
+def generate_all_variants(media_root, budget, workers=None):
+    jobs = []
+    for media in db.session.execute(db.select(Media)).scalars():
+        formats = MEDIA_VARIANT_SOURCES.get(media.extension)
+        if formats:
+            jobs.append((media_root, media.sha256, formats, budget))
+    if not jobs:
+        return 0
+    if not workers:
+        return sum(generate_variants(*job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(generate_variants, *zip(*jobs)))
+
+
+class VariantPool(object):
+    # at most MEDIA_VARIANT_QUEUE_LIMIT images are queued; anything
+    # dropped is queued again the next time one of its variants is missed
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, app, media):
+        formats = MEDIA_VARIANT_SOURCES.get(media.extension)
+        media_root = app.config['MEDIA_ROOT']
+        if not (HAVE_PILLOW and self.workers and formats and media_root):
+            return False
+        with self.lock:
+            if (media.sha256 in self.pending or
+                    len(self.pending) >= MEDIA_VARIANT_QUEUE_LIMIT):
+                return False
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            self.pending.add(media.sha256)
+        sha256 = media.sha256
+        logger = app.logger
+
+        def done(future):
+            with self.lock:
+                self.pending.discard(sha256)
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning('Could not resize media %s: %s', sha256,
+                               future.exception())
+
+        future = self.executor.submit(
+            generate_variants, media_root, sha256, formats,
+            app.config['MEDIA_VARIANT_BUDGET'])
+        future.add_done_callback(done)
+        return True
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class Job(db.Model):
+    # dedup_key is set while a job is pending, so that identical pending
+    # jobs are stored once
+    id = db.Column(db.Integer, primary_key=True)
+    command = db.Column(db.String(100), nullable=False)
+    args = db.Column(db.JSON, nullable=False)
+    dedup_key = db.Column(db.String(64), unique=True)
+    # pending, running or failed; done jobs are deleted
+    status = db.Column(db.String(10), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    run_after = db.Column(db.DateTime, nullable=False)
+    created_date = db.Column(db.DateTime, nullable=False)
+    started_date = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+    @staticmethod
+    def key_for(command, args):
+        return hashlib.sha256(
+            json.dumps([command] + list(args)).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def enqueue(cls, command, *args):
+        # one INSERT that does nothing if an identical job is pending, so
+        # it can run during a flush; returns whether the job was added. The
+        # caller commits, which wakes the workers.
+        args = [str(arg) for arg in args]
+        now = datetime.now()
+        values = dict(command=command, args=args,
+                      dedup_key=cls.key_for(command, args),
+                      status='pending', attempts=0, run_after=now,
+                      created_date=now)
+        conn = db.session.connection()
+        dialect = conn.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = (sqlite_insert if dialect == 'sqlite'
+                      else postgresql_insert)(Job.__table__)
+            added = conn.execute(
+                insert.values(values)
+                .on_conflict_do_nothing(index_elements=['dedup_key'])
+            ).rowcount == 1
+        elif dialect in ('mysql', 'mariadb'):
+            added = conn.execute(
+                db.insert(Job.__table__).prefix_with('IGNORE')
+                .values(values)).rowcount == 1
+        else:
+            try:
+                with conn.begin_nested():
+                    conn.execute(db.insert(Job.__table__).values(values))
+                added = True
+            except IntegrityError:
+                added = False
+        if added:
+            db.session.info['jobs_enqueued'] = True
+        return added
+
+    @staticmethod
+    def claimable(now):
+        return db.or_(
+            db.and_(Job.status == 'pending', Job.run_after <= now),
+            db.and_(Job.status == 'running',
+                    Job.started_date < now - timedelta(seconds=JOB_TIMEOUT)))
+
+    @classmethod
+    def claim(cls):
+        # the conditional UPDATE lets workers in any number of processes share
+        # the queue without locking it
+        now = datetime.now()
+        ids = db.session.execute(
+            db.select(Job.id).where(cls.claimable(now))
+            .order_by(Job.run_after, Job.id).limit(10)).scalars().all()
+        for job_id in ids:
+            claimed = db.session.execute(
+                db.update(Job).where(Job.id == job_id, cls.claimable(now))
+                .values(status='running', dedup_key=None, started_date=now,
+                        attempts=Job.attempts + 1)
+                .execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        return None
+
+    def retry_later(self, error, permanent=False):
+        self.last_error = error
+        if permanent or self.attempts >= JOB_MAX_ATTEMPTS:
+            self.status = 'failed'
+            return
+        key = Job.key_for(self.command, self.args)
+        if db.session.execute(db.select(Job.id).filter_by(
+                dedup_key=key)).first() is not None:
+            db.session.delete(self)
+            return
+        self.status = 'pending'
+        self.dedup_key = key
+        self.run_after = datetime.now() + timedelta(
+            seconds=JOB_RETRY_DELAY * 2 ** (self.attempts - 1))
+
+    @classmethod
+    def depth(cls):
+        return dict(db.session.execute(
+            db.select(Job.status, db.func.count(Job.id))
+            .group_by(Job.status)).all())
+
+
+def enqueue_media_variants(content):
+    if not (HAVE_PILLOW and has_app_context() and content and
+            current_app.config['MEDIA_ROOT']):
+        return
+    seen = set()
+    for sha256, extension in media_url_re.findall(content):
+        if sha256 not in seen and extension in MEDIA_VARIANT_SOURCES:
+            seen.add(sha256)
+            Job.enqueue('make-media-variants', sha256)
+
+
+def describe_error(e):
+    if isinstance(e, HTTPException):
+        return e.description
+    return '{}: {}'.format(type(e).__name__, e)
+
+
+def run_next_job():
+    # the job is deleted in the transaction of the command's changes;
+    # HTTP errors such as NotFound are not retried
+    job = Job.claim()
+    if job is None:
+        return None
+    job_id, name, args = job.id, job.command, list(job.args)
+    command = BATCH_COMMANDS.get(name)
+    try:
+        if command is None:
+            raise BadRequest('Unknown command {}'.format(name))
+        message = command(*args)
+        db.session.delete(job)
+        db.session.commit()
+        ok = True
+        result = 'done'
+    except Exception as e:
+        db.session.rollback()
+        message = describe_error(e)
+        ok = False
+        result = 'dropped'
+        job = db.session.get(Job, job_id)
+        if job is not None:
+            job.retry_later(message,
+                            permanent=isinstance(e, HTTPException))
+            result = 'failed' if job.status == 'failed' else 'retried'
+            db.session.commit()
+        current_app.logger.warning('Job %s (%s %s) %s: %s', job_id, name,
+                                   ' '.join(args), result, message)
+    current_app.metrics.inc('plantagenet_jobs_total',
+                            (('command', name), ('result', result)))
+    return job_id, ok, message
+
+
+class JobWorker(object):
+    def __init__(self, app, threads):
+        self.app = app
+        self.count = threads
+        self.threads = []
+        self.event = threading.Event()
+        self.stopping = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads or not self.count:
+                return
+            self.stopping = False
+            for i in range(self.count):
+                thread = threading.Thread(
+                    target=self.loop, name='plantagenet-job-{}'.format(i),
+                    daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        self.start()
+        self.event.set()
+
+    def loop(self):
+        while not self.stopping:
+            with self.app.app_context():
+                try:
+                    ran = run_next_job()
+                except Exception:
+                    self.app.logger.exception('Could not run a job')
+                    ran = None
+                self.app.metrics.maybe_flush()
+            if ran is None:
+                self.event.wait(JOB_POLL_INTERVAL)
+                self.event.clear()
+
+    def stop(self):
+        self.stopping = True
+        self.event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+@db.event.listens_for(Session, 'after_commit')
+def wake_job_workers(session):
+    if session.info.pop('jobs_enqueued', False) and has_app_context():
+        current_app.job_worker.wake()
+
+
 class Options(object):
+    @staticmethod
+    def _request_cache():
+        if not has_request_context():
+            return None
+        return g.setdefault('options', {})
+
     @staticmethod
     def get(key, default_value=None):
-        option = db.session.get(Option, key)
-        if option is None:
+        # Templates read the same options many times per page (e.g. the
+        # author of every post), and a missing option would otherwise be
+        # queried for each time, so values are cached for the request.
+        cache = Options._request_cache()
+        if cache is not None and key in cache:
+            value = cache[key]
+        else:
+            option = db.session.get(Option, key)
+            value = None if option is None else option.value
+            if cache is not None:
+                cache[key] = value
+        if value is None:
             return default_value
-        return option.value
+        return value
 
     @staticmethod
     def set(key, value):
@@ -462,6 +1945,13 @@ class Options(object):
             option = Option(key, value)
         db.session.add(option)
         db.session.commit()
+        cache = Options._request_cache()
+        if cache is not None:
+            cache[key] = value
+
+    @staticmethod
+    def clear_request_cache():
+        g.pop('options', None)
 
     @staticmethod
     def get_sitename():
@@ -520,10 +2010,665 @@ def setup_options():
 def render_gfm(s):
     import pycmarkgfm
     from pycmarkgfm import options as cmark_options
+    start = time.perf_counter()
     output = pycmarkgfm.gfm_to_html(s, options=cmark_options.hardbreaks)
+    output = highlight_code_blocks(output)
+    record_timing('md', time.perf_counter() - start)
     return Markup(output)  # nosec B704 - trusted author content
 
 
+class LRUCache(object):
+    MISSING = object()
+
+    def __init__(self, maxsize, maxweight=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.sizeof = sizeof
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weigh(self, value):
+        return self.sizeof(value) if self.sizeof else 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        weight = self._weigh(value)
+        if self.maxweight is not None and weight > self.maxweight:
+            return
+        with self._lock:
+            if key in self._data:
+                self.weight -= self._weigh(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.weight += weight
+            while (len(self._data) > self.maxsize or
+                   (self.maxweight is not None and
+                    self.weight > self.maxweight)):
+                _, evicted = self._data.popitem(last=False)
+                self.weight -= self._weigh(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+highlight_cache = LRUCache(1024)
+
+code_block_re = re.compile(
+    r'<pre><code class="language-([^"]+)">(.*?)</code></pre>', re.DOTALL)
+
+
+def highlight_code(lang, code):
+    key = (lang, hashlib.sha256(code.encode('utf-8')).hexdigest())
+    result = highlight_cache.get(key, LRUCache.MISSING)
+    hit = result is not LRUCache.MISSING
+    if has_app_context():
+        current_app.metrics.count_cache('highlight', hit)
+    if hit:
+        return result
+    try:
+        import pygments
+        from pygments.formatters import HtmlFormatter
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+    except ImportError:
+        return None
+    try:
+        lexer = get_lexer_by_name(lang)
+    except ClassNotFound:
+        result = None
+    else:
+        result = pygments.highlight(code, lexer, HtmlFormatter(nowrap=True))
+    highlight_cache.put(key, result)
+    return result
+
+
+def highlight_code_blocks(output):
+    def replace(m):
+        lang = html_lib.unescape(m.group(1))
+        highlighted = highlight_code(lang, html_lib.unescape(m.group(2)))
+        if highlighted is None:
+            return m.group(0)
+        return '<pre class="highlight"><code class="language-{}">{}</code>' \
+               '</pre>'.format(m.group(1), highlighted)
+
+    return code_block_re.sub(replace, output)
+
+
+def add_heading_anchors(html):
+    # returns the html and the table of contents
+    toc = []
+    used = set()
+
+    def replace(m):
+        level = int(m.group(1))
+        text = html_lib.unescape(tag_re.sub('', m.group(2))).strip()
+        base = slugify(text) or 'section'
+        anchor = base
+        i = 1
+        while anchor in used:
+            anchor = '{}-{}'.format(base, i)
+            i += 1
+        used.add(anchor)
+        toc.append([level, anchor, text])
+        return '<h{0} id="{1}">{2}</h{0}>'.format(level, anchor, m.group(2))
+
+    return heading_re.sub(replace, html), toc
+
+
+def count_words(html):
+    return len(word_re.findall(html_lib.unescape(tag_re.sub(' ', html))))
+
+
+def reading_minutes(word_count):
+    if word_count is None:
+        return None
+    return max(1, int(math.ceil(word_count / WORDS_PER_MINUTE)))
+
+
+fence_open_re = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+html_block_ends = (
+    (re.compile(r'^ {0,3}<!--'), '-->'),
+    (re.compile(r'^ {0,3}<\?'), '?>'),
+    (re.compile(r'^ {0,3}<!\[CDATA\['), ']]>'),
+    (re.compile(r'^ {0,3}<pre[\s>]|^ {0,3}<pre$', re.IGNORECASE), '</pre>'),
+    (re.compile(r'^ {0,3}<script[\s>]|^ {0,3}<script$', re.IGNORECASE),
+     '</script>'),
+    (re.compile(r'^ {0,3}<style[\s>]|^ {0,3}<style$', re.IGNORECASE),
+     '</style>'),
+    (re.compile(r'^ {0,3}<textarea[\s>]|^ {0,3}<textarea$', re.IGNORECASE),
+     '</textarea>'),
+)
+list_item_re = re.compile(r'^([-+*]|\d{1,9}[.)])(\s|$)')
+# link reference and footnote definitions affect the rendering of blocks
+# elsewhere in the document
+definition_re = re.compile(r'^ {0,3}\[[^\]]+\]:', re.MULTILINE)
+
+
+def block_closer(line):
+    m = fence_open_re.match(line)
+    if m:
+        fence = m.group(1)
+        if fence[0] == '`' and '`' in line[m.end():]:
+            return None
+        close_re = re.compile(r'^ {0,3}%s{%d,}\s*$' % (
+            re.escape(fence[0]), len(fence)))
+        return close_re.match
+    for start_re, end in html_block_ends:
+        m = start_re.match(line)
+        if m:
+            if end in line.lower()[m.end():]:
+                return None
+            return lambda line, end=end: end in line.lower()
+    return None
+
+
+def split_markdown_blocks(content):
+    # Blocks render the same on their own as in the document, so their
+    # html can be concatenated. ''.join() of the result is content.
+    parts = content.split('\n')
+    lines = [part + '\n' for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    blocks = []
+    current = []
+    closer = None
+    after_blank = False
+    for line in lines:
+        stripped = line.rstrip('\r\n')
+        if closer is not None:
+            current.append(line)
+            if closer(stripped):
+                closer = None
+            continue
+        blank = not stripped.strip()
+        if (not blank and after_blank and current and
+                stripped[0] not in ' \t' and not list_item_re.match(stripped)):
+            blocks.append(''.join(current))
+            current = []
+        current.append(line)
+        if not blank:
+            closer = block_closer(stripped)
+        after_blank = blank
+    if current:
+        blocks.append(''.join(current))
+    return blocks
+
+
+def utf16_length(text):
+    # the length of the string in javascript
+    return len(text.encode('utf-16-le')) // 2
+
+
+def preview_entry_size(entry):
+    source, html = entry
+    return len(source or '') + len(html)
+
+
+def preview_markdown(items, cache):
+    # items are markdown strings or {"hash": ...} references to blocks
+    # of a previous call; missing lists the ones no longer cached
+    texts = []
+    referenced = set()
+    missing = []
+    for item in items:
+        if isinstance(item, str):
+            texts.append(item)
+        elif isinstance(item, dict) and isinstance(item.get('hash'), str):
+            entry = cache.get(item['hash'])
+            if entry is None:
+                missing.append(item['hash'])
+            else:
+                texts.append(entry[0])
+                referenced.add(item['hash'])
+        else:
+            raise BadRequest('Invalid preview block.')
+    if missing:
+        return None, missing
+    content = ''.join(texts)
+    metrics = current_app.metrics
+    if definition_re.search(content):
+        key = 'document:' + hashlib.sha256(
+            content.encode('utf-8')).hexdigest()
+        entry = cache.get(key)
+        metrics.count_cache('preview', entry is not None)
+        if entry is None:
+            entry = (None, str(render_gfm(content)))
+            cache.put(key, entry)
+        return {'html': entry[1]}, None
+    blocks = []
+    for source in split_markdown_blocks(content):
+        key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        entry = cache.get(key)
+        metrics.count_cache('preview', entry is not None)
+        if entry is None:
+            entry = (source, str(render_gfm(source)))
+            cache.put(key, entry)
+        block = {'hash': key, 'length': utf16_length(source)}
+        if key not in referenced:
+            block['html'] = entry[1]
+        blocks.append(block)
+    return {'blocks': blocks}, None
+
+
+def render_document(content):
+    html, toc = add_heading_anchors(str(render_gfm(content)))
+    return add_responsive_images(html), toc, count_words(html)
+
+
+def record_timing(name, elapsed):
+    if not has_request_context():
+        return
+    timings = g.get('timings')
+    if timings is None:
+        return
+    count, total = timings.get(name, (0, 0.0))
+    timings[name] = (count + 1, total + elapsed)
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    # on the context, so that a statement that fails leaves nothing behind
+    context._plantagenet_start_time = time.perf_counter()
+
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.perf_counter() - context._plantagenet_start_time
+    record_timing('db', elapsed)
+    if has_app_context():
+        current_app.metrics.observe('plantagenet_db_query_duration_seconds',
+                                    (), elapsed)
+        log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+def explain_query(conn, statement, parameters):
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    # use a raw DBAPI cursor, so that the EXPLAIN itself does not go
+    # through the engine events
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [tuple(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def describe_parameters(parameters, executemany):
+    # only their types, since the values can be passwords or drafts
+    if executemany:
+        return '{} rows'.format(len(parameters))
+    if isinstance(parameters, dict):
+        return '({})'.format(', '.join(
+            '{}: {}'.format(k, type(v).__name__)
+            for k, v in parameters.items()))
+    return '({})'.format(', '.join(type(v).__name__
+                                   for v in parameters or ()))
+
+
+def log_slow_query(conn, statement, parameters, executemany, elapsed):
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD')
+    if threshold is None or elapsed * 1000 < float(threshold):
+        return
+    endpoint = None
+    request_id = None
+    if has_request_context():
+        endpoint = request.endpoint
+        request_id = g.get('request_id')
+    logger = current_app.logger
+    logger.warning('Slow query (%.1f ms, endpoint=%s, request_id=%s): %s '
+                   '-- parameters: %s', elapsed * 1000, endpoint, request_id,
+                   statement, describe_parameters(parameters, executemany))
+    explained = current_app.explained_statements
+    if (executemany or statement in explained or
+            not statement.lstrip().upper().startswith('SELECT')):
+        return
+    explained.add(statement)
+    try:
+        plan = explain_query(conn, statement, parameters)
+    except Exception as e:
+        logger.warning('Could not explain slow query: %s', e)
+        return
+    logger.warning('Query plan for slow query: %s\n%s', statement,
+                   '\n'.join(' '.join(str(c) for c in row) for row in plan))
+
+
+def set_request_id():
+    g.request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+
+
+def add_request_id_header(response):
+    if g.get('request_id'):
+        response.headers['X-Request-Id'] = g.request_id
+    return response
+
+
+class Metrics(object):
+    # Samples go to per-thread dicts, so recording takes no lock. With a
+    # directory, each process writes its samples to a file there, and
+    # collect() adds up the files of all processes.
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               10.0)
+
+    TYPES = {
+        'plantagenet_request_duration_seconds': 'histogram',
+        'plantagenet_requests_total': 'counter',
+        'plantagenet_db_query_duration_seconds': 'histogram',
+        'plantagenet_cache_requests_total': 'counter',
+        'plantagenet_db_pool_size': 'gauge',
+        'plantagenet_db_pool_checked_out': 'gauge',
+        'plantagenet_job_queue_depth': 'gauge',
+        'plantagenet_jobs_total': 'counter',
+    }
+
+    def __init__(self, enabled=False, directory=None, flush_interval=5.0):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._shards = []
+        self._dead = {}
+        self._lock = threading.Lock()
+        self._gauges = {}
+        self._last_flush = time.monotonic()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._reap()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _reap(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+            for key, value in shard.items():
+                self._dead[key] = self._dead.get(key, 0) + value
+        self._shards = live
+
+    def inc(self, name, labels=(), amount=1):
+        if not self.enabled:
+            return
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        if not self.enabled:
+            return
+        for bucket in self.BUCKETS:
+            if value <= bucket:
+                self.inc(name + '_bucket', labels + (('le', str(bucket)),))
+        self.inc(name + '_bucket', labels + (('le', '+Inf'),))
+        self.inc(name + '_sum', labels, value)
+        self.inc(name + '_count', labels)
+
+    def set_gauge(self, name, labels, value):
+        if self.enabled:
+            self._gauges[(name, labels)] = value
+
+    def count_cache(self, cache, hit):
+        self.inc('plantagenet_cache_requests_total',
+                 (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+    def snapshot(self):
+        with self._lock:
+            self._reap()
+            totals = dict(self._dead)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for key, value in dict(shard).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self.directory:
+            return
+        pid = os.getpid()
+        data = {
+            'counters': [[name, labels, value] for (name, labels), value
+                         in self.snapshot().items()],
+            'gauges': [[name, labels, value] for (name, labels), value
+                       in dict(self._gauges).items()],
+        }
+        tmp = self._path(pid) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self._path(pid))
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def collect(self):
+        if not self.directory:
+            return self.snapshot(), dict(self._gauges)
+        self.flush()
+        counters = {}
+        gauges = {}
+        for fname in os.listdir(self.directory):
+            m = re.match(r'^metrics-(\d+)\.json$', fname)
+            if not m:
+                continue
+            pid = m.group(1)
+            try:
+                with open(os.path.join(self.directory, fname)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data['counters']:
+                key = (name, tuple(tuple(lv) for lv in labels))
+                counters[key] = counters.get(key, 0) + value
+            # gauges describe live processes only
+            if not self._is_alive(int(pid)):
+                continue
+            for name, labels, value in data['gauges']:
+                key = (name, tuple(tuple(lv) for lv in labels) +
+                       (('pid', pid),))
+                gauges[key] = value
+        return counters, gauges
+
+    def render(self, extra_gauges=None):
+        # extra_gauges are not per process, e.g. the job queue depth
+        counters, gauges = self.collect()
+        gauges.update(extra_gauges or {})
+        samples = sorted(list(counters.items()) + list(gauges.items()))
+        lines = []
+        typed = set()
+        for (name, labels), value in samples:
+            family = re.sub(r'_(bucket|sum|count)$', '', name)
+            if family not in self.TYPES:
+                family = name
+            if family not in typed:
+                typed.add(family)
+                lines.append('# TYPE {} {}'.format(
+                    family, self.TYPES.get(family, 'untyped')))
+            if labels:
+                label_str = ','.join(
+                    '{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                     .replace('"', '\\"'))
+                    for k, v in labels)
+                lines.append('{}{{{}}} {}'.format(name, label_str, value))
+            else:
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics():
+    if current_app.metrics.enabled:
+        g.metrics_start = time.perf_counter()
+
+
+def record_request_metrics(response):
+    metrics = current_app.metrics
+    if not metrics.enabled or g.get('metrics_start') is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('plantagenet_request_duration_seconds',
+                    (('endpoint', endpoint),),
+                    time.perf_counter() - g.metrics_start)
+    metrics.inc('plantagenet_requests_total',
+                (('endpoint', endpoint),
+                 ('status', str(response.status_code))))
+    pool = db.engine.pool
+    if hasattr(pool, 'checkedout') and hasattr(pool, 'size'):
+        metrics.set_gauge('plantagenet_db_pool_size', (), pool.size())
+        metrics.set_gauge('plantagenet_db_pool_checked_out', (),
+                          pool.checkedout())
+    metrics.maybe_flush()
+    return response
+
+
+def get_metrics():
+    if not current_app.metrics.enabled:
+        raise NotFound()
+    depth = Job.depth()
+    gauges = {('plantagenet_job_queue_depth', (('status', status),)):
+              depth.get(status, 0)
+              for status in ('pending', 'running', 'failed')}
+    return current_app.metrics.render(gauges), 200, {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def profile_request():
+    # Only requests that ask for it pay for the login check, and only logged
+    # in users are profiled.
+    if ('__profile' not in request.args and
+            'X-Plantagenet-Profile' not in request.headers):
+        return None
+    if not current_user.is_authenticated or request.endpoint is None:
+        return None
+    # views that change things commit them themselves, so they can't be
+    # profiled without applying the change
+    if request.method not in ('GET', 'HEAD'):
+        raise MethodNotAllowed(valid_methods=['GET', 'HEAD'],
+                               description='Only GET requests are profiled.')
+    view = current_app.view_functions[request.endpoint]
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        view(**request.view_args)
+    except HTTPException:
+        # the profile of e.g. a 404 is still worth keeping
+        pass
+    finally:
+        profiler.disable()
+    duration = time.perf_counter() - start
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(60)
+    profile = Profile(datetime.now(), request.method, request.full_path,
+                      request.endpoint, duration, stream.getvalue(),
+                      base64.b64encode(marshal.dumps(stats.stats))
+                      .decode('ascii'))
+    # the view may have left pending changes in the session; don't save
+    # them with the profile
+    db.session.rollback()
+    profile.save(keep=current_app.config['PROFILE_HISTORY'])
+    if (request.args.get('__profile') == 'pstats' or
+            request.headers.get('X-Plantagenet-Profile') == 'pstats'):
+        return download_profile(profile.id)
+    return get_profile(profile.id)
+
+
+@login_required
+def get_profile(profile_id):
+    profile = db.session.get(Profile, profile_id)
+    if profile is None:
+        raise NotFound()
+    header = '{} {} ({}) took {:.1f} ms on {}\n\n'.format(
+        profile.method, profile.url, profile.endpoint,
+        profile.duration * 1000, profile.date)
+    return header + profile.report, 200, {
+        'Content-Type': 'text/plain; charset=utf-8'}
+
+
+@login_required
+def download_profile(profile_id):
+    profile = db.session.get(Profile, profile_id)
+    if profile is None:
+        raise NotFound()
+    filename = 'profile-{}-{}.pstats'.format(profile.id, profile.endpoint)
+    return profile.get_stats_bytes(), 200, {
+        'Content-Type': 'application/octet-stream',
+        'Content-Disposition': 'attachment; filename="{}"'.format(filename),
+    }
+
+
+def start_timing():
+    if current_app.config.get('SERVER_TIMING'):
+        g.timings = {}
+        g.request_start = time.perf_counter()
+        g.render_starts = []
+
+
+def start_template_timing(sender, template, context, **extra):
+    if g.get('timings') is not None:
+        g.render_starts.append(time.perf_counter())
+
+
+def stop_template_timing(sender, template, context, **extra):
+    if g.get('timings') is not None and g.render_starts:
+        start = g.render_starts.pop()
+        if not g.render_starts:
+            # nested renders are already included in the outer one
+            record_timing('tpl', time.perf_counter() - start)
+
+
+def add_server_timing_header(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    descriptions = {'db': 'SQL', 'md': 'Markdown', 'tpl': 'Templates'}
+    entries = []
+    for name in ('db', 'md', 'tpl'):
+        if name in timings:
+            count, total = timings[name]
+            entries.append('{};desc="{} ({})";dur={:.3f}'.format(
+                name, descriptions[name], count, total * 1000))
+    total = time.perf_counter() - g.request_start
+    entries.append('total;dur={:.3f}'.format(total * 1000))
+    response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
 def index():
     pager = Post.list_paginated(include_drafts=current_user.is_authenticated)
     return render_template("index.html", pager=pager)
@@ -570,9 +2715,11 @@ def edit_post(slug):
     post = Post.get_by_slug(slug)
     if not post:
         raise NotFound()
+    buffer = DraftBuffer.get_for_post(post)
     if request.method == 'GET':
         return render_template('edit.html', post=post, config=Config,
-                               post_url=url_for('edit_post', slug=post.slug))
+                               post_url=url_for('edit_post', slug=post.slug),
+                               autosave=buffer)
 
     title = request.form['title'].strip()
     Post.validate_title(title)
@@ -582,22 +2729,48 @@ def edit_post(slug):
                          request.form['is_draft']))
     tags = request.form['tags']
 
-    post.title = title
-    post.content = content
-    post.notes = notes
-    post.is_draft = is_draft
-    post.last_updated_date = datetime.now()
+    post.update(title, content, notes, is_draft, tags)
+    if buffer is not None:
+        db.session.delete(buffer)
+    post.save()
+    return redirect(url_for('get_post', slug=post.slug))
 
-    current_tags = set(post.tags)
-    next_tags = Post.tags_from_string(tags)
-    tags_to_add = next_tags.difference(current_tags)
-    tags_to_remove = current_tags.difference(next_tags)
 
-    for ttr in tags_to_remove:
-        post.tags.remove(ttr)
-    post.tags.extend(tags_to_add)
+@login_required
+def autosave_post(slug):
+    post = Post.get_by_slug(slug)
+    if not post:
+        raise NotFound()
+    data = request.get_json(silent=True)
+    if (not isinstance(data, dict) or
+            not isinstance(data.get('revision'), int) or
+            not isinstance(data.get('changes', {}), dict) or
+            not isinstance(data.get('content_length', 0), int)):
+        raise BadRequest('Expected {"revision": ..., "changes": {...}}.')
+    buffer = DraftBuffer.for_post(post)
+    try:
+        buffer.apply(data['revision'], data.get('changes', {}),
+                     data.get('content_length'))
+    except Conflict:
+        return jsonify(revision=buffer.revision), 409
+    db.session.add(buffer)
+    db.session.commit()
+    return jsonify(revision=buffer.revision)
 
-    post.save()
+
+@login_required
+def promote_post(slug):
+    post = Post.get_by_slug(slug)
+    if not post:
+        raise NotFound()
+    buffer = DraftBuffer.get_for_post(post)
+    if buffer is not None:
+        title = (buffer.title or '').strip()
+        Post.validate_title(title)
+        post.update(title, buffer.content, buffer.notes, buffer.is_draft,
+                    buffer.tags or '')
+        db.session.delete(buffer)
+        post.save()
     return redirect(url_for('get_post', slug=post.slug))
 
 
@@ -623,11 +2796,67 @@ def create_new():
     return redirect(url_for('get_post', slug=post.slug))
 
 
+def show_revisions(document, view_url, endpoint):
+    return render_template('revisions.html', document=document,
+                           revisions=Revision.list_for(document),
+                           view_url=view_url, endpoint=endpoint)
+
+
+def show_revision(document, number, view_url, endpoint):
+    revision, content = Revision.load(document, number)
+    if revision is None:
+        raise NotFound()
+    older, previous = Revision.load(document, number - 1)
+    diff = difflib.unified_diff(
+        (previous or '').splitlines(), content.splitlines(),
+        'revision {}'.format(number - 1), 'revision {}'.format(number),
+        lineterm='')
+    latest = Revision.latest(Revision.of(document))[0]
+    return render_template('revision.html', document=document,
+                           revision=revision, content=content, diff=diff,
+                           older=older, latest=latest, view_url=view_url,
+                           endpoint=endpoint)
+
+
+@login_required
+def post_revisions(slug):
+    post = Post.get_by_slug(slug)
+    if not post:
+        raise NotFound()
+    return show_revisions(post, url_for('get_post', slug=post.slug),
+                          'post_revision')
+
+
+@login_required
+def post_revision(slug, number):
+    post = Post.get_by_slug(slug)
+    if not post:
+        raise NotFound()
+    return show_revision(post, number, url_for('get_post', slug=post.slug),
+                         'post_revision')
+
+
+@login_required
+def page_revisions(slug):
+    page = Page.get_by_slug(slug)
+    if not page:
+        raise NotFound()
+    return show_revisions(page, url_for('view_page', slug=page.slug),
+                          'page_revision')
+
+
+@login_required
+def page_revision(slug, number):
+    page = Page.get_by_slug(slug)
+    if not page:
+        raise NotFound()
+    return show_revision(page, number, url_for('view_page', slug=page.slug),
+                         'page_revision')
+
+
 def list_tags():
-    tags = Tag.list()
-    include_drafts = current_user.is_authenticated
-    tag_counts = [(tag, tag.post_count(include_drafts=include_drafts))
-                  for tag in tags]
+    tag_counts = Tag.list_with_counts(
+        include_drafts=current_user.is_authenticated)
     return render_template('list_tags.html', tag_counts=tag_counts)
 
 
@@ -637,6 +2866,44 @@ def get_tag(tag_id):
     return render_template("tag.html", tag=tag, posts=posts)
 
 
+def archive(year=None):
+    include_drafts = current_user.is_authenticated
+    counts = Post.archive_counts(include_drafts=include_drafts)
+    if year is not None:
+        counts = [(y, m, c) for y, m, c in counts if y == year]
+        if not counts:
+            raise NotFound()
+    years = []
+    for y, m, c in counts:
+        if not years or years[-1][0] != y:
+            years.append((y, []))
+        years[-1][1].append((datetime(y, m, 1), c))
+    return render_template('archive.html', years=years, year=year)
+
+
+def archive_month(year, month):
+    # the month's posts are those before the first of the next month
+    if not (1 <= month <= 12 and MINYEAR <= year <= MAXYEAR and
+            (year < MAXYEAR or month < 12)):
+        raise NotFound()
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    if before is not None:
+        try:
+            before = datetime.fromisoformat(before)
+        except ValueError:
+            raise BadRequest('Invalid "before" date.')
+        if before_id is None:
+            raise BadRequest('"before_id" is required with "before".')
+    posts, has_more = Post.list_for_month(
+        year, month, include_drafts=current_user.is_authenticated,
+        before=before, before_id=before_id)
+    if not posts and before is None:
+        raise NotFound()
+    return render_template('archive_month.html', posts=posts,
+                           has_more=has_more, month=datetime(year, month, 1))
+
+
 def list_pages():
     pages = Page.list(include_drafts=current_user.is_authenticated)
     return render_template('list_pages.html', pages=pages)
@@ -718,7 +2985,8 @@ def admin():
     if request.method == 'GET':
         return render_template('admin.html',
                                sitename=Options.get_sitename(),
-                               extra_links=Options.get('extra_links', ''))
+                               extra_links=Options.get('extra_links', ''),
+                               profiles=Profile.list_recent())
 
     sitename = request.form.get('sitename', '').strip()
     if sitename:
@@ -736,6 +3004,44 @@ def admin():
     return redirect(url_for('admin'))
 
 
+@login_required
+def preview():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('content'), str):
+        items = [data['content']]
+    elif isinstance(data, dict) and isinstance(data.get('blocks'), list):
+        items = data['blocks']
+    else:
+        raise BadRequest('Expected {"content": ...} or {"blocks": [...]}.')
+    response, missing = preview_markdown(items, current_app.preview_cache)
+    if missing:
+        return jsonify(missing=missing), 409
+    return jsonify(response)
+
+
+@login_required
+def admin_tags():
+    action = request.form.get('action')
+    if action == 'rename':
+        old_name = request.form.get('old_name', '').strip()
+        new_name = request.form.get('new_name', '').strip()
+        Tag.rename(old_name, new_name)
+        flash('Renamed tag {} to {}.'.format(old_name, new_name))
+    elif action == 'merge':
+        target = request.form.get('target', '').strip()
+        sources = [name.strip() for name in
+                   request.form.get('sources', '').split(',') if name.strip()]
+        moved = Tag.merge(target, sources)
+        flash('Merged {} into {} ({} posts retagged).'.format(
+            ', '.join(sources), target, moved))
+    elif action == 'delete_orphans':
+        count = Tag.delete_orphans()
+        flash('Deleted {} tags without posts.'.format(count))
+    else:
+        raise BadRequest('Unknown tag action.')
+    return redirect(url_for('admin'))
+
+
 def get_page(filename):
     if not Config.EXTERN_ROOT:
         raise NotFound()
@@ -748,6 +3054,140 @@ def get_page(filename):
     return send_from_directory(pages_dir, filename)
 
 
+def media_json(media):
+    return {
+        'sha256': media.sha256,
+        'url': url_for('get_media', sha256=media.sha256,
+                       extension=media.extension),
+        'size': media.size,
+        'content_type': media.content_type,
+        'filename': media.filename,
+        'upload_date': media.upload_date.isoformat(),
+    }
+
+
+@login_required
+def upload_media():
+    # a form upload redirects to the media library; a raw body is
+    # answered with json, 201 if the file is new
+    media_root = current_app.config['MEDIA_ROOT']
+    if not media_root:
+        raise NotFound()
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            raise BadRequest('No file was uploaded.')
+        media, created = Media.store(
+            upload.stream, upload.filename,
+            guess_content_type(upload.filename, upload.mimetype), media_root)
+        db.session.commit()
+        if created:
+            current_app.variant_pool.submit(
+                current_app._get_current_object(), media)
+        return redirect(url_for('media_library'))
+    filename = request.args.get('filename', '')
+    media, created = Media.store(
+        request.stream, filename,
+        guess_content_type(filename, request.mimetype), media_root)
+    db.session.commit()
+    if created:
+        current_app.variant_pool.submit(current_app._get_current_object(),
+                                        media)
+    return jsonify(media_json(media)), 201 if created else 200
+
+
+def guess_content_type(filename, content_type):
+    if content_type and content_type != 'application/octet-stream':
+        return content_type
+    return mimetypes.guess_type(filename or '')[0] or content_type
+
+
+def get_media(sha256, extension):
+    media_root = current_app.config['MEDIA_ROOT']
+    if not media_root or not sha256_re.match(sha256):
+        raise NotFound()
+    path = media_path(media_root, sha256)
+    if not os.path.isfile(path):
+        raise NotFound()
+    mimetype = (mimetypes.guess_type('media.' + extension)[0] or
+                'application/octet-stream')
+    relative_path = '{}/{}/{}'.format(sha256[:2], sha256[2:4], sha256)
+    return send_media(path, relative_path, mimetype, sha256)
+
+
+def get_media_variant(sha256, width, fmt):
+    # until the variant is made, redirect to the original
+    media_root = current_app.config['MEDIA_ROOT']
+    if (not media_root or not sha256_re.match(sha256) or
+            width not in MEDIA_VARIANT_WIDTHS or
+            fmt not in MEDIA_VARIANT_QUALITY):
+        raise NotFound()
+    path = variant_path(media_root, sha256, width, fmt)
+    if not os.path.isfile(path):
+        media = Media.get_by_sha256(sha256)
+        if media is None:
+            raise NotFound()
+        current_app.variant_pool.submit(current_app._get_current_object(),
+                                        media)
+        response = redirect(url_for('get_media', sha256=sha256,
+                                    extension=media.extension))
+        response.cache_control.no_store = True
+        return response
+    touch_variant(path)
+    return send_media(
+        path, 'variants/{}/{}'.format(sha256[:2], os.path.basename(path)),
+        'image/webp' if fmt == 'webp' else 'image/jpeg',
+        '{}-{}-{}'.format(sha256, width, fmt))
+
+
+def send_media(path, relative_path, mimetype, etag):
+    accel_redirect = current_app.config['MEDIA_ACCEL_REDIRECT']
+    if accel_redirect:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = '{}/{}'.format(
+            accel_redirect.rstrip('/'), relative_path)
+    else:
+        # handles If-None-Match and Range requests
+        response = send_file(path, mimetype=mimetype, conditional=True,
+                             etag=etag, max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+    response.cache_control.immutable = True
+    # uploads are served from the site's origin
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = \
+        "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return response
+
+
+@login_required
+def media_library():
+    before = request.args.get('before', type=int)
+    files = Media.list_page(before)
+    older = files[-1].id if len(files) == MEDIA_PAGE_SIZE else None
+    return render_template(
+        'media.html', files=files, before=before, older=older,
+        enabled=bool(current_app.config['MEDIA_ROOT']))
+
+
+add_column_re = re.compile(
+    r'^ALTER\s+TABLE\s+(\w+)\s+ADD\s+(?:COLUMN\s+)?(\w+)\s',
+    re.IGNORECASE)
+
+
+def column_already_added(conn, stmt):
+    # db.create_all() creates new columns on a fresh database before the
+    # migrations run, and not every backend supports ADD COLUMN IF NOT EXISTS
+    lines = [line for line in stmt.splitlines()
+             if not line.strip().startswith('--')]
+    m = add_column_re.match(' '.join(lines).strip())
+    if not m:
+        return False
+    table, column = m.group(1), m.group(2)
+    columns = inspect(conn).get_columns(table)
+    return any(c['name'].lower() == column.lower() for c in columns)
+
+
 def run_migrations(engine):
     migrations_dir = os.path.join(
         os.path.dirname(os.path.abspath(__file__)), 'migrations')
@@ -801,6 +3241,10 @@ def run_migrations(engine):
 
             try:
                 for stmt in statements:
+                    if column_already_added(conn, stmt):
+                        print(f'[migrations] skipping statement, column '
+                              f'already exists: {stmt}')
+                        continue
                     print(f'[migrations] running statement: {stmt}')
                     conn.execute(text(stmt))
                 conn.execute(
@@ -825,6 +3269,558 @@ def hash_password(unhashed_password):
     return bcrypt.generate_password_hash(unhashed_password)
 
 
+GENERATED_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua python flask query '
+    'index cache render template database server request latency worker '
+    'the a of to and in is it that for on with as').split()
+
+
+def generate_markdown(rnd, paragraphs):
+    words = GENERATED_WORDS
+    parts = []
+    for i in range(paragraphs):
+        if i % 6 == 0:
+            parts.append('## ' + ' '.join(rnd.choices(words, k=4)).title())
+        kind = rnd.random()
+        if kind < 0.1:
+            parts.append('```python\nfor {0} in range(10):\n'
+                         '    print({0})\n```'.format(rnd.choice(words)))
+        elif kind < 0.2:
+            parts.append('\n'.join('- ' + ' '.join(rnd.choices(words, k=6))
+                                   for _ in range(rnd.randint(2, 5))))
+        else:
+            sentence = rnd.choices(words, k=rnd.randint(40, 120))
+            sentence[rnd.randrange(len(sentence))] = '**{}**'.format(
+                rnd.choice(words))
+            sentence[rnd.randrange(len(sentence))] = (
+                '[{0}](https://example.com/{0})'.format(rnd.choice(words)))
+            parts.append(' '.join(sentence).capitalize() + '.')
+    return '\n\n'.join(parts)
+
+
+def finish_bulk_insert(tables=()):
+    # core inserts bypass the session's flush events, and rows inserted with
+    # explicit ids leave postgres sequences behind
+    reset_sequences(db.session.connection(), tables)
+    Post.invalidate_archive(db.session)
+    Tag.reconcile_counts()
+    db.session.commit()
+
+
+def generate_posts(count, num_tags=50, median_paragraphs=5, draft_ratio=0.1,
+                   num_pages=0, batch_size=5000, seed=None, progress=None):
+    rnd = random.Random(seed)  # nosec B311 - synthetic data only
+    tag_names = ['generated-{}'.format(i) for i in range(num_tags)]
+    existing = set(db.session.execute(
+        db.select(Tag.name).where(Tag.name.in_(tag_names))).scalars())
+    missing = [name for name in tag_names if name not in existing]
+    if missing:
+        db.session.execute(db.insert(Tag.__table__),
+                           [{'name': name} for name in missing])
+    tag_ids = list(db.session.execute(
+        db.select(Tag.id).where(Tag.name.in_(tag_names))).scalars())
+
+    next_id = (db.session.execute(
+        db.select(db.func.max(Post.id))).scalar() or 0) + 1
+    start_date = datetime.now() - timedelta(minutes=count)
+    mu = max(median_paragraphs, 1)
+    # posts are assembled from a pool of pre-generated paragraphs, which is
+    # much cheaper than generating the text of every post from scratch
+    pool = generate_markdown(rnd, 2000).split('\n\n')
+    inserted = 0
+    while inserted < count:
+        posts = []
+        links = []
+        for _ in range(min(batch_size, count - inserted)):
+            post_id = next_id + inserted
+            paragraphs = max(1, int(rnd.lognormvariate(0, 0.8) * mu))
+            content = '\n\n'.join(rnd.choices(pool, k=paragraphs))
+            date = start_date + timedelta(minutes=inserted)
+            posts.append({
+                'id': post_id,
+                'title': 'Generated post {}'.format(post_id),
+                'slug': 'generated-post-{}'.format(post_id),
+                'content': content,
+                'notes': None,
+                'date': date,
+                'last_updated_date': date,
+                'is_draft': rnd.random() < draft_ratio,
+                **render_post_content(content),
+            })
+            if tag_ids:
+                k = min(rnd.randint(0, 4), len(tag_ids))
+                links.extend({'tag_id': tag_id, 'post_id': post_id}
+                             for tag_id in rnd.sample(tag_ids, k))
+            inserted += 1
+        db.session.execute(db.insert(Post.__table__), posts)
+        if links:
+            db.session.execute(db.insert(tags_table), links)
+        db.session.commit()
+        if progress:
+            progress(inserted)
+
+    if num_pages:
+        next_page_id = (db.session.execute(
+            db.select(db.func.max(Page.id))).scalar() or 0) + 1
+        now = datetime.now()
+        pages = []
+        for i in range(num_pages):
+            content = generate_markdown(
+                rnd, max(1, int(rnd.lognormvariate(0, 0.8) * mu * 4)))
+            html, toc, word_count = render_document(content)
+            pages.append({
+                'id': next_page_id + i,
+                'title': 'Generated page {}'.format(next_page_id + i),
+                'slug': 'generated-page-{}'.format(next_page_id + i),
+                'content': content, 'content_html': html, 'toc': toc,
+                'word_count': word_count, 'notes': None, 'date': now,
+                'last_updated_date': now, 'published_date': now,
+                'is_draft': False})
+        db.session.execute(db.insert(Page.__table__), pages)
+    finish_bulk_insert([Post.__table__, Page.__table__])
+
+
+front_matter_re = re.compile(
+    r'^(---|\+\+\+)[ \t]*\r?\n(.*?)\r?\n\1[ \t]*(?:\r?\n|$)', re.DOTALL)
+
+
+def parse_front_matter(text):
+    m = front_matter_re.match(text)
+    if not m:
+        return {}, text
+    if m.group(1) == '---':
+        import yaml
+        meta = yaml.safe_load(m.group(2))
+    else:
+        import tomllib
+        meta = tomllib.loads(m.group(2))
+    if not isinstance(meta, dict):
+        meta = {}
+    return meta, text[m.end():]
+
+
+def prepare_markdown_file(path):
+    # runs in a worker process
+    try:
+        with open(path, encoding='utf-8') as f:
+            meta, body = parse_front_matter(f.read())
+        title = str(meta.get('title') or
+                    os.path.splitext(os.path.basename(path))[0])
+        slug = slugify(str(meta.get('slug') or title))
+        if not slug:
+            raise ValueError('No usable title or slug')
+        date = meta.get('date')
+        if date is None:
+            date = datetime.fromtimestamp(os.path.getmtime(path))
+        elif isinstance(date, str):
+            date = dateutil.parser.parse(date)
+        elif not isinstance(date, datetime) and isinstance(date, date_type):
+            date = datetime(date.year, date.month, date.day)
+        if getattr(date, 'tzinfo', None) is not None:
+            date = date.replace(tzinfo=None)
+        tags = meta.get('tags') or []
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        tags = sorted(set(str(t).strip() for t in tags if str(t).strip()))
+        return {
+            'path': path,
+            'title': title[:100],
+            'slug': slug[:100],
+            'content': body,
+            'rendered': render_post_content(body),
+            'date': date,
+            'is_draft': bool(meta.get('draft', False)),
+            'tags': tags,
+        }
+    except Exception as e:
+        return {'path': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def find_markdown_files(directory):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.lower().endswith(('.md', '.markdown')):
+                paths.append(os.path.join(dirpath, fname))
+    return paths
+
+
+def get_or_create_tag_ids(names):
+    if not names:
+        return {}
+    stmt = db.select(Tag.name, Tag.id).where(Tag.name.in_(names))
+    tag_ids = dict(db.session.execute(stmt).all())
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        db.session.execute(db.insert(Tag.__table__),
+                           [{'name': name} for name in missing])
+        tag_ids = dict(db.session.execute(stmt).all())
+    return tag_ids
+
+
+def import_markdown(directory, batch_size=500, workers=None, progress=None):
+    # existing slugs are skipped, so an interrupted import can be re-run
+    paths = find_markdown_files(directory)
+    imported = 0
+    skipped = 0
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for offset in range(0, len(paths), batch_size):
+            batch = list(executor.map(prepare_markdown_file,
+                                      paths[offset:offset + batch_size],
+                                      chunksize=8))
+            rows = []
+            for row in batch:
+                if 'error' in row:
+                    errors.append((row['path'], row['error']))
+                else:
+                    rows.append(row)
+            slugs = [row['slug'] for row in rows]
+            existing = set(db.session.execute(
+                db.select(Post.slug).where(Post.slug.in_(slugs))).scalars())
+            new_rows = []
+            for row in rows:
+                if row['slug'] in existing:
+                    skipped += 1
+                    continue
+                existing.add(row['slug'])
+                new_rows.append(row)
+            if new_rows:
+                db.session.execute(db.insert(Post.__table__), [
+                    {'title': row['title'], 'slug': row['slug'],
+                     'content': row['content'], 'notes': None,
+                     'date': row['date'], 'last_updated_date': row['date'],
+                     'is_draft': row['is_draft'], **row['rendered']}
+                    for row in new_rows])
+                post_ids = dict(db.session.execute(
+                    db.select(Post.slug, Post.id).where(Post.slug.in_(
+                        [row['slug'] for row in new_rows]))).all())
+                tag_ids = get_or_create_tag_ids(
+                    sorted(set(t for row in new_rows for t in row['tags'])))
+                links = [{'tag_id': tag_ids[t],
+                          'post_id': post_ids[row['slug']]}
+                         for row in new_rows for t in row['tags']]
+                if links:
+                    db.session.execute(db.insert(tags_table), links)
+            db.session.commit()
+            imported += len(new_rows)
+            if progress:
+                progress(offset + len(batch), len(paths))
+    finish_bulk_insert()
+    return imported, skipped, errors
+
+
+JSONL_TABLES = ('tag', 'post', 'tags_posts', 'page', 'option', 'revision',
+                'media')
+JSONL_FORMAT = 'plantagenet-jsonl'
+
+
+def export_jsonl(f, yield_per=1000):
+    f.write(json.dumps({'format': JSONL_FORMAT, 'version': 1}) + '\n')
+    count = 0
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True,
+                                      yield_per=yield_per)
+        for name in JSONL_TABLES:
+            table = db.metadata.tables[name]
+            for row in conn.execute(db.select(table)):
+                values = {}
+                for key, value in row._mapping.items():
+                    if isinstance(value, datetime):
+                        value = value.isoformat()
+                    values[key] = value
+                f.write(json.dumps({'table': name, 'row': values}) + '\n')
+                count += 1
+    return count
+
+
+def reset_sequences(conn, tables):
+    if conn.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        if 'id' not in table.c:
+            continue
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM {0}), 0) + 1, false)"
+            .format(table.name)))  # nosec B608 - fixed table names
+
+
+def load_jsonl_rows(conn, f, tables, counts, batch_size):
+    batch = []
+    batch_table = None
+
+    def flush():
+        if batch:
+            conn.execute(db.insert(tables[batch_table]), batch)
+            counts[batch_table] += len(batch)
+            del batch[:]
+
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        name = record['table']
+        if name not in tables:
+            continue
+        if name != batch_table or len(batch) >= batch_size:
+            flush()
+            batch_table = name
+        table = tables[name]
+        row = {}
+        for key, value in record['row'].items():
+            if key not in table.c:
+                continue
+            if value is not None and isinstance(table.c[key].type,
+                                                db.DateTime):
+                value = datetime.fromisoformat(value)
+            row[key] = value
+        batch.append(row)
+    flush()
+
+
+def import_jsonl(f, batch_size=1000):
+    # secondary indexes are dropped during the load and rebuilt in the
+    # same transaction
+    header = json.loads(f.readline() or '{}')
+    if header.get('format') != JSONL_FORMAT:
+        raise PlantagenetError('Not a plantagenet JSONL export.')
+    tables = {name: db.metadata.tables[name] for name in JSONL_TABLES}
+    counts = {name: 0 for name in JSONL_TABLES}
+    reflected = db.MetaData()
+    with db.engine.connect() as conn:
+        indexes = [index for name in JSONL_TABLES
+                   for index in db.Table(name, reflected,
+                                         autoload_with=conn).indexes]
+    try:
+        with db.engine.begin() as conn:
+            for index in indexes:
+                index.drop(conn)
+            load_jsonl_rows(conn, f, tables, counts, batch_size)
+            for index in indexes:
+                index.create(conn)
+            reset_sequences(conn, tables.values())
+    except Exception:
+        # not every backend rolls back DDL (e.g. pysqlite)
+        with db.engine.begin() as conn:
+            inspector = inspect(conn)
+            existing = {i['name'] for name in JSONL_TABLES
+                        for i in inspector.get_indexes(name)}
+            for index in indexes:
+                if index.name not in existing:
+                    index.create(conn)
+        raise
+    finish_bulk_insert()
+    return counts
+
+
+def render_post_content(content):
+    # module level, so that it can run in worker processes
+    content = content or ''
+    html, toc, word_count = render_document(content)
+    return {
+        'summary': Post.summarize(content),
+        'content_html': html,
+        'excerpt_html': Post.render_excerpt(content),
+        'toc': toc,
+        'word_count': word_count,
+    }
+
+
+def reset_all_summaries(batch_size=500, workers=None, commit=False,
+                        progress=None):
+    table = Post.__table__
+    update = (db.update(table).where(table.c.id == db.bindparam('_id'))
+              .values({name: db.bindparam(name)
+                       for name in render_post_content('')}))
+    count = 0
+
+    def write(post_ids, rendered):
+        nonlocal count
+        db.session.execute(update, [
+            dict(values, _id=post_id)
+            for post_id, values in zip(post_ids, rendered)])
+        if commit:
+            db.session.commit()
+        count += len(post_ids)
+        if progress:
+            progress(count)
+
+    executor = None
+    if workers:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        previous = None
+        last_id = None
+        while True:
+            stmt = (db.select(table.c.id, table.c.content)
+                    .order_by(table.c.id).limit(batch_size))
+            if last_id is not None:
+                stmt = stmt.where(table.c.id > last_id)
+            rows = db.session.execute(stmt).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            contents = [content for _, content in rows]
+            if executor:
+                # executor.map submits the whole batch right away
+                rendered = executor.map(
+                    render_post_content, contents,
+                    chunksize=max(1, len(contents) // (workers * 4)))
+            else:
+                rendered = map(render_post_content, contents)
+            if previous:
+                write(*previous)
+            previous = ([post_id for post_id, _ in rows], rendered)
+        if previous:
+            write(*previous)
+    finally:
+        if executor:
+            executor.shutdown()
+    return count
+
+
+def get_post_for_command(post_id):
+    post = db.session.get(Post, post_id)
+    if not post:
+        raise NotFound('No post found with id {}'.format(post_id))
+    return post
+
+
+def batch_reset_slug(post_id):
+    post = get_post_for_command(post_id)
+    old_slug = post.slug
+    post.slug = post.get_unique_slug(post.title)
+    return 'slug of post {} changed from "{}" to "{}"'.format(
+        post_id, old_slug, post.slug)
+
+
+def batch_set_date(post_id, new_date):
+    post = get_post_for_command(post_id)
+    old_date = post.date
+    post.date = dateutil.parser.parse(new_date)
+    return 'date of post {} changed from "{}" to "{}"'.format(
+        post_id, old_date, post.date)
+
+
+def batch_set_last_updated_date(post_id, new_date):
+    post = get_post_for_command(post_id)
+    old_date = post.last_updated_date
+    post.last_updated_date = dateutil.parser.parse(new_date)
+    return 'last updated date of post {} changed from "{}" to "{}"'.format(
+        post_id, old_date, post.last_updated_date)
+
+
+def batch_reset_summary(post_id):
+    if post_id == 'all':
+        count = reset_all_summaries()
+        return 'summaries of {} posts reset'.format(count)
+    post = get_post_for_command(post_id)
+    post.content = post.content
+    return 'summary of post {} reset to "{}"'.format(post_id, post.summary)
+
+
+def batch_set_option(name, value):
+    option = db.session.get(Option, name)
+    if option:
+        old_value = option.value
+        option.value = value
+        return 'option {} changed from "{}" to "{}"'.format(
+            name, old_value, value)
+    db.session.add(Option(name, value))
+    return 'option {} created with value "{}"'.format(name, value)
+
+
+def batch_clear_option(name):
+    option = db.session.get(Option, name)
+    if not option:
+        raise NotFound('No option found with name {}'.format(name))
+    db.session.delete(option)
+    return 'option {} cleared'.format(name)
+
+
+def batch_make_media_variants(sha256):
+    media = Media.get_by_sha256(sha256)
+    if not media:
+        raise NotFound('No media found with sha256 {}'.format(sha256))
+    formats = MEDIA_VARIANT_SOURCES.get(media.extension)
+    if not formats:
+        raise BadRequest('Media {} is not an image that can be '
+                         'resized'.format(sha256))
+    media_root = current_app.config['MEDIA_ROOT']
+    if not media_root or not HAVE_PILLOW:
+        raise BadRequest('Resizing images requires a media root and Pillow')
+    count = generate_variants(media_root, sha256, formats,
+                              current_app.config['MEDIA_VARIANT_BUDGET'])
+    return 'made {} variants of media {}'.format(count, sha256)
+
+
+def batch_encode_revisions(kind, document_id):
+    model = {'post': Post, 'page': Page}.get(kind)
+    if model is None:
+        raise BadRequest('Unknown kind {}'.format(kind))
+    document = db.session.get(model, document_id)
+    if document is None:
+        raise NotFound('No {} found with id {}'.format(kind, document_id))
+    count, before, after = Revision.encode_deferred(Revision.of(document))
+    return 'encoded {} revisions of {} {} from {} to {} bytes'.format(
+        count, kind, document_id, before, after)
+
+
+BATCH_COMMANDS = {
+    'reset-slug': batch_reset_slug,
+    'set-date': batch_set_date,
+    'set-last-updated-date': batch_set_last_updated_date,
+    'reset-summary': batch_reset_summary,
+    'set-option': batch_set_option,
+    'clear-option': batch_clear_option,
+    'make-media-variants': batch_make_media_variants,
+    'encode-revisions': batch_encode_revisions,
+}
+
+
+def run_batch(lines, batch_size=1000, report=None):
+    # each command runs in its own savepoint; returns (line_number, ok,
+    # message) for each line
+    results = []
+    pending = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            words = shlex.split(line, comments=True)
+        except ValueError as e:
+            words = None
+            result = (number, False, str(e))
+        if words == []:
+            continue
+        if words:
+            name = words[0]
+            if name.startswith('--'):
+                name = name[2:]
+            command = BATCH_COMMANDS.get(name)
+            if command is None:
+                result = (number, False, 'Unknown command {}'.format(name))
+            else:
+                savepoint = db.session.begin_nested()
+                try:
+                    message = command(*words[1:])
+                    savepoint.commit()
+                    result = (number, True, message)
+                    pending += 1
+                except Exception as e:
+                    savepoint.rollback()
+                    result = (number, False, describe_error(e))
+        results.append(result)
+        if report:
+            report(*result)
+        if pending >= batch_size:
+            db.session.commit()
+            pending = 0
+    db.session.commit()
+    return results
+
+
 def reset_slug(post_id):
     post = db.session.get(Post, post_id)
     if not post:
@@ -857,6 +3853,16 @@ def run():
         print(f"Effective DB URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
         print('Secret Key: {}'.format(Config.SECRET_KEY))
     print('Local Resources: {}'.format(Config.LOCAL_RESOURCES))
+    print('Server Timing: {}'.format(Config.SERVER_TIMING))
+    print('Metrics: {}'.format(Config.METRICS))
+    if Config.SLOW_QUERY_THRESHOLD is not None:
+        print('Slow query threshold: {} ms'.format(
+            Config.SLOW_QUERY_THRESHOLD))
+    if Config.METRICS_DIR:
+        print('Metrics dir: {}'.format(Config.METRICS_DIR))
+    if Config.MEDIA_ROOT:
+        print('Media root: {}'.format(Config.MEDIA_ROOT))
+    print('Job workers: {}'.format(Config.JOB_WORKERS))
 
     if args.create_db:
         cmd_create_db()
@@ -866,6 +3872,122 @@ def run():
         c = db.session.execute(
             db.select(db.func.count()).select_from(Post)).scalar()
         print(f'Found {c} posts.')
+    elif args.generate_posts is not None:
+        start = time.perf_counter()
+
+        def progress(n):
+            elapsed = time.perf_counter() - start
+            print('Inserted {} of {} posts ({:.0f} posts/s)'.format(
+                n, args.generate_posts, n / elapsed if elapsed else 0))
+
+        with app.app_context():
+            generate_posts(args.generate_posts, num_tags=args.generate_tags,
+                           median_paragraphs=args.generate_paragraphs,
+                           draft_ratio=args.generate_draft_ratio,
+                           num_pages=args.generate_pages,
+                           batch_size=args.generate_batch_size,
+                           seed=args.generate_seed, progress=progress)
+        print('Done in {:.1f}s'.format(time.perf_counter() - start))
+    elif args.rename_tag is not None:
+        old_name, new_name = args.rename_tag
+        try:
+            with app.app_context():
+                Tag.rename(old_name, new_name)
+            print('Renamed tag {} to {}'.format(old_name, new_name))
+        except (BadRequest, NotFound) as e:
+            print(e.description)
+            exit(1)
+    elif args.merge_tags is not None:
+        target, sources = args.merge_tags[0], args.merge_tags[1:]
+        try:
+            with app.app_context():
+                moved = Tag.merge(target, sources)
+            print('Merged {} into {} ({} posts retagged)'.format(
+                ', '.join(sources), target, moved))
+        except (BadRequest, NotFound) as e:
+            print(e.description)
+            exit(1)
+    elif args.delete_orphan_tags:
+        with app.app_context():
+            count = Tag.delete_orphans()
+        print('Deleted {} tags without posts'.format(count))
+    elif args.reconcile_tag_counts:
+        with app.app_context():
+            count = Tag.reconcile_counts()
+            db.session.commit()
+        print('Fixed the post counts of {} tags'.format(count))
+    elif args.prune_revisions is not None:
+        try:
+            with app.app_context():
+                count = Revision.prune(args.prune_revisions)
+                db.session.commit()
+            print('Deleted {} revisions'.format(count))
+        except BadRequest as e:
+            print(e.description)
+            exit(1)
+    elif args.compact_revisions:
+        with app.app_context():
+            count, before, after = Revision.compact()
+            db.session.commit()
+        print('Compacted the revisions of {} posts and pages from {} to {} '
+              'bytes'.format(count, before, after))
+    elif args.generate_media_variants:
+        if not Config.MEDIA_ROOT or not HAVE_PILLOW:
+            print('Resizing images requires --media-root and Pillow')
+            exit(1)
+        with app.app_context():
+            count = generate_all_variants(
+                Config.MEDIA_ROOT, Config.MEDIA_VARIANT_BUDGET,
+                workers=Config.MEDIA_WORKERS)
+        print('Made {} image variants'.format(count))
+    elif args.enqueue_job is not None:
+        name = args.enqueue_job[0]
+        if name not in BATCH_COMMANDS:
+            print('Unknown command {}'.format(name))
+            exit(1)
+        with app.app_context():
+            added = Job.enqueue(*args.enqueue_job)
+            db.session.commit()
+        if added:
+            print('Queued {}'.format(' '.join(args.enqueue_job)))
+        else:
+            print('An identical job is already queued')
+    elif args.worker:
+        worker = JobWorker(app, max(1, Config.JOB_WORKERS))
+        print('Running jobs with {} threads'.format(worker.count))
+        worker.start()
+        try:
+            while True:
+                time.sleep(JOB_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.stop()
+    elif args.export_jsonl is not None:
+        with app.app_context(), open(args.export_jsonl, 'w') as f:
+            count = export_jsonl(f)
+        print('Exported {} rows to {}'.format(count, args.export_jsonl))
+    elif args.import_jsonl is not None:
+        with app.app_context(), open(args.import_jsonl) as f:
+            counts = import_jsonl(f)
+        for name, count in counts.items():
+            print('Imported {} {} rows'.format(count, name))
+    elif args.import_markdown is not None:
+        start = time.perf_counter()
+
+        def progress(n, total):
+            elapsed = time.perf_counter() - start
+            print('Processed {} of {} files ({:.0f} files/s)'.format(
+                n, total, n / elapsed if elapsed else 0))
+
+        with app.app_context():
+            imported, skipped, errors = import_markdown(
+                args.import_markdown, batch_size=args.import_batch_size,
+                workers=args.import_workers, progress=progress)
+        for path, error in errors:
+            print('Error in {}: {}'.format(path, error))
+        print('Imported {} posts, skipped {} existing, {} errors.'.format(
+            imported, skipped, len(errors)))
     elif args.reset_slug is not None:
         try:
             reset_slug(args.reset_slug)
@@ -895,6 +4017,38 @@ def run():
         db.session.add(post)
         db.session.commit()
         print('New last updated date is "{}"'.format(post.last_updated_date))
+    elif args.batch is not None:
+        start = time.perf_counter()
+
+        def report(number, ok, message):
+            print('{}: {} {}'.format(number, 'OK' if ok else 'FAILED',
+                                     message))
+
+        with app.app_context():
+            if args.batch == '-':
+                results = run_batch(sys.stdin, args.batch_size, report)
+            else:
+                with open(args.batch) as f:
+                    results = run_batch(f, args.batch_size, report)
+        failed = sum(1 for _, ok, _ in results if not ok)
+        print('Ran {} commands in {:.1f}s, {} failed'.format(
+            len(results), time.perf_counter() - start, failed))
+        if failed:
+            exit(1)
+    elif args.reset_summary == 'all':
+        start = time.perf_counter()
+
+        def progress(n):
+            elapsed = time.perf_counter() - start
+            print('Reset {} summaries ({:.0f} posts/s)'.format(
+                n, n / elapsed if elapsed else 0))
+
+        with app.app_context():
+            count = reset_all_summaries(
+                batch_size=args.reset_summary_batch_size,
+                workers=args.reset_summary_workers, commit=True,
+                progress=progress)
+        print('Reset the summaries of {} posts'.format(count))
     elif args.reset_summary is not None:
         post_id = args.reset_summary
         post = db.session.get(Post, post_id)
@@ -932,6 +4086,8 @@ def run():
         db.session.delete(option)
         db.session.commit()
     else:
+        # run the jobs left in the queue by a previous process
+        app.job_worker.start()
         app.run(debug=Config.DEBUG, host=Config.HOST, port=Config.PORT,
                 use_reloader=Config.DEBUG)
 
@@ -949,6 +4105,16 @@ def create_app(config=None):
         app.jinja_loader = jinja2.ChoiceLoader(extra_loaders)
 
     app.config['TEMPLATES_AUTO_RELOAD'] = True
+    app.config['SERVER_TIMING'] = Config.SERVER_TIMING
+    app.config['METRICS'] = Config.METRICS
+    app.config['METRICS_DIR'] = Config.METRICS_DIR
+    app.config['SLOW_QUERY_THRESHOLD'] = Config.SLOW_QUERY_THRESHOLD
+    app.config['PROFILE_HISTORY'] = Config.PROFILE_HISTORY
+    app.config['MEDIA_ROOT'] = Config.MEDIA_ROOT
+    app.config['MEDIA_ACCEL_REDIRECT'] = Config.MEDIA_ACCEL_REDIRECT
+    app.config['MEDIA_WORKERS'] = Config.MEDIA_WORKERS
+    app.config['MEDIA_VARIANT_BUDGET'] = Config.MEDIA_VARIANT_BUDGET
+    app.config['JOB_WORKERS'] = Config.JOB_WORKERS
     app.config['SECRET_KEY'] = Config.SECRET_KEY  # for WTF-forms and login
 
     db_uri = 'sqlite://'
@@ -972,12 +4138,34 @@ def create_app(config=None):
 
     if config:
         app.config.update(config)
+    if app.config['PROFILE_HISTORY'] < 1:
+        # the newest profile would be pruned as soon as it is saved
+        raise ConfigError('PROFILE_HISTORY must be at least 1.')
 
     login_manager.init_app(app)
     db.init_app(app)
     app.db = db
+    app.archive_cache = {}
+    app.preview_cache = LRUCache(PREVIEW_CACHE_ENTRIES, PREVIEW_CACHE_SIZE,
+                                 preview_entry_size)
+    app.metrics = Metrics(app.config['METRICS'], app.config['METRICS_DIR'])
+    app.variant_pool = VariantPool(app.config['MEDIA_WORKERS'])
+    app.job_worker = JobWorker(app, app.config['JOB_WORKERS'])
+    app.explained_statements = set()
     bcrypt.init_app(app)
 
+    app.before_request(Options.clear_request_cache)
+    app.before_request(set_request_id)
+    app.before_request(profile_request)
+    app.after_request(add_request_id_header)
+
+    app.before_request(start_timing)
+    app.after_request(add_server_timing_header)
+    app.before_request(start_metrics)
+    app.after_request(record_request_metrics)
+    before_render_template.connect(start_template_timing, app)
+    template_rendered.connect(stop_template_timing, app)
+
     app.context_processor(setup_options)
     app.add_template_filter(render_gfm, name='gfm')
 
@@ -986,18 +4174,47 @@ def create_app(config=None):
     app.add_url_rule('/post/<slug>', 'get_post', get_post)
     app.add_url_rule('/edit/<slug>', 'edit_post', edit_post,
                      methods=['GET', 'POST'])
+    app.add_url_rule('/edit/<slug>/autosave', 'autosave_post', autosave_post,
+                     methods=['PATCH'])
+    app.add_url_rule('/edit/<slug>/promote', 'promote_post', promote_post,
+                     methods=['POST'])
+    app.add_url_rule('/post/<slug>/revisions', 'post_revisions',
+                     post_revisions)
+    app.add_url_rule('/post/<slug>/revisions/<int:number>', 'post_revision',
+                     post_revision)
     app.add_url_rule('/new', 'create_new', create_new, methods=['GET', 'POST'])
     app.add_url_rule('/tags', 'list_tags', list_tags)
     app.add_url_rule('/tags/<tag_id>', 'get_tag', get_tag)
+    app.add_url_rule('/archive', 'archive', archive)
+    app.add_url_rule('/archive/<int:year>', 'archive', archive)
+    app.add_url_rule('/archive/<int:year>/<int:month>', 'archive_month',
+                     archive_month)
     app.add_url_rule('/page', 'list_pages', list_pages)
     app.add_url_rule('/page/<slug>', 'view_page', view_page)
     app.add_url_rule('/page/<slug>/edit', 'edit_page', edit_page,
                      methods=['GET', 'POST'])
+    app.add_url_rule('/page/<slug>/revisions', 'page_revisions',
+                     page_revisions)
+    app.add_url_rule('/page/<slug>/revisions/<int:number>', 'page_revision',
+                     page_revision)
     app.add_url_rule('/new-page', 'create_new_page', create_new_page,
                      methods=['GET', 'POST'])
     app.add_url_rule('/logout', 'logout', logout)
     app.add_url_rule('/admin', 'admin', admin, methods=['GET', 'POST'])
+    app.add_url_rule('/admin/tags', 'admin_tags', admin_tags,
+                     methods=['POST'])
+    app.add_url_rule('/preview', 'preview', preview, methods=['POST'])
+    app.add_url_rule('/admin/profiles/<int:profile_id>', 'get_profile',
+                     get_profile)
+    app.add_url_rule('/admin/profiles/<int:profile_id>/pstats',
+                     'download_profile', download_profile)
     app.add_url_rule('/pages/<path:filename>', 'get_page', get_page)
+    app.add_url_rule('/metrics', 'get_metrics', get_metrics)
+    app.add_url_rule('/media', 'media_library', media_library)
+    app.add_url_rule('/media', 'upload_media', upload_media, methods=['POST'])
+    app.add_url_rule('/media/<sha256>.<extension>', 'get_media', get_media)
+    app.add_url_rule('/media/<sha256>/<int:width>.<fmt>', 'get_media_variant',
+                     get_media_variant)
 
     for code in [400, 401, 403, 404, 500, 503]:
         app.register_error_handler(code, handle_error)
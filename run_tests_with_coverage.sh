@@ -2,7 +2,7 @@
 
 coverage run --source=plantagenet -m pytest tests/ "$@" && \
     coverage html && \
-    flake8 plantagenet.py tests/ && \
+    flake8 plantagenet.py benchmark.py tests/ && \
     bandit plantagenet.py && \
     shellcheck run_tests_with_coverage.sh && \
     pymarkdown scan README.md && \
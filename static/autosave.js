@@ -0,0 +1,145 @@
+/* plantagenet - a python blogging system
+ * Copyright (C) 2016-2017 izrik
+ *
+ * This file is a part of plantagenet.
+ *
+ * Plantagenet is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Plantagenet is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with plantagenet.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/* Autosave for forms with a data-autosave-url attribute. A little while
+ * after each edit, the fields that changed since the last autosave are sent
+ * in a PATCH request, the content as a single splice of the text between
+ * the unchanged start and end, with the length of the text it applies to.
+ * The server keeps them in a draft buffer at the given revision; if that
+ * revision or length turns out to be stale, every field is sent in
+ * full. */
+(function () {
+    'use strict';
+
+    var DELAY = 2000;
+    var FIELDS = ['title', 'content', 'notes', 'tags'];
+
+    function Autosave(form) {
+        this.form = form;
+        this.url = form.getAttribute('data-autosave-url');
+        this.revision = parseInt(form.getAttribute('data-revision'), 10);
+        this.saved = this.values();
+        this.timer = null;
+        this.sending = false;
+        this.pending = false;
+        form.addEventListener('input', this.schedule.bind(this));
+        form.addEventListener('change', this.schedule.bind(this));
+        form.addEventListener('submit', function () {
+            clearTimeout(this.timer);
+            this.url = null;
+        }.bind(this));
+    }
+
+    Autosave.prototype.values = function () {
+        var values = {};
+        for (var i = 0; i < FIELDS.length; i++) {
+            values[FIELDS[i]] = this.form.elements[FIELDS[i]].value;
+        }
+        values.is_draft = this.form.elements.is_draft.checked;
+        return values;
+    };
+
+    Autosave.prototype.schedule = function () {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(this.save.bind(this), DELAY);
+    };
+
+    function splice(before, after) {
+        var start = 0;
+        var limit = Math.min(before.length, after.length);
+        while (start < limit && before[start] === after[start]) {
+            start++;
+        }
+        var end = 0;
+        while (end < limit - start &&
+               before[before.length - 1 - end] ===
+               after[after.length - 1 - end]) {
+            end++;
+        }
+        return {start: start, end: before.length - end,
+                text: after.substring(start, after.length - end)};
+    }
+
+    Autosave.prototype.changes = function (values, full) {
+        var changes = {}, count = 0;
+        for (var name in values) {
+            if (full || values[name] !== this.saved[name]) {
+                changes[name] = values[name];
+                count++;
+            }
+        }
+        if (!full && changes.content !== undefined) {
+            changes.content = [splice(this.saved.content, values.content)];
+        }
+        return count ? changes : null;
+    };
+
+    Autosave.prototype.save = function (full) {
+        if (!this.url) {
+            return;
+        }
+        if (this.sending) {
+            this.pending = true;
+            return;
+        }
+        var self = this;
+        var values = this.values();
+        var changes = this.changes(values, full === true);
+        if (!changes) {
+            return;
+        }
+        var body = {revision: this.revision, changes: changes};
+        if (Array.isArray(changes.content)) {
+            body.content_length = this.saved.content.length;
+        }
+        this.sending = true;
+        fetch(this.url, {
+            method: 'PATCH',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(body)
+        }).then(function (response) {
+            return response.json().then(function (data) {
+                return {status: response.status, data: data};
+            });
+        }).then(function (result) {
+            self.sending = false;
+            if (result.status === 409) {
+                self.revision = result.data.revision;
+                self.save(true);
+                return;
+            }
+            if (result.status === 200) {
+                self.revision = result.data.revision;
+                self.saved = values;
+            }
+            if (self.pending) {
+                self.pending = false;
+                self.save();
+            }
+        }, function () {
+            self.sending = false;
+        });
+    };
+
+    var forms = document.querySelectorAll('form[data-autosave-url]');
+    for (var i = 0; i < forms.length; i++) {
+        new Autosave(forms[i]);
+    }
+})();
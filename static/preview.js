@@ -0,0 +1,140 @@
+/* plantagenet - a python blogging system
+ * Copyright (C) 2016-2017 izrik
+ *
+ * This file is a part of plantagenet.
+ *
+ * Plantagenet is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * Plantagenet is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with plantagenet.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/* Live preview of textareas with a data-preview-url attribute, rendered by
+ * the server. The server splits the document into blocks and returns the
+ * hash and length of each. On later requests, the blocks at the start and
+ * end of the document that haven't changed are sent as {"hash": ...}, so
+ * only the edited part is uploaded and re-rendered. */
+(function () {
+    'use strict';
+
+    var DELAY = 300;
+
+    function Preview(textarea) {
+        this.textarea = textarea;
+        this.url = textarea.getAttribute('data-preview-url');
+        this.blocks = [];
+        this.sequence = 0;
+        this.timer = null;
+        this.output = document.createElement('div');
+        this.output.className = 'gfm-content preview';
+        textarea.parentNode.insertBefore(this.output, textarea.nextSibling);
+        textarea.addEventListener('input', this.schedule.bind(this));
+        this.update();
+    }
+
+    Preview.prototype.schedule = function () {
+        clearTimeout(this.timer);
+        this.timer = setTimeout(this.update.bind(this), DELAY);
+    };
+
+    Preview.prototype.items = function (content) {
+        var blocks = this.blocks;
+        var start = 0, end = content.length;
+        var first = 0, last = blocks.length;
+        while (first < last &&
+               content.substr(start, blocks[first].text.length) ===
+               blocks[first].text) {
+            start += blocks[first].text.length;
+            first++;
+        }
+        while (last > first &&
+               end - blocks[last - 1].text.length >= start &&
+               content.substring(end - blocks[last - 1].text.length, end) ===
+               blocks[last - 1].text) {
+            end -= blocks[last - 1].text.length;
+            last--;
+        }
+        var items = [], i;
+        for (i = 0; i < first; i++) {
+            items.push({hash: blocks[i].hash});
+        }
+        if (start < end) {
+            items.push(content.substring(start, end));
+        }
+        for (i = last; i < blocks.length; i++) {
+            items.push({hash: blocks[i].hash});
+        }
+        return items;
+    };
+
+    Preview.prototype.update = function () {
+        var content = this.textarea.value;
+        this.send(content, {blocks: this.items(content)});
+    };
+
+    Preview.prototype.send = function (content, body) {
+        var self = this;
+        var sequence = ++this.sequence;
+        fetch(this.url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(body)
+        }).then(function (response) {
+            if (response.status === 409) {
+                // blocks expired from the server's cache; send everything
+                self.blocks = [];
+                if (sequence === self.sequence) {
+                    self.send(content, {content: content});
+                }
+                return null;
+            }
+            return response.ok ? response.json() : null;
+        }).then(function (data) {
+            if (!data || sequence !== self.sequence) {
+                return;
+            }
+            self.show(content, data);
+        });
+    };
+
+    Preview.prototype.show = function (content, data) {
+        if (data.html !== undefined) {
+            this.blocks = [];
+            this.output.innerHTML = data.html;
+            return;
+        }
+        var known = {}, i;
+        for (i = 0; i < this.blocks.length; i++) {
+            known[this.blocks[i].hash] = this.blocks[i].html;
+        }
+        var blocks = [], html = [], offset = 0;
+        for (i = 0; i < data.blocks.length; i++) {
+            var block = data.blocks[i];
+            var blockHtml = block.html !== undefined ?
+                block.html : known[block.hash];
+            blocks.push({
+                hash: block.hash,
+                text: content.substr(offset, block.length),
+                html: blockHtml
+            });
+            html.push(blockHtml);
+            offset += block.length;
+        }
+        this.blocks = blocks;
+        this.output.innerHTML = html.join('');
+    };
+
+    var textareas = document.querySelectorAll('textarea[data-preview-url]');
+    for (var i = 0; i < textareas.length; i++) {
+        new Preview(textareas[i]);
+    }
+})();
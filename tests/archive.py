@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app
+
+
+def _add_posts(*posts):
+    for post in posts:
+        app.db.session.add(post)
+    app.db.session.commit()
+
+
+def test_archive_counts_groups_by_month(ctx):
+    _add_posts(
+        plantagenet.Post('a', 'content', datetime(2017, 1, 5)),
+        plantagenet.Post('b', 'content', datetime(2017, 1, 20)),
+        plantagenet.Post('c', 'content', datetime(2017, 3, 1)),
+        plantagenet.Post('d', 'content', datetime(2016, 12, 31)))
+
+    # when
+    result = plantagenet.Post.archive_counts()
+
+    # then months are returned newest first with their post counts
+    assert result == [(2017, 3, 1), (2017, 1, 2), (2016, 12, 1)]
+
+
+def test_archive_counts_excludes_drafts(ctx):
+    _add_posts(
+        plantagenet.Post('a', 'content', datetime(2017, 1, 5)),
+        plantagenet.Post('b', 'content', datetime(2017, 1, 20),
+                         is_draft=True))
+
+    assert plantagenet.Post.archive_counts() == [(2017, 1, 1)]
+    assert plantagenet.Post.archive_counts(include_drafts=True) == [
+        (2017, 1, 2)]
+
+
+def test_archive_counts_cache_invalidated_on_save(ctx):
+    post = plantagenet.Post('a', 'content', datetime(2017, 1, 5))
+    post.save()
+    assert plantagenet.Post.archive_counts() == [(2017, 1, 1)]
+
+    # when the post's date is changed
+    post.date = datetime(2018, 2, 1)
+    post.save()
+
+    # then the counts reflect the new date
+    assert plantagenet.Post.archive_counts() == [(2018, 2, 1)]
+
+
+def test_archive_counts_cache_invalidated_by_stamp(ctx):
+    post = plantagenet.Post('a', 'content', datetime(2017, 1, 5))
+    post.save()
+    assert plantagenet.Post.archive_counts() == [(2017, 1, 1)]
+
+    # when another process changes the date and bumps the stamp
+    plantagenet.db.session.execute(
+        plantagenet.db.update(plantagenet.Post).values(
+            date=datetime(2018, 2, 1)))
+    plantagenet.Options.set('archive_stamp', 'other')
+
+    # then the cached counts are not reused
+    assert plantagenet.Post.archive_counts() == [(2018, 2, 1)]
+
+
+def test_archive_counts_caches_drafts_and_published_separately(ctx,
+                                                               queries):
+    plantagenet.Post('a', 'content', datetime(2017, 1, 5)).save()
+    plantagenet.Post.archive_counts()
+    plantagenet.Post.archive_counts(include_drafts=True)
+    del queries[:]
+
+    # when both kinds of visitor view the archive
+    plantagenet.Post.archive_counts()
+    plantagenet.Post.archive_counts(include_drafts=True)
+
+    # then neither evicts the other
+    assert not any('count(' in q.lower() for q in queries)
+    assert len(ctx.archive_cache) == 2
+
+
+def test_list_for_month_keyset_pagination(ctx):
+    posts = [plantagenet.Post('p{}'.format(i), 'content',
+                              datetime(2017, 1, 1 + i))
+             for i in range(5)]
+    _add_posts(*posts)
+    _add_posts(plantagenet.Post('other', 'content', datetime(2017, 2, 1)))
+
+    # when
+    page1, more1 = plantagenet.Post.list_for_month(2017, 1, per_page=3)
+    last = page1[-1]
+    page2, more2 = plantagenet.Post.list_for_month(
+        2017, 1, per_page=3, before=last.date, before_id=last.id)
+
+    # then
+    assert [p.title for p in page1] == ['p4', 'p3', 'p2']
+    assert more1
+    assert [p.title for p in page2] == ['p1', 'p0']
+    assert not more2
+
+
+def test_archive_view_returns_200(cl):
+    _add_posts(plantagenet.Post('a', 'content', datetime(2017, 1, 5)))
+
+    response = cl.get('/archive')
+
+    assert response.status_code == 200
+    assert b'January 2017' in response.data
+
+
+def test_archive_year_view_missing_year_returns_404(cl):
+    _add_posts(plantagenet.Post('a', 'content', datetime(2017, 1, 5)))
+
+    response = cl.get('/archive/2010')
+
+    assert response.status_code == 404
+
+
+def test_archive_month_view_shows_posts(cl):
+    _add_posts(plantagenet.Post('My Post', 'content', datetime(2017, 1, 5)),
+               plantagenet.Post('Other', 'content', datetime(2017, 2, 5)))
+
+    response = cl.get('/archive/2017/1')
+
+    assert response.status_code == 200
+    assert b'My Post' in response.data
+    assert b'Other' not in response.data
+
+
+def test_archive_month_view_hides_drafts_from_unauthenticated(cl):
+    _add_posts(plantagenet.Post('Public', 'content', datetime(2017, 1, 5)),
+               plantagenet.Post('Secret', 'content', datetime(2017, 1, 6),
+                                is_draft=True))
+
+    response = cl.get('/archive/2017/1')
+
+    assert b'Public' in response.data
+    assert b'Secret' not in response.data
+
+
+@pytest.mark.parametrize('url', ['/archive/0/5', '/archive/99999/1',
+                                 '/archive/9999/12', '/archive/2017/13'])
+def test_archive_month_view_out_of_range_returns_404(cl, url):
+    response = cl.get(url)
+
+    assert response.status_code == 404
+
+
+def test_archive_month_view_invalid_before_returns_400(cl):
+    response = cl.get('/archive/2017/1?before=garbage&before_id=1')
+
+    assert response.status_code == 400
+
+
+def test_archive_counts_cache_invalidated_by_edit_post(cl, login):
+    post = plantagenet.Post('My Post', 'content', datetime(2017, 1, 5),
+                            is_draft=True)
+    post.save()
+    assert plantagenet.Post.archive_counts() == []
+
+    # when the post is published through the edit view
+    login()
+    cl.post('/edit/{}'.format(post.slug), data={
+        'title': 'My Post',
+        'content': 'content',
+        'notes': '',
+        'tags': '',
+    })
+
+    # then it is counted
+    assert plantagenet.Post.archive_counts() == [(2017, 1, 1)]
@@ -0,0 +1,227 @@
+from datetime import datetime
+
+import pytest
+from werkzeug.exceptions import BadRequest, Conflict
+
+import plantagenet
+from plantagenet import app
+
+
+def _autosave(cl, slug, revision, changes, content_length=None):
+    data = {'revision': revision, 'changes': changes}
+    if content_length is not None:
+        data['content_length'] = content_length
+    return cl.patch('/edit/{}/autosave'.format(slug), json=data)
+
+
+def test_apply_splices():
+    assert plantagenet.apply_splices('hello world', [
+        {'start': 0, 'end': 5, 'text': 'goodbye'},
+        {'start': 13, 'end': 13, 'text': '!'},
+    ]) == 'goodbye world!'
+
+
+def test_apply_splices_counts_utf16_code_units():
+    # the emoji is two code units in javascript, as is its replacement
+    assert plantagenet.apply_splices(
+        'a\U0001f600b', [{'start': 3, 'end': 4, 'text': 'c'}]) == \
+        'a\U0001f600c'
+    assert plantagenet.apply_splices(
+        'a\U0001f600b', [{'start': 1, 'end': 3, 'text': 'é'}]) == 'aéb'
+
+
+@pytest.mark.parametrize('splice', [
+    {'start': 2, 'end': 1},
+    {'start': 0, 'end': 4},
+    {'start': '0', 'end': 1},
+    {'start': 0, 'end': 1, 'text': 3},
+    {'start': 2, 'end': 2, 'text': 'x'},
+])
+def test_apply_splices_rejects_invalid_splices(splice):
+    with pytest.raises(BadRequest):
+        plantagenet.apply_splices('a\U0001f600', [splice])
+
+
+def test_buffer_rejects_stale_revision(ctx, make_post):
+    post = make_post()
+    buffer = plantagenet.DraftBuffer.for_post(post)
+    buffer.apply(0, {'title': 'New'})
+
+    with pytest.raises(Conflict):
+        buffer.apply(0, {'title': 'Newer'})
+    assert buffer.revision == 1
+    assert buffer.title == 'New'
+
+
+def test_autosave_requires_login(cl, make_post):
+    post = make_post()
+
+    response = _autosave(cl, post.slug, 0, {'title': 'New'})
+
+    assert response.status_code == 401
+    assert plantagenet.DraftBuffer.get_for_post(post) is None
+
+
+def test_autosave_missing_post_returns_404(cl, login):
+    login()
+
+    response = _autosave(cl, 'nonexistent', 0, {'title': 'New'})
+
+    assert response.status_code == 404
+
+
+def test_autosave_bad_request_returns_400(cl, login, make_post):
+    post = make_post()
+    login()
+
+    response = cl.patch('/edit/{}/autosave'.format(post.slug), json=[1])
+
+    assert response.status_code == 400
+    response = _autosave(cl, post.slug, 0, {'slug': 'x'})
+    assert response.status_code == 400
+
+
+def test_autosave_applies_deltas_to_the_buffer(cl, login, make_post):
+    post = make_post('My Post', 'a', content='hello world')
+    login()
+
+    response = _autosave(cl, post.slug, 0, {
+        'content': [{'start': 6, 'end': 11, 'text': 'there'}]}, 11)
+    assert response.status_code == 200
+    assert response.json == {'revision': 1}
+    response = _autosave(cl, post.slug, 1, {
+        'content': [{'start': 11, 'end': 11, 'text': '!'}],
+        'tags': 'a,b', 'is_draft': True}, 11)
+    assert response.json == {'revision': 2}
+
+    buffer = plantagenet.DraftBuffer.get_for_post(post)
+    assert buffer.content == 'hello there!'
+    assert buffer.title == 'My Post'
+    assert buffer.tags == 'a,b'
+    assert buffer.is_draft is True
+
+
+def test_autosave_splices_crlf_content_as_the_browser_sees_it(
+        cl, login, make_post):
+    post = make_post(content='line one\r\nline two\r\nline three')
+    login()
+
+    response = _autosave(cl, post.slug, 0, {
+        'content': [{'start': 23, 'end': 28, 'text': '3'}]}, 28)
+
+    assert response.status_code == 200
+    buffer = plantagenet.DraftBuffer.get_for_post(post)
+    assert buffer.content == 'line one\nline two\nline 3'
+
+
+def test_autosave_splice_against_a_different_length_conflicts(
+        cl, login, make_post):
+    post = make_post(content='hello world')
+    login()
+
+    response = _autosave(cl, post.slug, 0, {
+        'content': [{'start': 0, 'end': 5, 'text': 'bye'}]}, 12)
+    assert response.status_code == 409
+    assert response.json == {'revision': 0}
+    response = _autosave(cl, post.slug, 0, {
+        'content': [{'start': 0, 'end': 5, 'text': 'bye'}]})
+    assert response.status_code == 409
+
+    assert plantagenet.DraftBuffer.get_for_post(post) is None
+
+
+def test_autosave_conflict_returns_current_revision(cl, login, make_post):
+    post = make_post()
+    login()
+    _autosave(cl, post.slug, 0, {'title': 'New'})
+
+    response = _autosave(cl, post.slug, 0, {'title': 'Other'})
+
+    assert response.status_code == 409
+    assert response.json == {'revision': 1}
+    assert plantagenet.DraftBuffer.get_for_post(post).title == 'New'
+
+
+def test_autosave_leaves_the_post_alone(cl, login, queries, make_post):
+    post = make_post('My Post', 'a')
+    login()
+    del queries[:]
+
+    _autosave(cl, post.slug, 0, {'content': 'new content', 'tags': 'b',
+                                 'is_draft': True})
+
+    written = [q for q in queries
+               if q.split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+    assert written
+    assert all('draft_buffer' in q for q in written)
+    app.db.session.refresh(post)
+    assert post.content == 'content'
+    assert post.last_updated_date == datetime(2024, 1, 1)
+    assert [tag.name for tag in post.tags] == ['a']
+
+
+def test_edit_shows_the_buffer(cl, login, make_post):
+    post = make_post('My Post', 'a')
+    login()
+    _autosave(cl, post.slug, 0, {'content': 'buffered content', 'tags': 'b'})
+
+    response = cl.get('/edit/{}'.format(post.slug))
+
+    html = response.get_data(as_text=True)
+    assert 'buffered content' in html
+    assert 'value="b"' in html
+    assert 'data-revision="1"' in html
+    assert '/edit/{}/promote'.format(post.slug) in html
+
+
+def test_edit_without_buffer_starts_at_revision_0(cl, login, make_post):
+    post = make_post()
+    login()
+
+    response = cl.get('/edit/{}'.format(post.slug))
+
+    html = response.get_data(as_text=True)
+    assert 'data-revision="0"' in html
+    assert '/promote' not in html
+
+
+def test_promote_applies_and_deletes_the_buffer(cl, login, make_post):
+    post = make_post('My Post', 'a')
+    login()
+    _autosave(cl, post.slug, 0, {'title': 'New Title',
+                                 'content': 'new content', 'tags': 'b'})
+
+    response = cl.post('/edit/{}/promote'.format(post.slug))
+
+    assert response.status_code == 302
+    app.db.session.refresh(post)
+    assert post.title == 'New Title'
+    assert post.content == 'new content'
+    assert [tag.name for tag in post.tags] == ['b']
+    assert post.last_updated_date > datetime(2024, 1, 1)
+    assert plantagenet.DraftBuffer.get_for_post(post) is None
+
+
+def test_promote_with_empty_title_returns_400(cl, login, make_post):
+    post = make_post()
+    login()
+    _autosave(cl, post.slug, 0, {'title': '  '})
+
+    response = cl.post('/edit/{}/promote'.format(post.slug))
+
+    assert response.status_code == 400
+    app.db.session.refresh(post)
+    assert post.title == 'My Post'
+
+
+def test_saving_the_form_discards_the_buffer(cl, login, make_post):
+    post = make_post()
+    login()
+    _autosave(cl, post.slug, 0, {'content': 'buffered'})
+
+    cl.post('/edit/{}'.format(post.slug), data={
+        'title': 'My Post', 'content': 'saved', 'notes': '', 'tags': ''})
+
+    app.db.session.refresh(post)
+    assert post.content == 'saved'
+    assert plantagenet.DraftBuffer.get_for_post(post) is None
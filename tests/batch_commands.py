@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import db
+
+
+def test_run_batch_runs_each_command(ctx, make_post):
+    post = make_post('a')
+    lines = [
+        '# maintenance',
+        '',
+        'set-date {} 2020-02-03'.format(post.id),
+        '--set-last-updated-date {} "2020-02-04 10:00"'.format(post.id),
+        'set-option "site name" "My Blog"',
+    ]
+
+    # when
+    results = plantagenet.run_batch(lines)
+
+    # then
+    assert [(n, ok) for n, ok, _ in results] == [
+        (3, True), (4, True), (5, True)]
+    db.session.expire_all()
+    assert post.date == datetime(2020, 2, 3)
+    assert post.last_updated_date == datetime(2020, 2, 4, 10)
+    assert db.session.get(plantagenet.Option, 'site name').value == 'My Blog'
+
+
+def test_run_batch_failure_only_rolls_back_that_command(ctx, make_post,
+                                                        monkeypatch):
+    def write_then_fail(name):
+        db.session.add(plantagenet.Option(name, 'x'))
+        db.session.flush()
+        raise ValueError('boom')
+
+    monkeypatch.setitem(plantagenet.BATCH_COMMANDS, 'write-then-fail',
+                        write_then_fail)
+    post = make_post('a')
+    lines = [
+        'set-date {} 2020-02-03'.format(post.id),
+        'set-date {} not-a-date'.format(post.id),
+        'write-then-fail written',
+        'reset-slug 9999',
+        'frobnicate 1',
+        'set-option "unterminated',
+        'clear-option missing',
+        'set-option a b',
+    ]
+
+    # when
+    results = plantagenet.run_batch(lines)
+
+    # then
+    assert [ok for _, ok, _ in results] == [
+        True, False, False, False, False, False, False, True]
+    assert results[2][2] == 'ValueError: boom'
+    assert results[3][2] == 'No post found with id 9999'
+    assert results[4][2] == 'Unknown command frobnicate'
+    db.session.expire_all()
+    assert post.date == datetime(2020, 2, 3)
+    assert db.session.get(plantagenet.Option, 'written') is None
+    assert db.session.get(plantagenet.Option, 'a').value == 'b'
+
+
+def test_run_batch_commits_every_batch(ctx, monkeypatch):
+    commits = []
+    monkeypatch.setattr(db.session, 'commit',
+                        lambda: commits.append(1), raising=False)
+    lines = ['set-option o{} v'.format(i) for i in range(5)]
+
+    plantagenet.run_batch(lines, batch_size=2)
+
+    # after commands 2 and 4, and at the end
+    assert len(commits) == 3
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_reset_all_summaries(ctx, workers, make_post):
+    posts = [make_post('p{}'.format(i), content='content {}'.format(i))
+             for i in range(5)]
+    db.session.execute(db.update(plantagenet.Post).values(
+        summary=None, _content_html=None))
+    db.session.commit()
+    progress = []
+
+    # when
+    count = plantagenet.reset_all_summaries(batch_size=2, workers=workers,
+                                            commit=True,
+                                            progress=progress.append)
+
+    # then
+    assert count == 5
+    assert progress == [2, 4, 5]
+    db.session.expire_all()
+    for i, post in enumerate(posts):
+        assert post.summary == 'content {}'.format(i)
+        assert post.html == '<p>content {}</p>\n'.format(i)
+
+
+def test_run_batch_reset_summary_all(ctx, make_post):
+    post = make_post('a', content='new content')
+    db.session.execute(db.update(plantagenet.Post).values(summary='old'))
+    db.session.commit()
+
+    results = plantagenet.run_batch(['reset-summary all'])
+
+    assert results == [(1, True, 'summaries of 1 posts reset')]
+    db.session.expire_all()
+    assert post.summary == 'new content'
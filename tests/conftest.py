@@ -1,21 +1,39 @@
+from datetime import datetime
+
 import pytest
+from sqlalchemy import event
 
-from plantagenet import create_app, db
+from plantagenet import create_app, db, Post, Tag
 
 
 @pytest.fixture
-def ctx():
-    test_app = create_app({
-        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
-        'TESTING': True,
-    })
-    c = test_app.app_context()
-    c.push()
-    db.create_all()
-    yield test_app
-    db.session.rollback()
-    db.drop_all()
-    c.pop()
+def make_app():
+    contexts = []
+
+    def _make_app(**config):
+        test_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'TESTING': True,
+            'MEDIA_WORKERS': 0,
+            'JOB_WORKERS': 0,
+            **config,
+        })
+        c = test_app.app_context()
+        c.push()
+        contexts.append(c)
+        db.create_all()
+        return test_app
+
+    yield _make_app
+    for c in reversed(contexts):
+        db.session.rollback()
+        db.drop_all()
+        c.pop()
+
+
+@pytest.fixture
+def ctx(make_app):
+    return make_app()
 
 
 @pytest.fixture
@@ -30,3 +48,34 @@ def login(cl):
             sess['_user_id'] = 'admin'
             sess['_fresh'] = True
     return _login
+
+
+@pytest.fixture
+def make_post(ctx):
+    def _make_post(title='My Post', *tags, content='content',
+                   date=datetime(2024, 1, 1), is_draft=False):
+        post = Post(title, content, date, is_draft=is_draft)
+        post.tags.extend(Tag(tag) if isinstance(tag, str) else tag
+                         for tag in tags)
+        post.save()
+        return post
+    return _make_post
+
+
+@pytest.fixture
+def media_root(ctx, tmp_path):
+    root = tmp_path / 'media'
+    ctx.config['MEDIA_ROOT'] = str(root)
+    return root
+
+
+@pytest.fixture
+def queries(ctx):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import plantagenet
+from plantagenet import db
+
+
+CONTENT = 'Intro with *emphasis*.\n\n<!--more-->\n\nThe rest of the post.'
+
+
+def test_content_setter_stores_excerpt(ctx):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+
+    assert post.excerpt == '<p>Intro with <em>emphasis</em>.</p>\n'
+
+
+def test_marker_may_contain_spaces(ctx):
+    post = plantagenet.Post('title', 'a\n\n<!-- more -->\n\nb',
+                            datetime(2017, 1, 1))
+
+    assert post.excerpt == '<p>a</p>\n'
+
+
+def test_no_marker_no_excerpt(ctx):
+    post = plantagenet.Post('title', 'no marker', datetime(2017, 1, 1))
+
+    assert post.excerpt is None
+
+
+def test_index_renders_stored_excerpt(cl, monkeypatch):
+    # given
+    db.session.add(plantagenet.Post('title', CONTENT, datetime(2017, 1, 1)))
+    db.session.commit()
+
+    def fail(s):
+        raise AssertionError('render_gfm called')
+
+    monkeypatch.setattr(plantagenet, 'render_gfm', fail)
+
+    # when
+    response = cl.get('/')
+
+    # then
+    assert response.status_code == 200
+    assert b'<p>Intro with <em>emphasis</em>.</p>' in response.data
+    assert b'The rest of the post' not in response.data
+    assert b'Read more' in response.data
+
+
+def test_index_falls_back_to_summary(cl):
+    db.session.add(plantagenet.Post('title', 'Plain *content*.',
+                                    datetime(2017, 1, 1)))
+    db.session.commit()
+
+    response = cl.get('/')
+
+    assert b'<blockquote>Plain content. </blockquote>' in response.data
+    assert b'Read more' not in response.data
+
+
+def test_reset_all_summaries_fills_excerpt(ctx):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+    db.session.add(post)
+    db.session.commit()
+    db.session.execute(db.update(plantagenet.Post).values(_excerpt_html=None))
+    db.session.commit()
+
+    plantagenet.reset_all_summaries(commit=True)
+
+    db.session.expire_all()
+    assert post.excerpt == '<p>Intro with <em>emphasis</em>.</p>\n'
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app
+
+pytestmark = pytest.mark.usefixtures('ctx')
+
+
+def _count(model):
+    return app.db.session.execute(
+        app.db.select(app.db.func.count()).select_from(model)).scalar()
+
+
+def test_generate_posts_inserts_posts_tags_and_pages():
+    # when
+    plantagenet.generate_posts(30, num_tags=4, num_pages=3, batch_size=7,
+                               seed=1)
+
+    # then
+    assert _count(plantagenet.Post) == 30
+    assert _count(plantagenet.Tag) == 4
+    assert _count(plantagenet.Page) == 3
+
+
+def test_generate_posts_rows_are_consistent():
+    plantagenet.generate_posts(10, num_tags=3, seed=2)
+
+    for post in plantagenet.Post.query:
+        assert post.summary == plantagenet.Post.summarize(post.content)
+        assert post.slug == plantagenet.slugify(post.title)
+        assert len(set(post.tags)) == len(post.tags)
+
+
+def test_generate_posts_draft_ratio():
+    plantagenet.generate_posts(20, draft_ratio=1, seed=3)
+
+    assert all(post.is_draft for post in plantagenet.Post.query)
+
+
+def test_generate_posts_after_existing_posts():
+    # given an existing post
+    post = plantagenet.Post('title', 'content', datetime(2017, 1, 1))
+    post.save()
+
+    # when posts are generated twice
+    plantagenet.generate_posts(5, num_tags=2, seed=4)
+    plantagenet.generate_posts(5, num_tags=2, seed=5)
+
+    # then the ids and tags do not collide
+    assert _count(plantagenet.Post) == 11
+    assert _count(plantagenet.Tag) == 2
+
+
+def test_generate_posts_invalidates_archive_counts():
+    assert plantagenet.Post.archive_counts() == []
+
+    plantagenet.generate_posts(5, draft_ratio=0, seed=6)
+
+    assert sum(c for _, _, c in plantagenet.Post.archive_counts()) == 5
+
+
+def test_generate_posts_resets_the_id_sequences(monkeypatch):
+    reset = []
+    monkeypatch.setattr(plantagenet, 'reset_sequences',
+                        lambda conn, tables: reset.extend(
+                            table.name for table in tables))
+
+    plantagenet.generate_posts(3, num_tags=2, num_pages=1, seed=1)
+
+    assert reset == ['post', 'page']
@@ -0,0 +1,62 @@
+import plantagenet
+
+
+def test_fenced_code_is_highlighted():
+    html = plantagenet.render_gfm('```python\nif x < 1:\n    pass\n```\n')
+
+    assert html.startswith(
+        '<pre class="highlight"><code class="language-python">')
+    assert '<span class="k">if</span>' in html
+    assert '&lt;' in html
+    assert html.endswith('</code></pre>\n')
+
+
+def test_unknown_language_is_left_alone():
+    html = plantagenet.render_gfm('```nosuchlanguage\nx < 1\n```\n')
+
+    assert html == ('<pre><code class="language-nosuchlanguage">'
+                    'x &lt; 1\n</code></pre>\n')
+
+
+def test_code_without_language_is_left_alone():
+    html = plantagenet.render_gfm('```\nif x:\n```\n')
+
+    assert html == '<pre><code>if x:\n</code></pre>\n'
+
+
+def test_highlight_is_cached(monkeypatch):
+    import pygments
+    calls = []
+    original = pygments.highlight
+
+    def counting_highlight(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(pygments, 'highlight', counting_highlight)
+    code = 'print("cached {}")\n'.format(id(calls))
+
+    first = plantagenet.highlight_code('python', code)
+    second = plantagenet.highlight_code('python', code)
+    plantagenet.highlight_code('python3', code)
+
+    assert first == second
+    assert len(calls) == 2
+
+
+def test_highlight_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(plantagenet.highlight_cache, 'maxsize', 2)
+    plantagenet.highlight_cache.clear()
+
+    for i in range(5):
+        plantagenet.highlight_code('python', 'x = {}\n'.format(i))
+
+    assert len(plantagenet.highlight_cache) == 2
+
+
+def test_highlighted_html_is_stored(ctx):
+    from datetime import datetime
+    post = plantagenet.Post('title', '```python\nx = 1\n```\n',
+                            datetime(2017, 1, 1))
+
+    assert 'class="highlight"' in str(post.html)
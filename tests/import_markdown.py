@@ -0,0 +1,127 @@
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app
+
+pytestmark = pytest.mark.usefixtures('ctx')
+
+
+@pytest.fixture
+def blog_dir():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, '2017'))
+        files = {
+            'first.md': (
+                '---\n'
+                'title: First Post\n'
+                'date: 2017-01-02 03:04:05\n'
+                'tags: [python, flask]\n'
+                '---\n'
+                'Hello, *world*.\n'),
+            '2017/second.markdown': (
+                '+++\n'
+                'title = "Second Post"\n'
+                'date = 2017-02-03\n'
+                'tags = "python, sql"\n'
+                'draft = true\n'
+                'slug = "second"\n'
+                '+++\n'
+                '# Heading\n'),
+            'no-front-matter.md': 'Just text.\n',
+            'ignored.txt': 'not markdown',
+        }
+        for name, text in files.items():
+            with open(os.path.join(tmpdir, name), 'w') as f:
+                f.write(text)
+        yield tmpdir
+
+
+def test_parse_front_matter_yaml():
+    meta, body = plantagenet.parse_front_matter(
+        '---\ntitle: T\ntags: [a, b]\n---\nbody\n')
+
+    assert meta == {'title': 'T', 'tags': ['a', 'b']}
+    assert body == 'body\n'
+
+
+def test_parse_front_matter_toml():
+    meta, body = plantagenet.parse_front_matter(
+        '+++\ntitle = "T"\ndraft = true\n+++\nbody')
+
+    assert meta == {'title': 'T', 'draft': True}
+    assert body == 'body'
+
+
+def test_parse_front_matter_missing():
+    meta, body = plantagenet.parse_front_matter('---- not front matter')
+
+    assert meta == {}
+    assert body == '---- not front matter'
+
+
+def test_import_markdown_creates_posts(blog_dir):
+    # when
+    imported, skipped, errors = plantagenet.import_markdown(
+        blog_dir, workers=2)
+
+    # then
+    assert (imported, skipped, errors) == (3, 0, [])
+    first = plantagenet.Post.get_by_slug('first-post')
+    assert first.title == 'First Post'
+    assert first.date == datetime(2017, 1, 2, 3, 4, 5)
+    assert first.summary == plantagenet.Post.summarize('Hello, *world*.\n')
+    assert '<em>world</em>' in first.html
+    assert not first.is_draft
+    assert sorted(t.name for t in first.tags) == ['flask', 'python']
+
+    second = plantagenet.Post.get_by_slug('second')
+    assert second.is_draft
+    assert second.date == datetime(2017, 2, 3)
+    assert sorted(t.name for t in second.tags) == ['python', 'sql']
+
+    assert plantagenet.Post.get_by_slug('no-front-matter') is not None
+
+
+def test_import_markdown_reuses_existing_tags(blog_dir):
+    tag = plantagenet.Tag('python')
+    app.db.session.add(tag)
+    app.db.session.commit()
+
+    plantagenet.import_markdown(blog_dir, workers=1)
+
+    tags = app.db.session.execute(
+        plantagenet.db.select(plantagenet.Tag).filter_by(
+            name='python')).scalars().all()
+    assert tags == [tag]
+    assert len(tag.posts) == 2
+
+
+def test_import_markdown_is_idempotent(blog_dir):
+    plantagenet.import_markdown(blog_dir, workers=1, batch_size=2)
+
+    # when the import is run again
+    imported, skipped, errors = plantagenet.import_markdown(
+        blog_dir, workers=1, batch_size=2)
+
+    # then nothing new is imported
+    assert (imported, skipped) == (0, 3)
+    count = app.db.session.execute(
+        plantagenet.db.select(plantagenet.db.func.count(
+            plantagenet.Post.id))).scalar()
+    assert count == 3
+
+
+def test_import_markdown_reports_bad_files(blog_dir):
+    with open(os.path.join(blog_dir, 'bad.md'), 'w') as f:
+        f.write('---\ntitle: [unclosed\n---\nbody\n')
+
+    imported, skipped, errors = plantagenet.import_markdown(
+        blog_dir, workers=1)
+
+    assert imported == 3
+    assert len(errors) == 1
+    assert errors[0][0].endswith('bad.md')
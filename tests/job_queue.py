@@ -0,0 +1,341 @@
+from datetime import datetime, timedelta
+import time
+
+import pytest
+
+import plantagenet
+from plantagenet import app, Job, Media, Option, Post
+
+SHA = 'cd' * 32
+
+
+def _pending():
+    return app.db.session.execute(
+        app.db.select(Job).filter_by(status='pending')).scalars().all()
+
+
+def test_enqueue_stores_identical_pending_jobs_once(ctx):
+    assert Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    assert not Job.enqueue('set-option', 'name', 'value')
+    assert Job.enqueue('set-option', 'name', 'other')
+    app.db.session.commit()
+    assert len(_pending()) == 2
+
+
+def test_claimed_job_no_longer_blocks_an_identical_one(ctx):
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    job = Job.claim()
+
+    assert job.status == 'running'
+    assert job.attempts == 1
+    assert job.dedup_key is None
+    assert Job.enqueue('set-option', 'name', 'value')
+
+
+def test_run_next_job_runs_the_command_and_deletes_the_job(ctx):
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    job_id, ok, message = plantagenet.run_next_job()
+
+    assert ok
+    assert message == 'option name created with value "value"'
+    assert app.db.session.get(Option, 'name').value == 'value'
+    assert app.db.session.get(Job, job_id) is None
+    assert plantagenet.run_next_job() is None
+
+
+def test_jobs_run_in_order(ctx):
+    Job.enqueue('set-option', 'name', 'first')
+    Job.enqueue('set-option', 'name', 'second')
+    app.db.session.commit()
+
+    plantagenet.run_next_job()
+    plantagenet.run_next_job()
+
+    assert app.db.session.get(Option, 'name').value == 'second'
+
+
+def test_failing_job_is_retried_with_backoff(ctx, monkeypatch):
+    def fail(name, value):
+        raise ValueError('boom')
+
+    monkeypatch.setitem(plantagenet.BATCH_COMMANDS, 'set-option', fail)
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    job_id, ok, message = plantagenet.run_next_job()
+
+    assert not ok
+    assert message == 'ValueError: boom'
+    job = app.db.session.get(Job, job_id)
+    assert job.status == 'pending'
+    assert job.last_error == 'ValueError: boom'
+    assert job.run_after > datetime.now() + timedelta(
+        seconds=plantagenet.JOB_RETRY_DELAY - 5)
+    assert job.dedup_key is not None
+    # not due yet
+    assert plantagenet.run_next_job() is None
+
+    job.run_after = datetime.now()
+    app.db.session.commit()
+    plantagenet.run_next_job()
+    job = app.db.session.get(Job, job_id)
+    assert job.attempts == 2
+    assert job.run_after > datetime.now() + timedelta(
+        seconds=2 * plantagenet.JOB_RETRY_DELAY - 5)
+
+
+def test_job_fails_after_max_attempts(ctx, monkeypatch):
+    def fail(name, value):
+        raise ValueError('boom')
+
+    monkeypatch.setitem(plantagenet.BATCH_COMMANDS, 'set-option', fail)
+    Job.enqueue('set-option', 'name', 'value')
+    _pending()[0].attempts = plantagenet.JOB_MAX_ATTEMPTS - 1
+    app.db.session.commit()
+
+    job_id, ok, _ = plantagenet.run_next_job()
+
+    job = app.db.session.get(Job, job_id)
+    assert job.status == 'failed'
+    assert job.dedup_key is None
+    assert Job.depth() == {'failed': 1}
+
+
+def test_http_errors_are_not_retried(ctx):
+    Job.enqueue('reset-slug', '123')
+    app.db.session.commit()
+
+    job_id, ok, message = plantagenet.run_next_job()
+
+    assert not ok
+    assert message == 'No post found with id 123'
+    assert app.db.session.get(Job, job_id).status == 'failed'
+
+
+def test_failed_changes_are_rolled_back(ctx, monkeypatch):
+    def fail(name, value):
+        app.db.session.add(Option(name, value))
+        app.db.session.flush()
+        raise ValueError('boom')
+
+    monkeypatch.setitem(plantagenet.BATCH_COMMANDS, 'set-option', fail)
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    plantagenet.run_next_job()
+
+    assert app.db.session.get(Option, 'name') is None
+
+
+def test_retry_that_duplicates_a_pending_job_is_dropped(ctx, monkeypatch):
+    def fail(name, value):
+        Job.enqueue('set-option', name, value)
+        app.db.session.commit()
+        raise ValueError('boom')
+
+    monkeypatch.setitem(plantagenet.BATCH_COMMANDS, 'set-option', fail)
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    job_id, ok, _ = plantagenet.run_next_job()
+
+    assert not ok
+    assert app.db.session.get(Job, job_id) is None
+    assert len(_pending()) == 1
+
+
+def test_stale_running_job_is_claimed_again(ctx):
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+    job = Job.claim()
+    assert Job.claim() is None
+
+    job.started_date = datetime.now() - timedelta(
+        seconds=plantagenet.JOB_TIMEOUT + 1)
+    app.db.session.commit()
+
+    assert Job.claim().id == job.id
+    assert job.attempts == 2
+
+
+def test_saving_a_post_queues_its_images(ctx, tmp_path, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', True)
+    ctx.config['MEDIA_ROOT'] = str(tmp_path)
+    post = Post('Title', '![a](/media/{0}.jpg) ![b](/media/{0}.jpg) '
+                '[c](/media/{1}.pdf)'.format(SHA, 'ef' * 32),
+                datetime(2024, 1, 1))
+
+    post.save()
+
+    assert [job.args for job in _pending()] == [[SHA]]
+    assert _pending()[0].command == 'make-media-variants'
+
+
+def test_editing_a_post_queues_its_revision(ctx):
+    post = Post('Title', 'First', datetime(2024, 1, 1))
+    post.save()
+    assert _pending() == []
+
+    post.content = 'Second'
+    post.save()
+    post.content = 'Third'
+    post.save()
+
+    assert [(job.command, job.args) for job in _pending()] == [
+        ('encode-revisions', ['post', str(post.id)])]
+
+
+def test_saving_unchanged_content_queues_nothing(ctx, tmp_path,
+                                                 monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', True)
+    ctx.config['MEDIA_ROOT'] = str(tmp_path)
+    post = Post('Title', '![a](/media/{}.jpg)'.format(SHA),
+                datetime(2024, 1, 1))
+    post.save()
+    app.db.session.execute(app.db.delete(Job))
+
+    post.is_draft = True
+    post.save()
+
+    assert _pending() == []
+
+
+def test_saving_without_media_root_queues_nothing(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', True)
+    Post('Title', '![a](/media/{}.jpg)'.format(SHA),
+         datetime(2024, 1, 1)).save()
+
+    assert _pending() == []
+
+
+def test_commit_wakes_the_workers(ctx, monkeypatch):
+    woken = []
+    monkeypatch.setattr(ctx.job_worker, 'wake', lambda: woken.append(1))
+
+    app.db.session.commit()
+    assert woken == []
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+    assert woken == [1]
+
+
+def test_worker_threads_run_queued_jobs(make_app, tmp_path):
+    test_app = make_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'db'),
+        JOB_WORKERS=2)
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            app.db.session.rollback()
+            if app.db.session.get(Option, 'name') is not None:
+                break
+            time.sleep(0.05)
+        assert app.db.session.get(Option, 'name').value == 'value'
+        assert Job.depth() == {}
+    finally:
+        test_app.job_worker.stop()
+
+
+def test_make_media_variants_requires_an_image(ctx, tmp_path):
+    ctx.config['MEDIA_ROOT'] = str(tmp_path)
+    with pytest.raises(plantagenet.NotFound):
+        plantagenet.batch_make_media_variants(SHA)
+
+
+@pytest.fixture
+def image(ctx, tmp_path, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', True)
+    ctx.config['MEDIA_ROOT'] = str(tmp_path)
+    media = Media(sha256=SHA, size=3, content_type='image/jpeg',
+                  filename='photo.jpg', upload_date=datetime.now())
+    app.db.session.add(media)
+    app.db.session.commit()
+    return media
+
+
+def test_make_media_variants_writes_the_variants(ctx, image, tmp_path,
+                                                 monkeypatch):
+    made = []
+
+    def generate_variants(media_root, sha256, formats, budget):
+        made.append((media_root, sha256, formats))
+        return 2
+
+    monkeypatch.setattr(plantagenet, 'generate_variants', generate_variants)
+    Job.enqueue('make-media-variants', SHA)
+    app.db.session.commit()
+
+    job_id, ok, message = plantagenet.run_next_job()
+
+    assert ok
+    assert message == 'made 2 variants of media {}'.format(SHA)
+    assert made == [(str(tmp_path), SHA, ('webp', 'jpg'))]
+    assert app.db.session.get(Job, job_id) is None
+
+
+def test_make_media_variants_keeps_the_job_until_it_succeeds(ctx, image,
+                                                             monkeypatch):
+    def generate_variants(media_root, sha256, formats, budget):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(plantagenet, 'generate_variants', generate_variants)
+    Job.enqueue('make-media-variants', SHA)
+    app.db.session.commit()
+
+    job_id, ok, _ = plantagenet.run_next_job()
+
+    assert not ok
+    job = app.db.session.get(Job, job_id)
+    assert job.status == 'pending'
+    assert job.last_error == 'OSError: disk full'
+
+
+def test_encode_revisions_turns_saved_revisions_into_deltas(ctx):
+    first = ''.join('line {}\n'.format(i) for i in range(50))
+    post = Post('Title', first, datetime(2024, 1, 1))
+    post.save()
+    for i in range(3):
+        post.content += 'edit {}\n'.format(i)
+        post.save()
+    revisions = plantagenet.Revision.list_for(post)
+    assert [r.base == r.number for r in revisions] == [
+        True, True, True, False]
+
+    job_id, ok, message = plantagenet.run_next_job()
+
+    assert ok
+    assert message.startswith(
+        'encoded 3 revisions of post {} from '.format(post.id))
+    app.db.session.expire_all()
+    assert [r.base for r in plantagenet.Revision.list_for(post)] == [
+        3, 1, 1, None]
+    assert [plantagenet.Revision.load(post, n)[1] for n in (1, 4)] == [
+        first, post.content]
+
+
+def test_encode_revisions_requires_a_document(ctx):
+    with pytest.raises(plantagenet.NotFound):
+        plantagenet.batch_encode_revisions('post', '123')
+    with pytest.raises(plantagenet.BadRequest):
+        plantagenet.batch_encode_revisions('tag', '1')
+
+
+def test_metrics_report_the_queue_depth(ctx):
+    ctx.metrics.enabled = True
+    Job.enqueue('set-option', 'name', 'value')
+    app.db.session.commit()
+
+    response = ctx.test_client().get('/metrics')
+
+    text = response.get_data(as_text=True)
+    assert '# TYPE plantagenet_job_queue_depth gauge' in text
+    assert 'plantagenet_job_queue_depth{status="pending"} 1' in text
+    assert 'plantagenet_job_queue_depth{status="failed"} 0' in text
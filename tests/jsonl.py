@@ -0,0 +1,110 @@
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app, db
+
+
+def _populate():
+    tag1 = plantagenet.Tag('python')
+    tag2 = plantagenet.Tag('sql')
+    post1 = plantagenet.Post('First', '*one*', datetime(2017, 1, 2, 3, 4, 5))
+    post1.tags.extend([tag1, tag2])
+    post2 = plantagenet.Post('Second', 'two', datetime(2017, 2, 1),
+                             is_draft=True, notes='notes')
+    post2.tags.append(tag1)
+    page = plantagenet.Page('About', 'about', datetime(2017, 1, 1))
+    media = plantagenet.Media(sha256='ab' * 32, size=3,
+                              content_type='image/png', filename='a.png',
+                              upload_date=datetime(2017, 1, 3))
+    db.session.add_all([post1, post2, page, media,
+                        plantagenet.Option('sitename', 'My Site')])
+    db.session.commit()
+    post1.content = '*one*, edited'
+    db.session.commit()
+
+
+def test_export_jsonl_writes_every_table(ctx):
+    _populate()
+    f = io.StringIO()
+
+    # when
+    count = plantagenet.export_jsonl(f)
+
+    # then
+    lines = [json.loads(line) for line in f.getvalue().splitlines()]
+    assert lines[0]['format'] == 'plantagenet-jsonl'
+    tables = [line['table'] for line in lines[1:]]
+    assert count == len(tables)
+    assert tables.count('post') == 2
+    assert tables.count('tag') == 2
+    assert tables.count('tags_posts') == 3
+    assert tables.count('page') == 1
+    assert tables.count('revision') == 4
+    assert tables.count('media') == 1
+    assert 'option' in tables
+    post = next(line['row'] for line in lines[1:]
+                if line['table'] == 'post')
+    assert post['date'] == '2017-01-02T03:04:05'
+
+
+def test_import_jsonl_round_trip(ctx, make_app):
+    _populate()
+    f = io.StringIO()
+    plantagenet.export_jsonl(f)
+    f.seek(0)
+
+    # when the export is loaded into another, empty database
+    make_app()
+    counts = plantagenet.import_jsonl(f, batch_size=2)
+
+    # then
+    assert counts['post'] == 2
+    assert counts['tags_posts'] == 3
+    first = plantagenet.Post.get_by_slug('first')
+    assert first.date == datetime(2017, 1, 2, 3, 4, 5)
+    assert '<em>one</em>' in first.html
+    assert sorted(t.name for t in first.tags) == ['python', 'sql']
+    second = plantagenet.Post.get_by_slug('second')
+    assert second.is_draft
+    assert second.notes == 'notes'
+    assert plantagenet.Page.get_by_slug('about').content == 'about'
+    assert plantagenet.Options.get('sitename') == 'My Site'
+    # the history and the media library come along
+    assert [r.number for r in plantagenet.Revision.list_for(first)] == [2, 1]
+    assert plantagenet.Revision.load(first, 1)[1] == '*one*'
+    assert plantagenet.Media.get_by_sha256('ab' * 32).filename == 'a.png'
+    # the indexes are back
+    indexes = plantagenet.inspect(db.engine).get_indexes('post')
+    assert any(i['column_names'] == ['date'] for i in indexes)
+    # new rows get fresh ids
+    post = plantagenet.Post('Third', 'three', datetime(2018, 1, 1))
+    post.save()
+    assert post.id == 3
+
+
+def test_import_jsonl_rejects_other_files(ctx):
+    with pytest.raises(plantagenet.PlantagenetError):
+        plantagenet.import_jsonl(io.StringIO('{"something": "else"}\n'))
+
+
+def test_import_jsonl_rolls_back_on_error(ctx):
+    _populate()
+    f = io.StringIO()
+    plantagenet.export_jsonl(f)
+    f.seek(0)
+
+    # when the export is loaded into the same database, the ids collide
+    with pytest.raises(Exception):
+        plantagenet.import_jsonl(f)
+    app.db.session.rollback()
+
+    # then nothing was changed
+    count = db.session.execute(
+        db.select(db.func.count(plantagenet.Post.id))).scalar()
+    assert count == 2
+    indexes = plantagenet.inspect(db.engine).get_indexes('post')
+    assert any(i['column_names'] == ['date'] for i in indexes)
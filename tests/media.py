@@ -0,0 +1,228 @@
+from datetime import datetime, timedelta
+import hashlib
+import io
+import os
+
+import pytest
+
+import plantagenet
+from plantagenet import app, Media
+
+DATA = b'\x89PNG\r\n' + bytes(range(256)) * 1000
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+def _upload(cl, data=DATA, filename='photo.png'):
+    return cl.post('/media?filename={}'.format(filename), data=data,
+                   content_type='image/png')
+
+
+class ChunkCountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return super().read(size)
+
+
+def test_store_reads_in_chunks(ctx, media_root):
+    stream = ChunkCountingStream(DATA)
+
+    media, created = Media.store(stream, 'photo.png', 'image/png',
+                                 str(media_root))
+
+    assert created
+    assert media.sha256 == DIGEST
+    assert media.size == len(DATA)
+    assert set(stream.sizes) == {plantagenet.MEDIA_CHUNK_SIZE}
+    path = media_root / DIGEST[:2] / DIGEST[2:4] / DIGEST
+    assert path.read_bytes() == DATA
+    assert [p.name for p in media_root.iterdir()] == [DIGEST[:2]]
+
+
+def test_store_deduplicates(ctx, media_root):
+    first, _ = Media.store(io.BytesIO(DATA), 'a.png', 'image/png',
+                           str(media_root))
+    app.db.session.commit()
+
+    second, created = Media.store(io.BytesIO(DATA), 'b.png', 'image/png',
+                                  str(media_root))
+
+    assert not created
+    assert second.id == first.id
+    assert second.filename == 'a.png'
+    files = [f for _, _, names in os.walk(media_root) for f in names]
+    assert files == [DIGEST]
+
+
+def test_failed_store_leaves_no_file(ctx, media_root):
+    class BrokenStream(object):
+        def read(self, size):
+            raise IOError('connection reset')
+
+    with pytest.raises(IOError):
+        Media.store(BrokenStream(), 'a.png', 'image/png', str(media_root))
+
+    assert list(media_root.iterdir()) == []
+
+
+@pytest.mark.parametrize('filename, content_type, extension', [
+    ('photo.PNG', 'image/png', 'png'),
+    ('archive.tar.gz', 'application/gzip', 'gz'),
+    ('noextension', 'image/jpeg', 'jpg'),
+    ('../../evil.<script>', 'text/plain', 'txt'),
+    ('', 'application/x-unknown', 'bin'),
+])
+def test_media_extension(filename, content_type, extension):
+    assert plantagenet.media_extension(filename, content_type) == extension
+
+
+def test_upload_requires_login(cl, media_root):
+    assert _upload(cl).status_code == 401
+
+
+def test_upload_without_media_root_returns_404(cl, login):
+    login()
+
+    assert _upload(cl).status_code == 404
+
+
+def test_upload_raw_body(cl, login, media_root):
+    login()
+
+    response = _upload(cl)
+
+    assert response.status_code == 201
+    assert response.json['sha256'] == DIGEST
+    assert response.json['url'] == '/media/{}.png'.format(DIGEST)
+    assert response.json['filename'] == 'photo.png'
+    assert response.json['size'] == len(DATA)
+    assert _upload(cl, filename='copy.png').status_code == 200
+
+
+def test_upload_form(cl, login, media_root):
+    login()
+
+    response = cl.post('/media', data={
+        'file': (io.BytesIO(DATA), 'photo.png', 'application/octet-stream'),
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 302
+    media = Media.get_by_sha256(DIGEST)
+    assert media.content_type == 'image/png'
+    assert media.filename == 'photo.png'
+
+
+def test_upload_form_without_file_returns_400(cl, login, media_root):
+    login()
+
+    response = cl.post('/media', data={}, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+
+
+def test_get_media(cl, login, media_root, queries):
+    login()
+    _upload(cl)
+    del queries[:]
+
+    response = cl.get('/media/{}.png'.format(DIGEST))
+
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == plantagenet.MEDIA_MAX_AGE
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+    assert not [q for q in queries if 'media' in q]
+
+
+def test_get_media_range(cl, login, media_root):
+    login()
+    _upload(cl)
+
+    response = cl.get('/media/{}.png'.format(DIGEST),
+                      headers={'Range': 'bytes=10-19'})
+
+    assert response.status_code == 206
+    assert response.data == DATA[10:20]
+    assert response.headers['Content-Range'] == \
+        'bytes 10-19/{}'.format(len(DATA))
+
+
+def test_get_media_not_modified(cl, login, media_root):
+    login()
+    _upload(cl)
+
+    response = cl.get('/media/{}.png'.format(DIGEST),
+                      headers={'If-None-Match': '"{}"'.format(DIGEST)})
+
+    assert response.status_code == 304
+
+
+def test_get_media_accel_redirect(ctx, cl, login, media_root):
+    login()
+    _upload(cl)
+    ctx.config['MEDIA_ACCEL_REDIRECT'] = '/_media/'
+
+    response = cl.get('/media/{}.png'.format(DIGEST))
+
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == \
+        '/_media/{}/{}/{}'.format(DIGEST[:2], DIGEST[2:4], DIGEST)
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.immutable
+
+
+@pytest.mark.parametrize('url', [
+    '/media/{}.png'.format('0' * 64),
+    '/media/{}.png'.format(DIGEST[:-1]),
+    '/media/..%2F..%2Fsecret.png',
+])
+def test_get_media_404(cl, login, media_root, url):
+    login()
+    _upload(cl)
+
+    assert cl.get(url).status_code == 404
+
+
+def test_list_page_paginates_by_upload_date(ctx):
+    start = datetime(2024, 1, 1)
+    for i in range(7):
+        # two files per date, so that pages split ties by id
+        app.db.session.add(Media(
+            sha256='{:064x}'.format(i), size=1, content_type='image/png',
+            filename='{}.png'.format(i),
+            upload_date=start + timedelta(days=i // 2)))
+    app.db.session.commit()
+
+    pages = []
+    before = None
+    while True:
+        page = Media.list_page(before, limit=3)
+        pages.append([m.filename for m in page])
+        if len(page) < 3:
+            break
+        before = page[-1].id
+
+    assert pages == [['6.png', '5.png', '4.png'],
+                     ['3.png', '2.png', '1.png'],
+                     ['0.png']]
+
+
+def test_media_library(cl, login, media_root):
+    login()
+    _upload(cl)
+
+    response = cl.get('/media')
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '![photo.png](/media/{}.png)'.format(DIGEST) in html
+
+
+def test_media_library_requires_login(cl):
+    assert cl.get('/media').status_code == 401
@@ -0,0 +1,231 @@
+from concurrent.futures import Future
+import io
+import os
+import time
+
+import pytest
+
+import plantagenet
+from plantagenet import app, Media
+
+SHA = 'ab' * 32
+
+
+@pytest.fixture
+def pillow(monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', True)
+
+
+@pytest.fixture
+def submitted(ctx, monkeypatch):
+    calls = []
+    monkeypatch.setattr(ctx.variant_pool, 'submit',
+                        lambda app, media: calls.append(media.sha256))
+    return calls
+
+
+def _media(sha256=SHA, filename='photo.jpg', content_type='image/jpeg'):
+    media = Media(sha256=sha256, size=3, content_type=content_type,
+                  filename=filename, upload_date=plantagenet.datetime.now())
+    app.db.session.add(media)
+    app.db.session.commit()
+    return media
+
+
+def _write_variant(media_root, width=480, fmt='webp', data=b'variant',
+                   mtime=None):
+    path = plantagenet.variant_path(str(media_root), SHA, width, fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_jpeg_gets_webp_source_and_jpeg_srcset(pillow):
+    html = plantagenet.add_responsive_images(
+        '<p><img src="/media/{}.jpg" alt="A photo" /></p>'.format(SHA))
+
+    assert html.startswith('<p><picture><source type="image/webp" srcset="'
+                           '/media/{0}/480.webp 480w, '.format(SHA))
+    assert ' srcset="/media/{0}/480.jpg 480w, /media/{0}/960.jpg 960w, '\
+        .format(SHA) in html
+    assert '<img src="/media/{}.jpg"'.format(SHA) in html
+    assert html.endswith('loading="lazy" alt="A photo" /></picture></p>')
+
+
+def test_png_gets_webp_source_only(pillow):
+    html = plantagenet.add_responsive_images(
+        '<img src="/media/{}.png" alt="" />'.format(SHA))
+
+    assert 'image/webp' in html
+    assert '.jpg' not in html
+
+
+@pytest.mark.parametrize('html', [
+    '<img src="/media/{}.gif" alt="" />'.format(SHA),
+    '<img src="/media/{}.svg" alt="" />'.format(SHA),
+    '<img src="http://example.com/photo.jpg" alt="" />',
+])
+def test_other_images_are_left_alone(pillow, html):
+    assert plantagenet.add_responsive_images(html) == html
+
+
+def test_nothing_is_rewritten_without_pillow(monkeypatch):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', False)
+    html = '<img src="/media/{}.jpg" alt="" />'.format(SHA)
+
+    assert plantagenet.add_responsive_images(html) == html
+
+
+def test_post_html_is_rewritten_when_saved(ctx, pillow):
+    post = plantagenet.Post(
+        'Title', 'Intro ![photo](/media/{}.jpg)\n\n<!--more-->\n\nmore'
+        .format(SHA), plantagenet.datetime(2024, 1, 1))
+
+    assert '/media/{}/960.webp 960w'.format(SHA) in str(post.html)
+    assert '/media/{}/960.webp 960w'.format(SHA) in str(post.excerpt)
+
+
+def test_evict_variants_deletes_least_recently_used(media_root):
+    now = time.time()
+    old = _write_variant(media_root, 480, data=b'x' * 100, mtime=now - 30)
+    middle = _write_variant(media_root, 960, data=b'x' * 100,
+                            mtime=now - 20)
+    new = _write_variant(media_root, 1440, data=b'x' * 100, mtime=now - 10)
+
+    deleted = plantagenet.evict_variants(str(media_root), 250)
+
+    assert deleted == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(middle) and os.path.exists(new)
+    assert plantagenet.evict_variants(str(media_root), 250) == 0
+
+
+def test_touch_variant_is_throttled(media_root):
+    now = time.time()
+    stale = _write_variant(media_root, 480, mtime=now - 2 * 60 * 60)
+    fresh = _write_variant(media_root, 960, mtime=now - 60)
+
+    plantagenet.touch_variant(stale)
+    plantagenet.touch_variant(fresh)
+
+    assert os.stat(stale).st_mtime >= now
+    assert os.stat(fresh).st_mtime == pytest.approx(now - 60)
+
+
+def test_missing_variant_redirects_and_is_queued(cl, media_root, submitted):
+    _media()
+
+    response = cl.get('/media/{}/960.webp'.format(SHA))
+
+    assert response.status_code == 302
+    assert response.location == '/media/{}.jpg'.format(SHA)
+    assert response.cache_control.no_store
+    assert submitted == [SHA]
+
+
+def test_cached_variant_is_served(cl, media_root, submitted, queries):
+    path = _write_variant(media_root, 960, 'webp',
+                          mtime=time.time() - 2 * 60 * 60)
+    del queries[:]
+
+    response = cl.get('/media/{}/960.webp'.format(SHA))
+
+    assert response.status_code == 200
+    assert response.data == b'variant'
+    assert response.mimetype == 'image/webp'
+    assert response.cache_control.immutable
+    assert not [q for q in queries if 'media' in q]
+    assert os.stat(path).st_mtime > time.time() - 60
+    assert submitted == []
+
+
+@pytest.mark.parametrize('url', [
+    '/media/{}/960.webp'.format('cd' * 32),
+    '/media/{}/961.webp'.format(SHA),
+    '/media/{}/960.gif'.format(SHA),
+])
+def test_unknown_variant_returns_404(cl, media_root, submitted, url):
+    _media()
+
+    assert cl.get(url).status_code == 404
+
+
+def test_upload_queues_variants(cl, login, media_root, submitted):
+    login()
+
+    cl.post('/media?filename=photo.jpg', data=b'jpeg data',
+            content_type='image/jpeg')
+    cl.post('/media?filename=copy.jpg', data=b'jpeg data',
+            content_type='image/jpeg')
+
+    assert len(submitted) == 1
+
+
+class FakeExecutor(object):
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def test_pool_queues_each_image_once(ctx, media_root, pillow, monkeypatch):
+    pool = plantagenet.VariantPool(2)
+    pool.executor = FakeExecutor()
+    media = _media()
+
+    assert pool.submit(ctx, media)
+    assert not pool.submit(ctx, media)
+    pool.executor.futures[0].set_result(3)
+    assert pool.submit(ctx, media)
+
+
+def test_pool_queue_is_bounded(ctx, media_root, pillow, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'MEDIA_VARIANT_QUEUE_LIMIT', 1)
+    pool = plantagenet.VariantPool(2)
+    pool.executor = FakeExecutor()
+
+    assert pool.submit(ctx, _media('01' * 32))
+    assert not pool.submit(ctx, _media('02' * 32))
+
+
+@pytest.mark.parametrize('workers, pillow_installed, filename', [
+    (0, True, 'photo.jpg'),
+    (2, False, 'photo.jpg'),
+    (2, True, 'animation.gif'),
+])
+def test_pool_skips(ctx, media_root, monkeypatch, workers, pillow_installed,
+                    filename):
+    monkeypatch.setattr(plantagenet, 'HAVE_PILLOW', pillow_installed)
+    pool = plantagenet.VariantPool(workers)
+    pool.executor = FakeExecutor()
+
+    assert not pool.submit(ctx, _media(filename=filename))
+
+
+def test_generate_variants(ctx, media_root):
+    Image = pytest.importorskip('PIL.Image')
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 600), 'red').save(buffer, 'JPEG')
+    media, _ = Media.store(io.BytesIO(buffer.getvalue()), 'red.jpg',
+                           'image/jpeg', str(media_root))
+
+    written = plantagenet.generate_variants(
+        str(media_root), media.sha256, ('webp', 'jpg'), 10 ** 9)
+
+    assert written == 8
+    path = plantagenet.variant_path(str(media_root), media.sha256, 480,
+                                    'webp')
+    with Image.open(path) as variant:
+        assert variant.size == (480, 240)
+    path = plantagenet.variant_path(str(media_root), media.sha256, 1920,
+                                    'jpg')
+    with Image.open(path) as variant:
+        assert variant.size == (1200, 600)
+    assert plantagenet.generate_variants(
+        str(media_root), media.sha256, ('webp', 'jpg'), 10 ** 9) == 0
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+
+import plantagenet
+
+
+@pytest.fixture
+def metrics_app(make_app):
+    return make_app(METRICS=True)
+
+
+def test_metrics_404_when_disabled(cl):
+    response = cl.get('/metrics')
+
+    assert response.status_code == 404
+
+
+def test_metrics_reports_requests_by_endpoint(metrics_app):
+    cl = metrics_app.test_client()
+    cl.get('/')
+    cl.get('/')
+    cl.get('/post/missing')
+
+    response = cl.get('/metrics')
+
+    assert response.status_code == 200
+    text = response.data.decode('utf-8')
+    assert ('plantagenet_requests_total{endpoint="index",status="200"} 2'
+            in text)
+    assert ('plantagenet_requests_total{endpoint="get_post",status="404"} 1'
+            in text)
+    assert ('plantagenet_request_duration_seconds_count{endpoint="index"} 2'
+            in text)
+    assert '# TYPE plantagenet_request_duration_seconds histogram' in text
+    assert 'plantagenet_db_query_duration_seconds_count' in text
+
+
+def test_metrics_reports_cache_hits(metrics_app):
+    cl = metrics_app.test_client()
+    cl.get('/archive')
+    cl.get('/archive')
+
+    text = cl.get('/metrics').data.decode('utf-8')
+
+    assert ('plantagenet_cache_requests_total{cache="archive",result="hit"} 1'
+            in text)
+    assert ('plantagenet_cache_requests_total{cache="archive",result="miss"}'
+            ' 1' in text)
+
+
+def test_observe_fills_buckets():
+    metrics = plantagenet.Metrics(enabled=True)
+
+    metrics.observe('m', (), 0.02)
+
+    counters = metrics.snapshot()
+    assert ('m_bucket', (('le', '0.01'),)) not in counters
+    assert counters[('m_bucket', (('le', '0.025'),))] == 1
+    assert counters[('m_bucket', (('le', '+Inf'),))] == 1
+    assert counters[('m_count', ())] == 1
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = plantagenet.Metrics(enabled=False)
+
+    metrics.inc('m')
+
+    assert metrics.snapshot() == {}
+
+
+def test_finished_threads_are_folded_into_one_shard():
+    metrics = plantagenet.Metrics(enabled=True)
+
+    for _ in range(20):
+        thread = threading.Thread(target=metrics.inc, args=('m',))
+        thread.start()
+        thread.join()
+    metrics.inc('m')
+
+    assert metrics.snapshot() == {('m', ()): 21}
+    assert len(metrics._shards) == 1
+
+
+def test_collect_adds_up_processes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # given a snapshot written by another worker process
+        with open(os.path.join(tmpdir, 'metrics-1.json'), 'w') as f:
+            json.dump({'counters': [['m', [['a', 'b']], 2]],
+                       'gauges': []}, f)
+        metrics = plantagenet.Metrics(enabled=True, directory=tmpdir)
+        metrics.inc('m', (('a', 'b'),), 3)
+
+        # when
+        counters, gauges = metrics.collect()
+
+        # then the counters of both processes are summed
+        assert counters[('m', (('a', 'b'),))] == 5
+        # and this process's snapshot was written to the directory
+        assert os.path.exists(os.path.join(
+            tmpdir, 'metrics-{}.json'.format(os.getpid())))
@@ -0,0 +1,168 @@
+import random
+
+import pytest
+
+import plantagenet
+
+
+DOCUMENT = ('# Title\n\nFirst *paragraph*.\n\n'
+            '```python\nx = 1\n\ny = 2\n```\n\nLast paragraph.\n')
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """The markdown passed to render_gfm during the test."""
+    calls = []
+    original = plantagenet.render_gfm
+
+    def counting_render_gfm(s):
+        calls.append(s)
+        return original(s)
+
+    monkeypatch.setattr(plantagenet, 'render_gfm', counting_render_gfm)
+    return calls
+
+
+def _html(blocks):
+    return ''.join(block['html'] for block in blocks)
+
+
+@pytest.mark.parametrize('content', [
+    DOCUMENT,
+    '- a\n- b\n\nc',
+    '- a\n\n  b\n\n- c\n\nd\n',
+    '1. one\n\n2. two\n\ntext',
+    '<!--\n\ncomment\n-->\n\npara',
+    '~~~\na\n\n~~~\n\n> quote\n\n> another\n\n    code\n\n    more\n',
+    'text\r\n\r\nmore\r\n',
+])
+def test_blocks_render_like_the_whole_document(content):
+    blocks = plantagenet.split_markdown_blocks(content)
+
+    assert ''.join(blocks) == content
+    assert ''.join(str(plantagenet.render_gfm(b)) for b in blocks) == \
+        str(plantagenet.render_gfm(content))
+
+
+def test_blocks_render_like_generated_documents():
+    rnd = random.Random(3)
+    for _ in range(20):
+        content = plantagenet.generate_markdown(rnd, rnd.randint(1, 30))
+        blocks = plantagenet.split_markdown_blocks(content)
+        assert ''.join(str(plantagenet.render_gfm(b)) for b in blocks) == \
+            str(plantagenet.render_gfm(content))
+
+
+def test_fenced_code_is_not_split():
+    blocks = plantagenet.split_markdown_blocks(DOCUMENT)
+
+    assert blocks == ['# Title\n\n', 'First *paragraph*.\n\n',
+                      '```python\nx = 1\n\ny = 2\n```\n\n',
+                      'Last paragraph.\n']
+
+
+def test_preview_requires_login(cl):
+    response = cl.post('/preview', json={'content': 'x'})
+
+    assert response.status_code == 401
+
+
+def test_preview_content(cl, login):
+    login()
+
+    response = cl.post('/preview', json={'content': DOCUMENT})
+
+    assert response.status_code == 200
+    blocks = response.json['blocks']
+    assert len(blocks) == 4
+    assert _html(blocks) == str(plantagenet.render_gfm(DOCUMENT))
+    assert [b['length'] for b in blocks] == [
+        len(b) for b in plantagenet.split_markdown_blocks(DOCUMENT)]
+
+
+def test_preview_delta_only_renders_changed_block(cl, login, renders):
+    login()
+    first = cl.post('/preview', json={'content': DOCUMENT}).json['blocks']
+    del renders[:]
+
+    # when the second paragraph is edited and the others sent by hash
+    response = cl.post('/preview', json={'blocks': [
+        {'hash': first[0]['hash']},
+        'Second *paragraph*.\n\n',
+        {'hash': first[2]['hash']},
+        {'hash': first[3]['hash']},
+    ]})
+
+    # then
+    assert renders == ['Second *paragraph*.\n\n']
+    blocks = response.json['blocks']
+    assert [b['hash'] for b in blocks[2:]] == [
+        first[2]['hash'], first[3]['hash']]
+    assert 'html' not in blocks[0]
+    assert blocks[1]['html'] == '<p>Second <em>paragraph</em>.</p>\n'
+    assert 'html' not in blocks[2]
+
+
+def test_preview_is_cached_by_content_hash(cl, login, renders):
+    login()
+    cl.post('/preview', json={'content': DOCUMENT})
+    del renders[:]
+
+    response = cl.post('/preview', json={'content': DOCUMENT})
+
+    assert renders == []
+    assert _html(response.json['blocks']) == \
+        str(plantagenet.render_gfm(DOCUMENT))
+
+
+def test_lru_cache_is_bounded_by_weight():
+    cache = plantagenet.LRUCache(10, maxweight=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+
+    # when
+    cache.put('c', 'xxxx')
+    cache.put('huge', 'x' * 11)
+
+    # then the oldest entry is evicted, and the oversized one never stored
+    assert cache.get('a') is None
+    assert cache.get('b') == 'xxxx'
+    assert cache.get('huge') is None
+    assert cache.weight == 8
+
+
+def test_preview_unknown_hash(cl, login):
+    login()
+
+    response = cl.post('/preview', json={'blocks': [{'hash': 'nope'}, 'x']})
+
+    assert response.status_code == 409
+    assert response.json == {'missing': ['nope']}
+
+
+def test_preview_with_definitions_renders_whole_document(cl, login):
+    login()
+    content = 'See [the docs][docs].\n\n[docs]: http://example.com/\n'
+
+    response = cl.post('/preview', json={'content': content})
+
+    assert response.json == {'html': str(plantagenet.render_gfm(content))}
+    assert 'href="http://example.com/"' in response.json['html']
+
+
+def test_preview_lengths_are_utf16(cl, login):
+    login()
+
+    response = cl.post('/preview', json={'content': 'a \U0001F600\n\nb'})
+
+    assert [b['length'] for b in response.json['blocks']] == [6, 1]
+
+
+@pytest.mark.parametrize('body', [
+    {}, {'content': 1}, {'blocks': [1]}, {'blocks': [{'hash': 1}]}])
+def test_preview_bad_request(cl, login, body):
+    login()
+
+    response = cl.post('/preview', json=body)
+
+    assert response.status_code == 400
@@ -0,0 +1,109 @@
+import marshal
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app
+
+
+def _add_post():
+    post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
+    app.db.session.add(post)
+    app.db.session.commit()
+    return post
+
+
+def _count_profiles():
+    return app.db.session.execute(
+        app.db.select(app.db.func.count(plantagenet.Profile.id))).scalar()
+
+
+def test_profile_param_ignored_for_anonymous_users(cl):
+    post = _add_post()
+
+    response = cl.get('/post/{}?__profile=1'.format(post.slug))
+
+    assert response.status_code == 200
+    assert b'My Post' in response.data
+    assert _count_profiles() == 0
+
+
+def test_profile_param_returns_report(cl, login):
+    post = _add_post()
+    login()
+
+    response = cl.get('/post/{}?__profile=1'.format(post.slug))
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert b'get_post' in response.data
+    assert b'cumulative' in response.data
+    assert _count_profiles() == 1
+
+
+def test_profile_header_returns_pstats(cl, login):
+    login()
+
+    response = cl.get('/', headers={'X-Plantagenet-Profile': 'pstats'})
+
+    assert response.status_code == 200
+    assert 'attachment' in response.headers['Content-Disposition']
+    stats = marshal.loads(response.data)
+    assert any(func[2] == 'index' for func in stats)
+
+
+def test_profiles_are_listed_on_admin_page(cl, login):
+    login()
+    cl.get('/tags?__profile=1')
+
+    response = cl.get('/admin')
+
+    assert b'GET /tags?__profile=1' in response.data
+
+
+def test_profile_history_is_bounded(cl, login, monkeypatch):
+    monkeypatch.setitem(cl.application.config, 'PROFILE_HISTORY', 2)
+    login()
+
+    for _ in range(4):
+        cl.get('/?__profile=1')
+
+    assert _count_profiles() == 2
+
+
+def test_profile_of_missing_page_is_kept(cl, login):
+    login()
+
+    response = cl.get('/post/missing?__profile=1')
+
+    assert response.status_code == 200
+    assert _count_profiles() == 1
+
+
+def test_get_profile_requires_login(cl):
+    response = cl.get('/admin/profiles/1')
+
+    assert response.status_code == 401
+
+
+def test_profile_of_post_request_is_refused(cl, login):
+    post = _add_post()
+    login()
+
+    response = cl.post('/edit/{}?__profile=1'.format(post.slug), data={
+        'title': 'Changed', 'content': 'changed', 'notes': '', 'tags': ''})
+
+    assert response.status_code == 405
+    app.db.session.refresh(post)
+    assert post.title == 'My Post'
+    assert _count_profiles() == 0
+
+
+def test_profile_history_must_keep_a_profile():
+    assert plantagenet.positive_int('3') == 3
+    for value in ('0', '-1'):
+        with pytest.raises(ValueError):
+            plantagenet.positive_int(value)
+    with pytest.raises(plantagenet.ConfigError):
+        plantagenet.create_app({'PROFILE_HISTORY': 0})
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import app
+
+# The maximum number of SQL statements each route may issue. The fixture data
+# has several posts per tag and several tags per post, so a query issued once
+# per post or per tag (N+1) exceeds the budget.
+BUDGETS = {
+    'index': 5,
+    'get_post': 7,
+    'list_tags': 4,
+    'get_tag': 5,
+    'list_pages': 4,
+    'view_page': 4,
+    'archive': 5,
+    'archive_month': 4,
+    'edit_post': 6,
+    'post_revisions': 5,
+    'post_revision': 8,
+    'admin': 5,
+    'media_library': 4,
+}
+
+AUTHENTICATED = {'edit_post', 'post_revisions', 'post_revision', 'admin',
+                 'media_library'}
+
+
+@pytest.fixture
+def urls(ctx):
+    tags = [plantagenet.Tag('tag{}'.format(i)) for i in range(4)]
+    posts = []
+    for i in range(8):
+        post = plantagenet.Post('Post {}'.format(i), 'content',
+                                datetime(2017, 1, 1 + i), is_draft=(i == 3))
+        post.tags.extend(tags[i % 2:i % 2 + 3])
+        app.db.session.add(post)
+        posts.append(post)
+    for i in range(3):
+        app.db.session.add(plantagenet.Page('Page {}'.format(i), 'content',
+                                            datetime(2017, 1, 1)))
+    app.db.session.commit()
+    post = posts[4]
+    return {
+        'index': '/',
+        'get_post': '/post/{}'.format(post.slug),
+        'list_tags': '/tags',
+        'get_tag': '/tags/{}'.format(tags[1].id),
+        'list_pages': '/page',
+        'view_page': '/page/page-0',
+        'archive': '/archive',
+        'archive_month': '/archive/2017/1',
+        'edit_post': '/edit/{}'.format(post.slug),
+        'post_revisions': '/post/{}/revisions'.format(post.slug),
+        'post_revision': '/post/{}/revisions/1'.format(post.slug),
+        'admin': '/admin',
+        'media_library': '/media',
+    }
+
+
+@pytest.mark.parametrize('endpoint', sorted(BUDGETS))
+@pytest.mark.parametrize('authenticated', [False, True])
+def test_route_query_budget(cl, login, queries, urls, endpoint,
+                            authenticated):
+    if endpoint in AUTHENTICATED and not authenticated:
+        pytest.skip('route requires login')
+    if authenticated:
+        login()
+    del queries[:]
+
+    # when
+    response = cl.get(urls[endpoint])
+
+    # then
+    assert response.status_code == 200
+    budget = BUDGETS[endpoint]
+    assert len(queries) <= budget, (
+        '{} issued {} queries, over its budget of {}:\n{}'.format(
+            endpoint, len(queries), budget, '\n'.join(queries)))
+
+
+def test_every_route_has_a_budget(ctx):
+    # routes without a budget have no content queries to speak of, or are
+    # covered by the budget of the view they share a template with
+    exempt = {'static', 'login', 'logout', 'create_new', 'create_new_page',
+              'edit_page', 'get_page', 'get_metrics', 'get_profile',
+              'download_profile', 'admin_tags', 'preview', 'autosave_post',
+              'promote_post', 'page_revisions', 'page_revision',
+              'upload_media', 'get_media', 'get_media_variant'}
+    endpoints = {rule.endpoint for rule in ctx.url_map.iter_rules()}
+    assert endpoints - exempt <= set(BUDGETS)
@@ -0,0 +1,271 @@
+from datetime import datetime
+import random
+
+import pytest
+
+import plantagenet
+from plantagenet import app, Revision
+
+
+def _edit(document, contents):
+    for content in contents:
+        document.content = content
+        document.save()
+    # as the job workers would
+    while plantagenet.run_next_job() is not None:
+        pass
+
+
+def _contents(n, seed=0):
+    rnd = random.Random(seed)
+    lines = ['line {}\n'.format(i) for i in range(50)]
+    contents = []
+    for _ in range(n):
+        i = rnd.randrange(len(lines))
+        lines[i] = 'changed {}\n'.format(rnd.random())
+        if rnd.random() < 0.3:
+            lines.insert(i, 'inserted\n')
+        contents.append(''.join(lines))
+    return contents
+
+
+def test_diff_round_trip():
+    rnd = random.Random(1)
+    for _ in range(50):
+        old = plantagenet.generate_markdown(rnd, rnd.randint(0, 5))
+        new = plantagenet.generate_markdown(rnd, rnd.randint(0, 5))
+        for a, b in ((old, new), (old, old + new), ('', new), (old, ''),
+                     ('a\r\nb', 'a\nb\r\n')):
+            assert plantagenet.patch_content(
+                a, plantagenet.diff_content(a, b)) == b
+
+
+def test_skip_delta_chain_is_logarithmic():
+    assert plantagenet.skip_delta_chain(1, 1) == [1]
+    assert plantagenet.skip_delta_chain(1, 8) == [1, 5, 7, 8]
+    assert plantagenet.skip_delta_chain(33, 64) == [33, 49, 57, 61, 63, 64]
+    for number in range(2, 33):
+        assert len(plantagenet.skip_delta_chain(1, number)) <= 6
+
+
+def test_creating_a_post_records_a_snapshot(ctx, make_post):
+    post = make_post(content='line 1\nline 2\n')
+
+    revisions = list(Revision.list_for(post))
+
+    assert [(r.number, r.base, r.title) for r in revisions] == \
+        [(1, None, 'My Post')]
+    assert Revision.load(post, 1)[1] == 'line 1\nline 2\n'
+
+
+def test_every_revision_is_rebuilt(ctx, make_post):
+    post = make_post()
+    contents = [post.content] + _contents(100)
+    _edit(post, contents[1:])
+
+    for number, content in enumerate(contents, 1):
+        revision, loaded = Revision.load(post, number)
+        assert revision.number == number
+        assert loaded == content
+    assert Revision.load(post, 102) == (None, None)
+
+
+def test_revisions_are_mostly_deltas(ctx, make_post):
+    contents = _contents(100)
+    post = make_post(content=contents[0])
+    _edit(post, contents[1:])
+
+    revisions = list(Revision.list_for(post))
+
+    snapshots = [r.number for r in revisions if r.base is None]
+    assert sorted(snapshots) == [1, 33, 65, 97]
+    assert all(r.base is None or r.number - r.base >= 1 for r in revisions)
+
+
+def test_load_fetches_a_bounded_number_of_rows(ctx, queries, make_post):
+    post = make_post()
+    _edit(post, _contents(40))
+    post_id = post.id
+    del queries[:]
+
+    Revision.load(post, 31)
+
+    assert len(queries) == 2
+    assert post.id == post_id
+
+
+def test_rewrite_snapshot_when_delta_is_larger(ctx, make_post):
+    post = make_post(content='a\n' * 100)
+    _edit(post, ['b' * 300])
+
+    revision = Revision.load(post, 2)[0]
+
+    assert revision.base is None
+
+
+def test_long_documents_are_stored_in_full(ctx, monkeypatch, make_post):
+    monkeypatch.setattr(plantagenet, 'REVISION_DIFF_MAX_LINES', 10)
+    monkeypatch.setattr(plantagenet, 'diff_content', None)
+    post = make_post(content='line\n' * 11)
+    _edit(post, ['line\n' * 12])
+
+    assert [r.base for r in Revision.list_for(post)] == [None, None]
+    assert Revision.load(post, 2)[1] == 'line\n' * 12
+
+
+def test_unchanged_content_records_nothing(ctx, make_post):
+    post = make_post()
+    post.content = post.content
+    post.notes = 'notes'
+    post.is_draft = True
+    post.save()
+
+    assert [r.number for r in Revision.list_for(post)] == [1]
+
+
+def test_title_change_is_recorded(ctx, make_post):
+    post = make_post()
+    post.title = 'New Title'
+    post.save()
+
+    revision, content = Revision.load(post, 2)
+
+    assert revision.title == 'New Title'
+    assert content == post.content
+
+
+def test_document_without_history_records_previous_version(ctx, make_post):
+    post = make_post(content='old')
+    app.db.session.execute(app.db.delete(Revision))
+    app.db.session.commit()
+
+    _edit(post, ['new'])
+
+    assert Revision.load(post, 1)[1] == 'old'
+    assert Revision.load(post, 2)[1] == 'new'
+
+
+def test_pages_have_their_own_history(ctx, make_post):
+    post = make_post(content='post content')
+    page = plantagenet.Page('My Page', 'page content', datetime(2024, 1, 1))
+    page.save()
+    _edit(page, ['page content 2'])
+
+    assert Revision.load(page, 2)[1] == 'page content 2'
+    assert Revision.load(post, 2) == (None, None)
+    assert Revision.load(post, 1)[1] == 'post content'
+
+
+def test_prune_keeps_the_newest_revisions(ctx, make_post):
+    post = make_post()
+    contents = _contents(60)
+    _edit(post, contents)
+    page = plantagenet.Page('My Page', 'content', datetime(2024, 1, 1))
+    page.save()
+
+    deleted = Revision.prune(10)
+    app.db.session.commit()
+
+    assert deleted == 51
+    revisions = list(Revision.list_for(post))
+    assert [r.number for r in revisions] == list(range(61, 51, -1))
+    assert revisions[-1].base is None
+    for number, content in zip(range(52, 62), contents[-10:]):
+        assert Revision.load(post, number)[1] == content
+    assert [r.number for r in Revision.list_for(page)] == [1]
+
+
+def test_history_continues_after_prune(ctx, make_post):
+    contents = _contents(21)
+    post = make_post(content=contents[0])
+    _edit(post, contents[1:20])
+    Revision.prune(3)
+    app.db.session.commit()
+
+    _edit(post, contents[20:])
+
+    assert Revision.load(post, 21)[1] == contents[20]
+    assert Revision.load(post, 21)[0].base == 20
+    assert Revision.load(post, 22) == (None, None)
+
+
+def test_prune_requires_keeping_a_revision(ctx):
+    with pytest.raises(plantagenet.BadRequest):
+        Revision.prune(0)
+
+
+def test_compact_reencodes_every_history(ctx, monkeypatch, make_post):
+    contents = _contents(21)
+    post = make_post(content=contents[0])
+    _edit(post, contents[1:])
+    monkeypatch.setattr(plantagenet, 'REVISION_SNAPSHOT_INTERVAL', 4)
+
+    count, before, after = Revision.compact()
+    app.db.session.commit()
+
+    assert count == 1
+    assert after > before
+    snapshots = [r.number for r in Revision.list_for(post) if r.base is None]
+    assert sorted(snapshots) == [1, 5, 9, 13, 17, 21]
+    for number, content in enumerate(contents, 1):
+        assert Revision.load(post, number)[1] == content
+
+
+def test_revisions_require_login(cl, make_post):
+    post = make_post()
+
+    assert cl.get('/post/{}/revisions'.format(post.slug)).status_code == 401
+    assert cl.get('/post/{}/revisions/1'.format(post.slug)).status_code == \
+        401
+
+
+def test_list_revisions(cl, login, make_post):
+    post = make_post(content='line 1\nline 2\n')
+    login()
+    _edit(post, ['line 1\nline two\n'])
+
+    response = cl.get('/post/{}/revisions'.format(post.slug))
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '/post/{}/revisions/2'.format(post.slug) in html
+    assert '/post/{}/revisions/1'.format(post.slug) in html
+
+
+def test_show_revision_with_diff(cl, login, make_post):
+    post = make_post(content='line 1\nline 2\n')
+    login()
+    _edit(post, ['line 1\nline two\n', 'line 1\nline 3\n'])
+
+    response = cl.get('/post/{}/revisions/2'.format(post.slug))
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert '<span class="diff-removed">-line 2</span>' in html
+    assert '<span class="diff-added">+line two</span>' in html
+    assert '/post/{}/revisions/1'.format(post.slug) in html
+    assert '/post/{}/revisions/3'.format(post.slug) in html
+
+
+@pytest.mark.parametrize('url', [
+    '/post/nonexistent/revisions',
+    '/post/nonexistent/revisions/1',
+    '/post/my-post/revisions/2',
+    '/page/nonexistent/revisions',
+])
+def test_revisions_404(cl, login, url, make_post):
+    make_post()
+    login()
+
+    assert cl.get(url).status_code == 404
+
+
+def test_page_revisions(cl, login):
+    page = plantagenet.Page('My Page', 'content', datetime(2024, 1, 1))
+    page.save()
+    login()
+
+    assert cl.get('/page/my-page/revisions').status_code == 200
+    response = cl.get('/page/my-page/revisions/1')
+    assert response.status_code == 200
+    assert 'content' in response.get_data(as_text=True)
@@ -0,0 +1,29 @@
+import json
+import os
+import tempfile
+
+import benchmark
+
+
+def test_benchmark_writes_results_for_every_get_route():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'results.json')
+
+        # when
+        benchmark.main(['--scales', '30', '--repeat', '2',
+                        '--sqlite-path', os.path.join(tmpdir, 'b.sqlite'),
+                        '--output', output])
+
+        # then
+        with open(output) as f:
+            report = json.load(f)
+    result, = report['results']
+    assert result['backend'] == 'sqlite'
+    assert result['scale'] == 30
+    for endpoint in ('index', 'get_post', 'list_tags', 'get_tag',
+                     'list_pages', 'view_page', 'edit_post', 'admin'):
+        assert result['routes'][endpoint]['status'] == 200
+        assert result['routes'][endpoint]['queries'] > 0
+    assert result['routes']['edit_post']['authenticated']
+    assert set(result['functions']) >= {
+        'summarize_small', 'render_gfm_small', 'tags_from_string'}
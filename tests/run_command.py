@@ -11,12 +11,37 @@ def _fake_args(**kwargs):
         create_db=False,
         hash_password=None,
         count_posts=False,
+        generate_posts=None,
+        generate_tags=50,
+        generate_paragraphs=5,
+        generate_draft_ratio=0.1,
+        generate_pages=0,
+        generate_batch_size=5000,
+        generate_seed=None,
+        import_markdown=None,
+        export_jsonl=None,
+        rename_tag=None,
+        merge_tags=None,
+        delete_orphan_tags=False,
+        reconcile_tag_counts=False,
+        prune_revisions=None,
+        compact_revisions=False,
+        generate_media_variants=False,
+        import_jsonl=None,
+        import_batch_size=500,
+        import_workers=None,
         reset_slug=None,
         set_date=None,
         set_last_updated_date=None,
         reset_summary=None,
+        reset_summary_batch_size=500,
+        reset_summary_workers=None,
         set_option=None,
         clear_option=None,
+        batch=None,
+        batch_size=1000,
+        enqueue_job=None,
+        worker=False,
     )
     defaults.update(kwargs)
     return types.SimpleNamespace(**defaults)
@@ -42,6 +67,102 @@ def test_run_count_posts(ctx, monkeypatch):
     plantagenet.run()
 
 
+def test_run_generate_posts(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, generate_posts=25, generate_tags=5,
+              generate_pages=2, generate_batch_size=10, generate_seed=1)
+    plantagenet.run()
+    c = app.db.session.execute(
+        app.db.select(app.db.func.count(plantagenet.Post.id))).scalar()
+    assert c == 25
+
+
+def test_run_merge_tags(ctx, monkeypatch):
+    from datetime import datetime
+    post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
+    post.tags.append(plantagenet.Tag('Python'))
+    app.db.session.add(post)
+    app.db.session.commit()
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, merge_tags=['python', 'Python'])
+    plantagenet.run()
+    app.db.session.expire_all()
+    assert [t.name for t in post.tags] == ['python']
+
+
+def test_run_merge_tags_missing(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, merge_tags=['python', 'missing'])
+    with pytest.raises(SystemExit):
+        plantagenet.run()
+
+
+def test_run_reconcile_tag_counts(ctx, monkeypatch):
+    tag = plantagenet.Tag('tag')
+    app.db.session.add(tag)
+    app.db.session.commit()
+    app.db.session.execute(app.db.update(plantagenet.Tag).values(
+        total_count=3))
+    app.db.session.commit()
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, reconcile_tag_counts=True)
+    plantagenet.run()
+    app.db.session.expire_all()
+    assert tag.total_count == 0
+
+
+def test_run_prune_and_compact_revisions(ctx, monkeypatch):
+    from datetime import datetime
+    post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
+    post.save()
+    for i in range(3):
+        post.content = 'content {}'.format(i)
+        post.save()
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, prune_revisions=2)
+    plantagenet.run()
+    _set_args(monkeypatch, compact_revisions=True)
+    plantagenet.run()
+    assert [r.number for r in plantagenet.Revision.list_for(post)] == [4, 3]
+
+
+def test_run_prune_revisions_keeping_none_exits(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, prune_revisions=0)
+    with pytest.raises(SystemExit):
+        plantagenet.run()
+
+
+def test_run_batch(ctx, monkeypatch, tmp_path):
+    from datetime import datetime
+    post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
+    app.db.session.add(post)
+    app.db.session.commit()
+    script = tmp_path / 'script.txt'
+    script.write_text('set-date {} 2020-01-01\n'.format(post.id))
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, batch=str(script))
+    plantagenet.run()
+    app.db.session.expire_all()
+    assert post.date == datetime(2020, 1, 1)
+
+
+def test_run_batch_failure(ctx, monkeypatch, tmp_path):
+    script = tmp_path / 'script.txt'
+    script.write_text('reset-summary 9999\n')
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, batch=str(script))
+    with pytest.raises(SystemExit):
+        plantagenet.run()
+
+
+def test_run_reset_summary_all(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, reset_summary='all', reset_summary_batch_size=2,
+              reset_summary_workers=2)
+    plantagenet.run()
+
+
 def test_run_reset_slug(ctx, monkeypatch):
     from datetime import datetime
     post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
@@ -81,3 +202,20 @@ def test_run_clear_option_not_found(ctx, monkeypatch):
     _set_args(monkeypatch, clear_option='nonexistent')
     with pytest.raises(SystemExit):
         plantagenet.run()
+
+
+def test_run_enqueue_job(ctx, monkeypatch, capsys):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, enqueue_job=['set-option', 'name', 'value'])
+    plantagenet.run()
+    plantagenet.run()
+    out = capsys.readouterr().out
+    assert 'Queued set-option name value' in out
+    assert 'An identical job is already queued' in out
+
+
+def test_run_enqueue_job_unknown(ctx, monkeypatch):
+    monkeypatch.setattr(plantagenet, 'app', ctx)
+    _set_args(monkeypatch, enqueue_job=['missing'])
+    with pytest.raises(SystemExit):
+        plantagenet.run()
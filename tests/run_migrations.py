@@ -58,3 +58,58 @@ def test_run_migrations_rollback_on_error(monkeypatch):
         engine = create_engine('sqlite://')
         with pytest.raises(Exception):
             plantagenet.run_migrations(engine)
+
+
+def test_column_already_added(ctx):
+    with app.db.engine.connect() as conn:
+        assert plantagenet.column_already_added(
+            conn, 'ALTER TABLE post ADD COLUMN content_html TEXT')
+        assert plantagenet.column_already_added(
+            conn, '-- comment\nalter table post add content_html TEXT')
+        assert not plantagenet.column_already_added(
+            conn, 'ALTER TABLE post ADD COLUMN something_new TEXT')
+        assert not plantagenet.column_already_added(
+            conn, 'CREATE INDEX ix ON post (date)')
+
+
+def test_tags_posts_migration_dedupes_and_adds_primary_key():
+    engine = create_engine('sqlite://')
+    plantagenet.db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # given the table as it was before v0.7, with duplicate rows
+        conn.execute(text('DROP TABLE tags_posts'))
+        conn.execute(text('CREATE TABLE tags_posts (tag_id INTEGER, '
+                          'post_id INTEGER)'))
+        conn.execute(text("INSERT INTO tag (id, name) VALUES (1, 'a')"))
+        conn.execute(text(
+            "INSERT INTO post (id, last_updated_date, is_draft) "
+            "VALUES (1, '2017-01-01', 0), (2, '2017-01-01', 0)"))
+        conn.execute(text('INSERT INTO tags_posts VALUES '
+                          '(1, 1), (1, 1), (1, 2), (NULL, 2)'))
+
+    # when
+    plantagenet.run_migrations(engine)
+
+    # then
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            'SELECT tag_id, post_id FROM tags_posts ORDER BY post_id'))
+        assert rows.fetchall() == [(1, 1), (1, 2)]
+        with pytest.raises(Exception):
+            conn.execute(text('INSERT INTO tags_posts VALUES (1, 1)'))
+
+
+def test_tags_posts_joins_use_covering_indexes(ctx):
+    with app.db.engine.connect() as conn:
+        by_post = conn.execute(text(
+            'EXPLAIN QUERY PLAN SELECT tag.name FROM tag JOIN tags_posts '
+            'ON tag.id = tags_posts.tag_id WHERE tags_posts.post_id = 1'
+        )).fetchall()
+        by_tag = conn.execute(text(
+            'EXPLAIN QUERY PLAN SELECT post.title FROM post JOIN tags_posts '
+            'ON post.id = tags_posts.post_id WHERE tags_posts.tag_id = 1'
+        )).fetchall()
+    assert any('COVERING INDEX' in row[3] and 'tags_posts' in row[3]
+               for row in by_post)
+    assert any('COVERING INDEX' in row[3] and 'tags_posts' in row[3]
+               for row in by_tag)
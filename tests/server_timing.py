@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import plantagenet
+from plantagenet import app
+
+
+@pytest.fixture
+def timed_cl(make_app):
+    return make_app(SERVER_TIMING=True).test_client()
+
+
+def _parse(header):
+    entries = {}
+    for entry in header.split(', '):
+        name, *params = entry.split(';')
+        entries[name] = dict(p.split('=', 1) for p in params)
+    return entries
+
+
+def test_no_header_when_disabled(cl):
+    response = cl.get('/')
+
+    assert 'Server-Timing' not in response.headers
+
+
+def test_header_has_total_and_templates(timed_cl):
+    response = timed_cl.get('/')
+
+    entries = _parse(response.headers['Server-Timing'])
+    assert 'total' in entries
+    assert 'tpl' in entries
+    assert float(entries['total']['dur']) >= float(entries['tpl']['dur'])
+
+
+def test_header_counts_queries_and_markdown(timed_cl):
+    post = plantagenet.Post('My Post', '# content', datetime(2024, 1, 1),
+                            notes='# notes')
+    app.db.session.add(post)
+    app.db.session.commit()
+    with timed_cl.session_transaction() as sess:
+        sess['_user_id'] = 'admin'
+        sess['_fresh'] = True
+
+    # when the post is viewed, its stored html is used, and only the notes
+    # are rendered
+    response = timed_cl.get('/post/{}'.format(post.slug))
+
+    entries = _parse(response.headers['Server-Timing'])
+    assert entries['db']['desc'].startswith('"SQL (')
+    assert entries['db']['desc'] != '"SQL (0)"'
+    assert entries['md']['desc'] == '"Markdown (1)"'
+
+
+def test_record_timing_outside_request_is_ignored(ctx):
+    # should not raise
+    plantagenet.record_timing('db', 0.1)
+
+
+def test_failed_query_leaves_no_timing_behind(ctx, monkeypatch):
+    timings = []
+    monkeypatch.setattr(plantagenet, 'record_timing',
+                        lambda name, elapsed: timings.append(name))
+    conn = app.db.session.connection()
+    info = dict(conn.info)
+    with pytest.raises(OperationalError):
+        conn.exec_driver_sql('SELECT * FROM missing')
+
+    conn.exec_driver_sql('SELECT 1')
+
+    assert timings == ['db']
+    assert conn.info == info
@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime
+
+import pytest
+
+import plantagenet
+from plantagenet import db
+
+
+@pytest.fixture
+def slow_app(make_app):
+    return make_app(SLOW_QUERY_THRESHOLD=0)
+
+
+def test_slow_queries_are_logged_with_endpoint_and_request_id(slow_app,
+                                                              caplog):
+    cl = slow_app.test_client()
+
+    with caplog.at_level(logging.WARNING):
+        response = cl.get('/', headers={'X-Request-Id': 'abc123'})
+
+    assert response.headers['X-Request-Id'] == 'abc123'
+    messages = [r.getMessage() for r in caplog.records]
+    assert any('endpoint=index' in m and 'request_id=abc123' in m
+               for m in messages)
+
+
+def test_query_plan_is_logged_once_per_statement(slow_app, caplog):
+    post = plantagenet.Post('My Post', 'content', datetime(2024, 1, 1))
+    db.session.add(post)
+    db.session.commit()
+    cl = slow_app.test_client()
+
+    with caplog.at_level(logging.WARNING):
+        cl.get('/post/{}'.format(post.slug))
+        cl.get('/post/{}'.format(post.slug))
+
+    plans = [r.getMessage() for r in caplog.records
+             if r.getMessage().startswith('Query plan')]
+    assert plans
+    assert len(plans) == len(set(plans))
+    # the next/prev lookups use the post.date index
+    assert any('ix_post_date' in p for p in plans)
+
+
+def test_parameters_are_logged_as_types_only(slow_app, caplog):
+    with caplog.at_level(logging.WARNING):
+        db.session.execute(db.select(plantagenet.Option).filter_by(
+            name='secret-name'))
+
+    messages = [r.getMessage() for r in caplog.records
+                if r.getMessage().startswith('Slow query')]
+    assert messages[-1].endswith('-- parameters: (str)')
+    assert not any('secret-name' in m for m in messages)
+
+
+def test_describe_parameters():
+    assert plantagenet.describe_parameters({'a': 1, 'b': None}, False) == \
+        '(a: int, b: NoneType)'
+    assert plantagenet.describe_parameters([(1,), (2,)], True) == '2 rows'
+
+
+def test_no_log_when_threshold_unset(ctx, caplog):
+    with caplog.at_level(logging.WARNING):
+        ctx.test_client().get('/')
+
+    assert not any('Slow query' in r.getMessage() for r in caplog.records)
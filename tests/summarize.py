@@ -0,0 +1,82 @@
+import random
+import re
+
+import pytest
+
+import plantagenet
+
+
+def reference_summarize(value):
+    # the original four-pass implementation
+    stripped = re.sub(r'</?[^>]+/?>', '', value)
+    cleaned = re.sub(r'[^a-zA-Z01-9,.?!]', ' ', stripped)
+    normalized = re.sub(r'\s*([.,?!])\s*', r'\1 ', cleaned)
+    condensed = re.sub(r'\s+', ' ', normalized)
+    truncated = condensed
+    if len(truncated) > 100:
+        truncated = condensed[:100] + '...'
+    return truncated
+
+
+@pytest.mark.parametrize('value', [
+    '',
+    ' ',
+    'a',
+    ' a ',
+    '.',
+    ' . ',
+    'a . , b',
+    'a.b',
+    'Hello, world! How are you?',
+    '<p>Hello</p>\n<p>world</p>',
+    'a<b>c',
+    'a <b> c',
+    'a<>b',
+    '<>',
+    '</>',
+    '< a',
+    'a < b > c',
+    '<<a>b>',
+    'a<b',
+    'a>b',
+    '. <br/> . x',
+    'x ! <i> </i> , y',
+    'café — naïve',
+    '\t\n\r\x0b\x0c',
+    'a' * 99 + ' ',
+    'a' * 100,
+    'a' * 100 + ' ',
+    'a' * 101,
+    'a' * 99 + '.',
+    'a' * 98 + '. b',
+    'a' * 99 + ' <b>',
+    '# Title\n\nSome *markdown* with `code` and [a link](http://x.y/z).',
+])
+def test_summarize_matches_reference(value):
+    assert plantagenet.Post.summarize(value) == reference_summarize(value)
+
+
+def test_summarize_matches_reference_on_random_input():
+    rnd = random.Random(0)
+    alphabet = 'ab1 ,.?!<>/\n\té-'
+    for _ in range(5000):
+        value = ''.join(rnd.choice(alphabet)
+                        for _ in range(rnd.randint(0, 150)))
+        assert plantagenet.Post.summarize(value) == \
+            reference_summarize(value), repr(value)
+
+
+def test_summarize_matches_reference_on_generated_posts():
+    rnd = random.Random(1)
+    for paragraphs in (1, 2, 5, 50):
+        value = plantagenet.generate_markdown(rnd, paragraphs)
+        assert plantagenet.Post.summarize(value) == \
+            reference_summarize(value)
+        html = str(plantagenet.render_gfm(value))
+        assert plantagenet.Post.summarize(html) == reference_summarize(html)
+
+
+def test_summarize_stops_reading_early():
+    # a very long document only needs its first few tokens
+    value = 'word ' * 100000 + '<unterminated'
+    assert plantagenet.Post.summarize(value) == reference_summarize(value)
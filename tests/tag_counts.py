@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import plantagenet
+from plantagenet import db
+
+
+def _counts(tag):
+    db.session.expire_all()
+    return tag.published_count, tag.total_count
+
+
+def test_new_posts_are_counted(ctx, make_post):
+    tag = plantagenet.Tag('tag')
+    make_post('a', tag)
+    make_post('b', tag, is_draft=True)
+
+    assert _counts(tag) == (1, 2)
+
+
+def test_removing_and_adding_tags(ctx, make_post):
+    tag1 = plantagenet.Tag('tag1')
+    tag2 = plantagenet.Tag('tag2')
+    post = make_post('a', tag1)
+
+    # when
+    post.tags.remove(tag1)
+    post.tags.append(tag2)
+    db.session.commit()
+
+    # then
+    assert _counts(tag1) == (0, 0)
+    assert _counts(tag2) == (1, 1)
+
+
+def test_changing_draft_state(ctx, make_post):
+    tag = plantagenet.Tag('tag')
+    post = make_post('a', tag)
+
+    post.is_draft = True
+    db.session.commit()
+    assert _counts(tag) == (0, 1)
+
+    post.is_draft = False
+    db.session.commit()
+    assert _counts(tag) == (1, 1)
+
+
+def test_deleting_a_post(ctx, make_post):
+    tag = plantagenet.Tag('tag')
+    post = make_post('a', tag)
+    make_post('b', tag)
+
+    db.session.delete(post)
+    db.session.commit()
+
+    assert _counts(tag) == (1, 1)
+
+
+def test_edit_post_updates_counts(cl, login, make_post):
+    old = plantagenet.Tag('old')
+    post = make_post('a', old)
+    login()
+
+    # when the post is made a draft and retagged
+    cl.post('/edit/{}'.format(post.slug), data={
+        'title': 'a', 'content': 'content', 'notes': '',
+        'is_draft': 'on', 'tags': 'new, other'})
+
+    # then
+    assert _counts(old) == (0, 0)
+    new = plantagenet.Tag.get_by_name('new')
+    assert _counts(new) == (0, 1)
+
+
+def test_create_new_updates_counts(cl, login, make_post):
+    tag = plantagenet.Tag('tag')
+    make_post('a', tag)
+    login()
+
+    cl.post('/new', data={'title': 'b', 'content': 'content', 'notes': '',
+                          'tags': 'tag'})
+
+    assert _counts(tag) == (2, 2)
+
+
+def test_reconcile_counts_fixes_drift(ctx, make_post):
+    tag1 = plantagenet.Tag('tag1')
+    tag2 = plantagenet.Tag('tag2')
+    make_post('a', tag1, tag2)
+    make_post('b', tag1, is_draft=True)
+    db.session.execute(db.update(plantagenet.Tag).where(
+        plantagenet.Tag.name == 'tag1').values(published_count=7))
+    db.session.commit()
+
+    # when
+    fixed = plantagenet.Tag.reconcile_counts()
+    db.session.commit()
+
+    # then only the tag that drifted is updated
+    assert fixed == 1
+    assert _counts(tag1) == (1, 2)
+    assert _counts(tag2) == (1, 1)
+
+
+def test_merge_counts_target(ctx, make_post):
+    python = plantagenet.Tag('python')
+    upper = plantagenet.Tag('Python')
+    make_post('a', python, upper)
+    make_post('b', upper, is_draft=True)
+
+    plantagenet.Tag.merge('python', ['Python'])
+
+    assert _counts(python) == (1, 2)
+
+
+def test_generate_posts_counts(ctx):
+    plantagenet.generate_posts(20, num_tags=3, seed=1)
+
+    for tag in db.session.execute(db.select(plantagenet.Tag)).scalars():
+        assert tag.total_count == tag.post_count(include_drafts=True)
+        assert plantagenet.Tag.reconcile_counts([tag.id]) == 0
+
+
+def test_changing_other_columns_does_not_load_tags(ctx, queries, make_post):
+    tag = plantagenet.Tag('tag')
+    post = make_post('a', tag)
+    db.session.expire_all()
+    post = db.session.get(plantagenet.Post, post.id)
+    del queries[:]
+
+    # when
+    post.date = datetime(2018, 1, 1)
+    db.session.commit()
+
+    # then
+    assert not any('tags_posts' in q for q in queries)
+    assert _counts(tag) == (1, 1)
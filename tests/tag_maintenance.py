@@ -0,0 +1,128 @@
+import pytest
+from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import NotFound
+
+import plantagenet
+from plantagenet import db
+
+
+def _tag_names(post):
+    db.session.expire_all()
+    return sorted(t.name for t in post.tags)
+
+
+def _association_count():
+    return db.session.execute(
+        db.select(db.func.count()).select_from(plantagenet.tags_table)
+    ).scalar()
+
+
+def test_rename(ctx, make_post):
+    tag = plantagenet.Tag('pyhton')
+    post = make_post('a', tag)
+
+    plantagenet.Tag.rename('pyhton', 'python')
+
+    assert _tag_names(post) == ['python']
+
+
+def test_rename_to_existing_name_raises(ctx, make_post):
+    make_post('a', plantagenet.Tag('python'), plantagenet.Tag('Python'))
+
+    with pytest.raises(BadRequest):
+        plantagenet.Tag.rename('Python', 'python')
+
+
+def test_rename_missing_raises(ctx):
+    with pytest.raises(NotFound):
+        plantagenet.Tag.rename('missing', 'python')
+
+
+def test_merge_moves_posts_and_dedupes(ctx, make_post):
+    python = plantagenet.Tag('python')
+    upper = plantagenet.Tag('Python')
+    python3 = plantagenet.Tag('python3')
+    other = plantagenet.Tag('other')
+    post1 = make_post('a', python, upper)
+    post2 = make_post('b', upper, python3, other)
+    post3 = make_post('c', python3)
+
+    # when
+    moved = plantagenet.Tag.merge('python', ['Python', 'python3'])
+
+    # then every post has the target tag exactly once
+    assert moved == 2
+    assert _tag_names(post1) == ['python']
+    assert _tag_names(post2) == ['other', 'python']
+    assert _tag_names(post3) == ['python']
+    assert _association_count() == 4
+    # and the source tags are gone
+    assert plantagenet.Tag.get_by_name('Python') is None
+    assert plantagenet.Tag.get_by_name('python3') is None
+
+
+def test_merge_into_new_tag(ctx, make_post):
+    post = make_post('a', plantagenet.Tag('Python'))
+
+    plantagenet.Tag.merge('python', ['Python'])
+
+    assert _tag_names(post) == ['python']
+
+
+def test_merge_missing_source_raises(ctx, make_post):
+    make_post('a', plantagenet.Tag('python'))
+
+    with pytest.raises(NotFound):
+        plantagenet.Tag.merge('python', ['missing'])
+
+
+def test_delete_orphans(ctx, make_post):
+    used = plantagenet.Tag('used')
+    make_post('a', used)
+    db.session.add(plantagenet.Tag('orphan1'))
+    db.session.add(plantagenet.Tag('orphan2'))
+    db.session.commit()
+
+    count = plantagenet.Tag.delete_orphans()
+
+    assert count == 2
+    names = db.session.execute(db.select(plantagenet.Tag.name)).scalars()
+    assert list(names) == ['used']
+
+
+def test_admin_merge(cl, login, make_post):
+    post = make_post('a', plantagenet.Tag('Python'),
+                     plantagenet.Tag('python3'))
+    login()
+
+    response = cl.post('/admin/tags', data={
+        'action': 'merge', 'target': 'python', 'sources': 'Python, python3'})
+
+    assert response.status_code == 302
+    assert _tag_names(post) == ['python']
+
+
+def test_admin_delete_orphans(cl, login):
+    db.session.add(plantagenet.Tag('orphan'))
+    db.session.commit()
+    login()
+
+    cl.post('/admin/tags', data={'action': 'delete_orphans'})
+
+    assert plantagenet.Tag.get_by_name('orphan') is None
+
+
+def test_admin_rename_conflict_returns_400(cl, login, make_post):
+    make_post('a', plantagenet.Tag('a'), plantagenet.Tag('b'))
+    login()
+
+    response = cl.post('/admin/tags', data={
+        'action': 'rename', 'old_name': 'a', 'new_name': 'b'})
+
+    assert response.status_code == 400
+
+
+def test_admin_tags_requires_login(cl):
+    response = cl.post('/admin/tags', data={'action': 'delete_orphans'})
+
+    assert response.status_code == 401
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+import plantagenet
+from plantagenet import db
+
+
+CONTENT = '''# Intro
+
+Some words here.
+
+## Details & *more*
+
+Even more words.
+
+## Details & more
+
+Last.
+'''
+
+
+def test_content_setter_stores_anchors_and_toc(ctx):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+
+    assert post.toc == [[1, 'intro', 'Intro'],
+                        [2, 'details-more', 'Details & more'],
+                        [2, 'details-more-1', 'Details & more']]
+    assert '<h1 id="intro">Intro</h1>' in str(post.html)
+    assert '<h2 id="details-more">Details &amp; <em>more</em></h2>' in \
+        str(post.html)
+    assert '<h2 id="details-more-1">' in str(post.html)
+
+
+def test_word_count_and_reading_time(ctx):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+
+    assert post.word_count == 12
+    assert post.reading_minutes == 1
+
+    post.content = 'word ' * 401
+    assert post.word_count == 401
+    assert post.reading_minutes == 3
+
+
+def test_reading_time_unknown_for_old_rows():
+    assert plantagenet.reading_minutes(None) is None
+
+
+def test_page_content_setter_stores_toc(ctx):
+    page = plantagenet.Page('title', CONTENT, datetime(2017, 1, 1))
+
+    assert [anchor for _, anchor, _ in page.toc] == [
+        'intro', 'details-more', 'details-more-1']
+    assert page.word_count == 12
+    assert '<h1 id="intro">Intro</h1>' in str(page.html)
+
+
+def test_get_post_shows_toc_without_rendering(cl, monkeypatch):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+    db.session.add(post)
+    db.session.commit()
+
+    def fail(s):
+        raise AssertionError('render_gfm called')
+
+    monkeypatch.setattr(plantagenet, 'render_gfm', fail)
+
+    response = cl.get('/post/{}'.format(post.slug))
+
+    assert response.status_code == 200
+    assert b'<a href="#details-more-1">Details &amp; more</a>' in \
+        response.data
+    assert b'1 min read' in response.data
+
+
+def test_view_page_shows_toc_without_rendering(cl, monkeypatch):
+    page = plantagenet.Page('title', CONTENT, datetime(2017, 1, 1))
+    page.slug = 'my-page'
+    db.session.add(page)
+    db.session.commit()
+
+    def fail(s):
+        raise AssertionError('render_gfm called')
+
+    monkeypatch.setattr(plantagenet, 'render_gfm', fail)
+
+    response = cl.get('/page/my-page')
+
+    assert response.status_code == 200
+    assert b'<a href="#intro">Intro</a>' in response.data
+    assert b'<h1 id="intro">Intro</h1>' in response.data
+
+
+def test_single_heading_has_no_toc(cl):
+    post = plantagenet.Post('title', '# Only\n\ntext', datetime(2017, 1, 1))
+    db.session.add(post)
+    db.session.commit()
+
+    response = cl.get('/post/{}'.format(post.slug))
+
+    assert b'class="toc"' not in response.data
+
+
+def test_reset_all_summaries_fills_toc(ctx):
+    post = plantagenet.Post('title', CONTENT, datetime(2017, 1, 1))
+    db.session.add(post)
+    db.session.commit()
+    db.session.execute(db.update(plantagenet.Post).values(
+        toc=None, word_count=None))
+    db.session.commit()
+
+    plantagenet.reset_all_summaries(commit=True)
+
+    db.session.expire_all()
+    assert len(post.toc) == 3
+    assert post.word_count == 12